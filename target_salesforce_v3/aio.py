@@ -0,0 +1,115 @@
+"""Asyncio request engine for writing many records of a stream at once."""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import time
+
+import backoff
+from singer_sdk.exceptions import RetriableAPIError
+
+from target_salesforce_v3.limiter import response_feedback
+from target_salesforce_v3.session import gzip_json
+
+try:
+    import aiohttp
+except ImportError:  # optional, installed with the `async` extra
+    aiohttp = None
+
+RETRIABLE_ERRORS = (RetriableAPIError, asyncio.TimeoutError)
+if aiohttp is not None:
+    RETRIABLE_ERRORS += (aiohttp.ClientConnectionError,)
+
+
+class AsyncResponse:
+    """The parts of a `requests.Response` the sink's checks rely on."""
+
+    def __init__(self, status_code: int, reason: str, headers, text: str) -> None:
+        self.status_code = status_code
+        self.reason = reason
+        self.headers = headers
+        self.text = text
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class AsyncRequestEngine:
+    """Send a sink's requests concurrently on a private event loop.
+
+    Requests share one pooled aiohttp session and at most `concurrency` are
+    in flight at once, within the target's shared limiter. Responses get the
+    same validation, retries and quota check as `SalesforceV3Sink.request_api`.
+    """
+
+    def __init__(self, sink, concurrency: int) -> None:
+        if aiohttp is None:
+            raise ImportError("aiohttp is required for the async write mode, install the `async` extra")
+        self.sink = sink
+        self.concurrency = concurrency
+        self.loop = asyncio.new_event_loop()
+        self._session = None
+        self._semaphore = None
+
+    async def _start(self) -> None:
+        # both bind to the running loop, so they are created inside it
+        if self._session is None:
+            connector = aiohttp.TCPConnector(limit=self.concurrency)
+            self._session = aiohttp.ClientSession(connector=connector)
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+
+    async def _gather(self, coroutines: list) -> list:
+        await self._start()
+        return await asyncio.gather(*coroutines)
+
+    def run(self, coroutines: list) -> list:
+        """Run `coroutines` concurrently and return their results in order."""
+        return self.loop.run_until_complete(self._gather(coroutines))
+
+    async def request(self, http_method, endpoint, request_data=None) -> AsyncResponse:
+        response = await self._request(http_method, endpoint, request_data)
+        self.sink.check_salesforce_limits(response)
+        return response
+
+    @backoff.on_exception(backoff.expo, RETRIABLE_ERRORS, max_tries=5, factor=2)
+    async def _request(self, http_method, endpoint, request_data=None) -> AsyncResponse:
+        sink = self.sink
+        headers = dict(sink.http_headers)
+        body = None
+        if request_data is not None:
+            if sink.config.get("gzip_requests", False):
+                body = gzip_json(request_data)
+                headers["Content-Encoding"] = "gzip"
+            else:
+                body = json.dumps(request_data).encode("utf-8")
+
+        limiter = sink._target.limiter
+        async with self._semaphore:
+            while not limiter.try_acquire():
+                await asyncio.sleep(0.05)
+            started = time.monotonic()
+            response = None
+            try:
+                async with self._session.request(http_method, sink.url(endpoint), headers=headers, data=body) as resp:
+                    response = AsyncResponse(resp.status, resp.reason, resp.headers, await resp.text())
+            finally:
+                limiter.release(**response_feedback(response, time.monotonic() - started))
+
+        # NOTE: handle PATCH
+        if http_method == "PATCH" and response.status_code == 400:
+            data = response.json()
+            if isinstance(data, list) and len(data) > 0:
+                error = data[0] or dict()
+                if error.get("errorCode") == "INVALID_FIELD_FOR_INSERT_UPDATE":
+                    return await self._request(
+                        http_method, endpoint, {k: v for k, v in request_data.items() if k not in error.get("fields")}
+                    )
+
+        sink.validate_response(response)
+        return response
+
+    def close(self) -> None:
+        if self._session is not None:
+            self.loop.run_until_complete(self._session.close())
+        self.loop.close()
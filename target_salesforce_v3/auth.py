@@ -1,13 +1,20 @@
 import json
+import threading
 from datetime import datetime
 from typing import Any, Dict, Mapping, Optional
 from types import MappingProxyType
 import logging
 
-import requests
+# Salesforce sessions last two hours by default
+TOKEN_LIFETIME = 7200
 
 class SalesforceV3Authenticator:
-    """API Authenticator for OAuth 2.0 flows."""
+    """API Authenticator for OAuth 2.0 flows.
+
+    One instance is shared by every sink of a target. The token is kept in
+    memory and refreshed under a lock shortly before it expires, so concurrent
+    sinks trigger a single OAuth call.
+    """
 
     def __init__(
         self,
@@ -26,6 +33,10 @@ class SalesforceV3Authenticator:
         self.logger: logging.Logger = target.logger
         self._auth_endpoint = auth_endpoint
         self._target = target
+        self._lock = threading.Lock()
+        self.access_token = self._target._config.get("access_token")
+        self.issued_at = self._target._config.get("issued_at")
+        self.refresh_margin = int(self._target._config.get("token_refresh_margin", 200))
         self.update_access_token()
         self.instance_url = self._target.config["instance_url"]
 
@@ -45,7 +56,7 @@ class SalesforceV3Authenticator:
         """
         self.update_access_token()
         result = {}
-        result["Authorization"] = f"Bearer {self._target._config.get('access_token')}"
+        result["Authorization"] = f"Bearer {self.access_token}"
         return result
 
     @property
@@ -74,15 +85,12 @@ class SalesforceV3Authenticator:
         }
 
     def is_token_valid(self) -> bool:
-        access_token = self._target._config.get("access_token")
-        now = datetime.now().timestamp()
-        issued_at = self._target._config.get("issued_at")
-        if not access_token or not issued_at:
+        if not self.access_token or not self.issued_at:
             return False
 
-        time_since_issued = now - issued_at / 1000
+        time_since_issued = datetime.now().timestamp() - self.issued_at / 1000
 
-        return time_since_issued < 7000
+        return time_since_issued < TOKEN_LIFETIME - self.refresh_margin
 
     @property
     def oauth_request_payload(self) -> dict:
@@ -102,6 +110,13 @@ class SalesforceV3Authenticator:
         """
         if self.is_token_valid() and self._target._config.get("instance_url"):
             return
+        with self._lock:
+            # another sink may have refreshed the token while we waited
+            if self.is_token_valid() and self._target._config.get("instance_url"):
+                return
+            self._refresh_access_token()
+
+    def _refresh_access_token(self) -> None:
         auth_request_payload = self.oauth_request_payload
         headers = {"Content-Type": "application/x-www-form-urlencoded"}
 
@@ -116,7 +131,9 @@ class SalesforceV3Authenticator:
         else:
             login_url = 'https://login.salesforce.com/services/oauth2/token'
 
-        token_response = requests.post(
+        token_response = self._target.limiter.request(
+            self._target.session,
+            "POST",
             login_url,
             headers=headers,
             data=auth_request_payload
@@ -129,11 +146,17 @@ class SalesforceV3Authenticator:
                 f"Failed OAuth login, response was '{token_response.json()}'. {ex}"
             )
         token_json = token_response.json()
+        token_changed = (
+            token_json["access_token"] != self._target._config.get("access_token")
+            or token_json["instance_url"] != self._target._config.get("instance_url")
+        )
         self.access_token = token_json["access_token"]
-        issued_at = int(token_json["issued_at"])
+        self.issued_at = int(token_json["issued_at"])
 
-        self._target._config["access_token"] = token_json["access_token"]
-        self._target._config["issued_at"] = issued_at
+        self._target._config["access_token"] = self.access_token
+        self._target._config["issued_at"] = self.issued_at
         self._target._config["instance_url"] = token_json["instance_url"]
-        with open(self._target._config_file_path, "w") as outfile:
-            json.dump(self._target._config, outfile, indent=4)
+        self.instance_url = token_json["instance_url"]
+        if token_changed:
+            with open(self._target._config_file_path, "w") as outfile:
+                json.dump(self._target._config, outfile, indent=4)
@@ -0,0 +1,171 @@
+"""Bulk API 2.0 ingest jobs."""
+
+from __future__ import annotations
+
+import csv
+import io
+import json
+import logging
+import time
+
+JOB_FINAL_STATES = ["JobComplete", "Failed", "Aborted"]
+
+
+class BulkJobTimeoutError(Exception):
+    pass
+
+
+def to_csv_value(value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return str(value)
+
+
+class BulkIngestJob:
+    """Run one Bulk API 2.0 ingest job and map its results back to the input.
+
+    `request` has the signature of `SalesforceV3Sink.request_api`, with an
+    extra `data` argument for raw request bodies, so the job can be exercised
+    against a local fake of the ingest endpoints.
+    """
+
+    def __init__(
+        self,
+        request,
+        object_type: str,
+        operation: str,
+        external_id_field: str = None,
+        poll_interval: float = 2.0,
+        max_poll_interval: float = 30.0,
+        timeout: float = 3600.0,
+        sleep=time.sleep,
+        logger: logging.Logger = None,
+    ) -> None:
+        self.request = request
+        self.object_type = object_type
+        self.operation = operation
+        self.external_id_field = external_id_field
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.timeout = timeout
+        self.sleep = sleep
+        self.logger = logger or logging.getLogger(__name__)
+        self.job_id = None
+
+    def build_csv(self, records: list) -> tuple:
+        columns = []
+        for record in records:
+            for key in record:
+                if key not in columns:
+                    columns.append(key)
+
+        output = io.StringIO()
+        writer = csv.writer(output, lineterminator="\n")
+        writer.writerow(columns)
+        rows = []
+        for record in records:
+            row = [to_csv_value(record.get(column)) for column in columns]
+            writer.writerow(row)
+            rows.append(tuple(row))
+        return columns, rows, output.getvalue()
+
+    def create(self) -> str:
+        payload = {
+            "object": self.object_type,
+            "operation": self.operation,
+            "contentType": "CSV",
+            "lineEnding": "LF",
+        }
+        if self.operation == "upsert":
+            payload["externalIdFieldName"] = self.external_id_field
+        response = self.request("POST", endpoint="jobs/ingest", request_data=payload)
+        self.job_id = response.json()["id"]
+        return self.job_id
+
+    def upload(self, content: str) -> None:
+        self.request(
+            "PUT",
+            endpoint=f"jobs/ingest/{self.job_id}/batches",
+            headers={"Content-Type": "text/csv"},
+            data=content.encode("utf-8"),
+        )
+        self.request(
+            "PATCH",
+            endpoint=f"jobs/ingest/{self.job_id}",
+            request_data={"state": "UploadComplete"},
+        )
+
+    def wait(self) -> dict:
+        """Poll the job with exponential backoff until it reaches a final state."""
+        interval = self.poll_interval
+        waited = 0.0
+        while True:
+            job = self.request("GET", endpoint=f"jobs/ingest/{self.job_id}").json()
+            if job.get("state") in JOB_FINAL_STATES:
+                return job
+            if waited >= self.timeout:
+                raise BulkJobTimeoutError(
+                    f"Bulk job {self.job_id} did not finish after {waited:.0f}s, last state: {job.get('state')}"
+                )
+            self.sleep(interval)
+            waited += interval
+            interval = min(interval * 2, self.max_poll_interval)
+
+    def results(self, kind: str) -> list:
+        response = self.request(
+            "GET",
+            endpoint=f"jobs/ingest/{self.job_id}/{kind}/",
+            headers={"Accept": "text/csv"},
+        )
+        return list(csv.DictReader(io.StringIO(response.text)))
+
+    def run(self, records: list) -> list:
+        """Ingest `records` and return one result dict per record, in input order.
+
+        Each result has `success` and either `id` or `error`. Result rows
+        carry the uploaded values but no row number, and Salesforce rejects
+        extra columns, so identical rows are matched in input order within
+        each of the successful, failed and unprocessed result sets.
+        """
+        columns, rows, content = self.build_csv(records)
+        self.create()
+        self.logger.info(
+            f"Bulk {self.operation} job {self.job_id} created for {len(records)} {self.object_type} records"
+        )
+        self.upload(content)
+        job = self.wait()
+        self.logger.info(
+            f"Bulk job {self.job_id} finished with state {job.get('state')}: "
+            f"{job.get('numberRecordsProcessed')} processed, {job.get('numberRecordsFailed')} failed"
+        )
+
+        # results echo the uploaded columns, so rows are matched on their
+        # values, and identical rows take the next input index left in order
+        pending = {}
+        for index, row in enumerate(rows):
+            pending.setdefault(row, []).append(index)
+
+        results = [None] * len(records)
+
+        def assign(result_row, result):
+            key = tuple(result_row.get(column, "") for column in columns)
+            indexes = pending.get(key)
+            if indexes:
+                results[indexes.pop(0)] = result
+
+        for row in self.results("successfulResults"):
+            assign(row, {"success": True, "id": row.get("sf__Id"), "created": row.get("sf__Created") == "true"})
+        for row in self.results("failedResults"):
+            assign(row, {"success": False, "id": row.get("sf__Id") or None, "error": row.get("sf__Error")})
+        if job.get("state") != "JobComplete":
+            for row in self.results("unprocessedrecords"):
+                assign(row, {"success": False, "error": f"Record not processed, job {job.get('state')}: {job.get('errorMessage')}"})
+
+        return [
+            result or {"success": False, "error": f"No result returned by bulk job {self.job_id}"}
+            for result in results
+        ]
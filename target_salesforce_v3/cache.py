@@ -0,0 +1,361 @@
+"""Shared metadata caches for the Salesforce target."""
+
+from __future__ import annotations
+
+import base64
+import hashlib
+import json
+import os
+import re
+import threading
+
+
+def build_fields_description(fields: list) -> dict:
+    """Group describe fields the way the sinks consume them."""
+    description = {}
+    description["createable"] = [
+        f["name"] for f in fields if f["createable"] and not f["custom"]
+    ]
+    description["custom"] = [f["name"] for f in fields if f["custom"]]
+    description["createable_not_default"] = [
+        f["name"]
+        for f in fields
+        if f["createable"] and not f["defaultedOnCreate"] and not f["custom"]
+    ]
+    description["required"] = [
+        f["name"]
+        for f in fields
+        if not f["nillable"] and f["createable"] and not f["defaultedOnCreate"]
+    ]
+    description["external_ids"] = [f["name"] for f in fields if f["externalId"]]
+    description["pickable"] = {}
+    for field in fields:
+        if field["picklistValues"]:
+            description["pickable"][field["name"]] = [
+                p["label"] for p in field["picklistValues"] if p["active"]
+            ]
+    return description
+
+
+def normalize_picklist_value(value) -> str:
+    return re.sub(r"\W+", "", str(value)).lower()
+
+
+def decode_valid_for(valid_for: str) -> set:
+    """Decode a describe `validFor` bitmap into controlling value indexes."""
+    bits = base64.b64decode(valid_for)
+    return {i for i in range(len(bits) * 8) if bits[i >> 3] & (0x80 >> (i & 7))}
+
+
+class PicklistIndex:
+    """Normalized picklist values of one field mapped to their canonical label.
+
+    Keys are the label and API value with non-word characters stripped and
+    lowercased. Dependent picklists also keep which controlling values each
+    label is valid for.
+    """
+
+    def __init__(self, values: list, controller_values: dict = None) -> None:
+        # values: dicts with label, value and (for dependent picklists) the
+        # set of controlling value indexes under "valid_for"
+        self.labels = [v["label"] for v in values]
+        self.controller_values = controller_values
+        self._labels = {}
+        self._valid_for = {}
+        for v in values:
+            self._labels.setdefault(normalize_picklist_value(v["label"]), v["label"])
+            self._labels.setdefault(normalize_picklist_value(v["value"]), v["label"])
+            if v.get("valid_for") is not None:
+                self._valid_for[v["label"]] = v["valid_for"]
+
+    @classmethod
+    def from_describe(cls, field: dict, controller: dict = None) -> "PicklistIndex":
+        controller_values = None
+        if field.get("dependentPicklist") and controller:
+            if controller["type"] == "boolean":
+                controller_values = {"false": 0, "true": 1}
+            else:
+                controller_values = {}
+                for i, p in enumerate(controller["picklistValues"]):
+                    controller_values.setdefault(normalize_picklist_value(p["label"]), i)
+                    controller_values.setdefault(normalize_picklist_value(p["value"]), i)
+        values = []
+        for p in field["picklistValues"]:
+            if not p["active"]:
+                continue
+            valid_for = None
+            if controller_values is not None and p.get("validFor"):
+                valid_for = decode_valid_for(p["validFor"])
+            values.append({"label": p["label"], "value": p["value"], "valid_for": valid_for})
+        return cls(values, controller_values)
+
+    @classmethod
+    def from_ui_api(cls, field_values: dict) -> "PicklistIndex":
+        """Build from a ui-api picklist-values entry of a record type."""
+        controller_values = field_values.get("controllerValues") or None
+        if controller_values:
+            controller_values = {normalize_picklist_value(k): i for k, i in controller_values.items()}
+        values = [
+            {
+                "label": v["label"],
+                "value": v["value"],
+                "valid_for": set(v.get("validFor") or []) if controller_values else None,
+            }
+            for v in field_values.get("values", [])
+        ]
+        return cls(values, controller_values)
+
+    def allowed(self, label: str, controlling_value=None) -> bool:
+        if controlling_value is None or self.controller_values is None or label not in self._valid_for:
+            return True
+        index = self.controller_values.get(normalize_picklist_value(controlling_value))
+        return index is not None and index in self._valid_for[label]
+
+    def resolve(self, value, controlling_value=None):
+        """Return the canonical label for `value`, or None if it is not valid."""
+        if value is None:
+            return None
+        label = self._labels.get(normalize_picklist_value(value))
+        if label is not None and self.allowed(label, controlling_value):
+            return label
+        return None
+
+    def first(self, controlling_value=None):
+        return next((label for label in self.labels if self.allowed(label, controlling_value)), None)
+
+
+class SObjectDescribe:
+    """A describe response with the lookups the sinks need precomputed."""
+
+    def __init__(self, describe: dict) -> None:
+        self.raw = describe
+        self.name = describe.get("name")
+        self.fields = describe.get("fields", [])
+        self.fields_by_name = {f["name"]: f for f in self.fields}
+        self.description = build_fields_description(self.fields)
+        self.writable_fields = frozenset(self.description["createable"]) | {"Id"}
+        self._picklists = {}
+
+    def picklist(self, field_name: str):
+        """Return the PicklistIndex of a field, built on first use."""
+        if field_name not in self._picklists:
+            field = self.fields_by_name.get(field_name)
+            index = None
+            if field and field["picklistValues"]:
+                controller = self.fields_by_name.get(field.get("controllerName"))
+                index = PicklistIndex.from_describe(field, controller)
+            self._picklists[field_name] = index
+        return self._picklists[field_name]
+
+
+class SObjectCatalog:
+    """The org's sObjects indexed by API name, label and plural label.
+
+    Like a scan of the listing, the first sObject matching by any of the three
+    wins. Exact matches win over case-insensitive ones.
+    """
+
+    def __init__(self, sobjects: list) -> None:
+        self._exact = {}
+        self._folded = {}
+        for sobject in sobjects:
+            for key in ["name", "label", "labelPlural"]:
+                if sobject.get(key):
+                    self._exact.setdefault(sobject[key], sobject["name"])
+                    self._folded.setdefault(sobject[key].casefold(), sobject["name"])
+
+    def resolve(self, name: str):
+        """Return the API name of the sObject called `name`, if any."""
+        if not name:
+            return None
+        return self._exact.get(name) or self._folded.get(name.casefold())
+
+
+class MetadataDiskCache:
+    """Metadata responses persisted between runs.
+
+    Each entry stores the response body with the ``Last-Modified`` value it was
+    fetched at, so the next run can revalidate it with ``If-Modified-Since``.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, key: tuple) -> str:
+        digest = hashlib.sha1(json.dumps(key).encode()).hexdigest()
+        return os.path.join(self.path, f"{digest}.json")
+
+    def load(self, key: tuple):
+        try:
+            with open(self._file(key)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def save(self, key: tuple, last_modified: str, body) -> None:
+        file = self._file(key)
+        tmp_file = f"{file}.{threading.get_ident()}.tmp"
+        with open(tmp_file, "w") as f:
+            json.dump({"last_modified": last_modified, "body": body}, f)
+        os.replace(tmp_file, file)
+
+    def delete(self, key: tuple) -> None:
+        try:
+            os.remove(self._file(key))
+        except OSError:
+            pass
+
+
+class DescribeCache:
+    """Thread-safe, per-run cache of sObject describe results.
+
+    Entries are keyed by ``(instance_url, api_version, sobject)`` so every sink
+    of a target shares one describe call per sObject. Concurrent misses for the
+    same key wait on a per-key lock instead of issuing duplicate requests.
+    The global ``sobjects`` listing is cached the same way, keyed by
+    ``(instance_url, api_version)``.
+    """
+
+    def __init__(self, disk: MetadataDiskCache = None) -> None:
+        self.disk = disk
+        self._entries = {}
+        self._sobjects = {}
+        self._record_type_picklists = {}
+        self._catalogs = {}
+        self._lock = threading.Lock()
+        self._key_locks = {}
+
+    def _get(self, entries: dict, key: tuple, loader):
+        entry = entries.get(key)
+        if entry is not None:
+            return entry
+
+        # the catalog and the sObject list share a key, and the catalog's
+        # loader fetches the list, so locks are per cache as well as per key
+        with self._lock:
+            key_lock = self._key_locks.setdefault((id(entries), key), threading.Lock())
+
+        with key_lock:
+            entry = entries.get(key)
+            if entry is None:
+                entry = loader()
+                entries[key] = entry
+        return entry
+
+    def get(self, key: tuple, loader) -> SObjectDescribe:
+        """Return the cached describe for `key`, calling `loader` on a miss."""
+        return self._get(self._entries, key, lambda: SObjectDescribe(loader()))
+
+    def get_sobjects(self, key: tuple, loader) -> list:
+        """Return the cached global sObject list, calling `loader` on a miss."""
+        return self._get(self._sobjects, key, loader)
+
+    def get_catalog(self, key: tuple, loader) -> SObjectCatalog:
+        """Return the cached sObject catalog built from `loader`'s listing."""
+        return self._get(self._catalogs, key, lambda: SObjectCatalog(loader()))
+
+    def get_record_type_picklists(self, key: tuple, loader) -> dict:
+        """Return the field to PicklistIndex map of a record type."""
+        return self._get(
+            self._record_type_picklists,
+            key,
+            lambda: {
+                name: PicklistIndex.from_ui_api(values)
+                for name, values in loader().get("picklistFieldValues", {}).items()
+            },
+        )
+
+    def invalidate(self, key: tuple) -> None:
+        """Drop a cached describe, e.g. after a custom field was created."""
+        with self._lock:
+            self._entries.pop(key, None)
+            for record_type_key in [k for k in self._record_type_picklists if k[:3] == key]:
+                self._record_type_picklists.pop(record_type_key)
+        if self.disk:
+            self.disk.delete(key)
+
+
+class ReferenceIndex:
+    """Name to Id index of an sObject, shared by every sink of a target.
+
+    Objects with up to `preload_limit` rows are loaded once in full, paging
+    through every result page. Larger objects, or every object when the limit
+    is 0, are resolved on demand with targeted ``WHERE Name IN (...)`` queries
+    whose matches are memoized. Rows are read oldest first, so the oldest row
+    wins when several share a name.
+    """
+
+    def __init__(self, object_type: str, case_insensitive: bool = False, preload_limit: int = 50000) -> None:
+        self.object_type = object_type
+        self.case_insensitive = case_insensitive
+        self.preload_limit = preload_limit
+        # None until the row count has been checked
+        self.preloaded = None if preload_limit else False
+        self._ids = {}
+        self._lock = threading.Lock()
+        self._create_lock = threading.Lock()
+
+    def key(self, name: str) -> str:
+        return name.casefold() if self.case_insensitive else name
+
+    def _add(self, record: dict) -> None:
+        if record.get("Name") is not None:
+            self._ids.setdefault(self.key(record["Name"]), record["Id"])
+
+    def _load(self, sink) -> None:
+        total = sink.request_api(
+            "GET", endpoint="query", params={"q": f"SELECT COUNT() FROM {self.object_type}"}
+        ).json().get("totalSize", 0)
+        self.preloaded = total <= self.preload_limit
+        if self.preloaded:
+            for record in sink.query_all(f"SELECT Id, Name FROM {self.object_type} ORDER BY CreatedDate ASC"):
+                self._add(record)
+        else:
+            sink.logger.info(
+                f"{self.object_type} has {total} rows, resolving names with targeted queries instead of preloading"
+            )
+
+    def resolve(self, sink, names: list) -> dict:
+        """Return a dict of name to Id (or None) for `names`."""
+        names = [name for name in names if name]
+        with self._lock:
+            if self.preloaded is None:
+                self._load(sink)
+            if not self.preloaded:
+                missing = [name for name in names if self.key(name) not in self._ids]
+                for record in sink.query_in(
+                    self.object_type, ["Id", "Name"], "Name", missing, order_by="CreatedDate ASC"
+                ):
+                    self._add(record)
+        return {name: self._ids.get(self.key(name)) for name in names}
+
+    def get(self, sink, name: str):
+        if not name:
+            return None
+        return self.resolve(sink, [name])[name]
+
+    def get_or_create(self, sink, name: str, create) -> str:
+        """Return the Id of `name`, calling `create(name)` if no row has it.
+
+        Creation happens under a lock, so concurrent callers create a row at
+        most once. A preloaded index is checked again with a targeted query
+        before creating, in case another sink created the row since.
+        """
+        if not name:
+            return None
+        id = self._ids.get(self.key(name))
+        if id:
+            return id
+        with self._create_lock:
+            id = self.get(sink, name)
+            if id is None and self.preloaded:
+                for record in sink.query_in(
+                    self.object_type, ["Id", "Name"], "Name", [name], order_by="CreatedDate ASC"
+                ):
+                    id = id or record["Id"]
+            if id is None:
+                id = create(name)
+            with self._lock:
+                self._ids[self.key(name)] = id
+        return id
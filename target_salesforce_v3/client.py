@@ -2,30 +2,34 @@
 
 from __future__ import annotations
 
+import gzip
+import hashlib
 import re
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
 
 import backoff
 import requests
 
 from backports.cached_property import cached_property
 from datetime import datetime
+from email.utils import formatdate
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape as xml_escape
 
 from singer_sdk.exceptions import FatalAPIError, RetriableAPIError
-from singer_sdk.sinks import RecordSink
 
-from target_salesforce_v3.auth import SalesforceV3Authenticator
+from target_salesforce_v3.aio import AsyncRequestEngine, aiohttp
+from target_salesforce_v3.bulk import BulkIngestJob
+from target_salesforce_v3.cache import ReferenceIndex
+from target_salesforce_v3.countries import lookup_country
+from target_salesforce_v3.session import gzip_json
 
-from target_hotglue.sinks import HotglueSink
+from target_hotglue.client import HotglueBatchSink
+from target_hotglue.common import HGJSONEncoder
 
-import os
 import json
 
-__location__ = os.path.realpath(os.path.join(os.getcwd(), os.path.dirname(__file__)))
-
-
-class TargetSalesforceQuotaExceededException(Exception):
-    pass
-
 
 class MissingRequiredFieldException(Exception):
     pass
@@ -35,18 +39,132 @@ class NoCreatableFieldsException(Exception):
     pass
 
 
-class SalesforceV3Sink(HotglueSink, RecordSink):
-    """SalesforceV3 target sink class."""
+# per-record data that preprocess_record passes along to the write step but
+# that is not a Salesforce field, removed before the record is sent
+RECORD_CONTEXT_KEY = "__context__"
+
+# keep GET query URLs well under the ~16k characters Salesforce accepts
+SOQL_MAX_LENGTH = 12000
+
+
+def chunked(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def match_key(field, value):
+    """Key to match a looked up value with the value of a queried record.
+
+    Ids compare on their case-sensitive 15 character form, other values like
+    SOQL does, ignoring case.
+    """
+    if field == "Id":
+        return str(value)[:15]
+    return str(value).lower()
+
+
+def same_value(current, value):
+    """Whether a queried field value equals the value about to be written."""
+    if current == value:
+        return True
+    if current is None or value is None or isinstance(current, bool) or isinstance(value, bool):
+        return False
+    if isinstance(current, (int, float)) or isinstance(value, (int, float)):
+        try:
+            return float(current) == float(value)
+        except (TypeError, ValueError):
+            return False
+    return str(current) == str(value)
+
+
+def read_only_fields(result):
+    """Fields a failed collections row was rejected for, when they can't be written."""
+    for error in result.get("errors") or []:
+        if error.get("statusCode") == "INVALID_FIELD_FOR_INSERT_UPDATE" and error.get("fields"):
+            return error["fields"]
+    return None
+
+
+def soql_literal(value):
+    value = str(value).replace("\\", "\\\\").replace("'", "\\'")
+    return f"'{value}'"
+
+
+class SalesforceV3Sink(HotglueBatchSink):
+    """SalesforceV3 target sink class.
+
+    Buffered write modes stage records in the batch context and write them
+    when the batch is drained. In "record" mode each record is written as
+    soon as it is processed, through the same steps as a batch of one.
+    """
+
+    # sObject Collections accept at most 200 records per call
+    COLLECTIONS_BATCH_SIZE = 200
+    # createMetadata accepts at most 10 components per call
+    METADATA_BATCH_SIZE = 10
+    # composite requests accept at most 25 subrequests
+    COMPOSITE_MAX_SUBREQUESTS = 25
+    # fields that can be set on create but are rejected on update
+    non_updatable_fields = ["ContactId"]
+    # Bulk API 2.0 cannot load binary content
+    bulk_unsupported_objects = ["Attachment", "ContentVersion", "Document"]
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.api_version = self.config.get("api_version", "55.0").replace("v", "")
+        self._external_id_fields = {}
+        self._lookups = {}
+        # custom fields seen in buffered records, sObject -> name -> label
+        self._pending_custom_fields = {}
+
+    @cached_property
+    def write_mode(self):
+        """How records are written.
+
+        "record" writes each record on its own, "batch" through sObject
+        Collections, "async" and "threaded" as concurrent single-record calls
+        and "bulk" through Bulk API 2.0 once a drained batch has at least
+        `bulk_threshold` records.
+        """
+        stream_write_modes = self.config.get("stream_write_modes") or {}
+        write_mode = stream_write_modes.get(self.stream_name) or self.config.get("write_mode", "record")
+        if write_mode == "async" and aiohttp is None:
+            self.logger.warning("aiohttp is not installed, writing %s in batch mode instead of async", self.stream_name)
+            return "batch"
+        return write_mode
+
+    @property
+    def is_buffered(self):
+        return self.write_mode != "record"
+
+    @property
+    def max_size(self):
+        if self.write_mode == "bulk":
+            return int(self.config.get("bulk_batch_size", 10000))
+        if self.write_mode in ["async", "threaded"]:
+            return int(self.config.get("batch_size", self.COLLECTIONS_BATCH_SIZE))
+        if self.is_buffered:
+            return min(int(self.config.get("batch_size", self.COLLECTIONS_BATCH_SIZE)), self.COLLECTIONS_BATCH_SIZE)
+        return super().max_size
 
     @property
     def permission_set_ids(self):
-        params = {"q": "SELECT Id FROM PermissionSet"}
-        response = self.request_api("GET", endpoint="query", params=params, headers={"Content-Type": "application/json"})
-        return [r["Id"] for r in response.json()["records"]]
+        """Ids of the org's permission sets, queried once per run."""
+        if self._target.permission_set_ids is None:
+            self._target.permission_set_ids = [r["Id"] for r in self.query_all("SELECT Id FROM PermissionSet")]
+        return self._target.permission_set_ids
+
+    @property
+    def session(self):
+        return self._target.session
+
+    @cached_property
+    def async_engine(self):
+        return AsyncRequestEngine(self, int(self.config.get("async_concurrency", 10)))
+
+    @cached_property
+    def executor(self):
+        return ThreadPoolExecutor(max_workers=int(self.config.get("thread_workers", 10)))
 
     @property
     def http_headers(self) -> dict:
@@ -60,11 +178,9 @@ class SalesforceV3Sink(HotglueSink, RecordSink):
 
     def get_fields_for_object(self, object_type):
         """Check if Salesforce has an object type and fetches its fields."""
-        req = self.request_api("GET", endpoint="sobjects/")
-        for object in req.json().get("sobjects", []):
-            if object["name"] == object_type or object["label"] == object_type or object["labelPlural"] == object_type:
-                obj_req = self.request_api("GET", endpoint=f"sobjects/{object['name']}/describe").json()
-                return {f["name"]: f for f in obj_req.get("fields", [])}
+        object_name = self.sobject_catalog().resolve(object_type)
+        if object_name:
+            return dict(self.describe(object_name).fields_by_name)
 
     def validate_response(self, response: requests.Response) -> None:
         """Validate HTTP response."""
@@ -90,46 +206,62 @@ class SalesforceV3Sink(HotglueSink, RecordSink):
             f"{response.reason} for path: {self.endpoint}"
         )
 
+    @property
+    def quota(self):
+        return self._target.quota
+
     def check_salesforce_limits(self, response):
-        limit_info = response.headers.get("Sforce-Limit-Info")
-        quota_percent_total = 80
+        """Report the call and the daily usage in its response to the quota governor.
 
-        match = re.search("^api-usage=(\d+)/(\d+)$", limit_info)
+        Budgets are enforced between batches by `quota_allows`, so a batch is
+        never cut off halfway.
+        """
+        limit_info = response.headers.get("Sforce-Limit-Info")
+        match = re.search(r"^api-usage=(\d+)/(\d+)$", limit_info) if limit_info else None
         if match is None:
+            self.quota.observe(self.stream_name)
             return
         remaining, allotted = map(int, match.groups())
 
-        self.logger.info("Used %s of %s daily REST API quota", remaining, allotted)
-        percent_used_from_total = (remaining / allotted) * 100
+        self.logger.debug("Used %s of %s daily REST API quota", remaining, allotted)
+        self.quota.observe(self.stream_name, remaining, allotted)
 
-        if percent_used_from_total > quota_percent_total:
-            total_message = (
-                "Salesforce has reported {}/{} ({:3.2f}%) total REST quota "
-                "used across all Salesforce Applications. Terminating "
-                "replication to not continue past configured percentage "
-                "of {}% total quota."
-            ).format(remaining, allotted, percent_used_from_total, quota_percent_total)
-            raise TargetSalesforceQuotaExceededException(total_message)
+    def quota_allows(self, record_count):
+        """Whether the next `record_count` records fit in the API budgets."""
+        self.quota.start(self)
+        return self.quota.allows(self.stream_name, record_count)
 
     @backoff.on_exception(
         backoff.expo,
-        (RetriableAPIError, requests.exceptions.ReadTimeout),
+        (RetriableAPIError, requests.exceptions.ReadTimeout, requests.exceptions.ConnectionError),
         max_tries=5,
         factor=2,
     )
     def _request(
-        self, http_method, endpoint, params=None, request_data=None, headers=None
+        self, http_method, endpoint, params=None, request_data=None, headers=None, data=None
     ) -> requests.PreparedRequest:
         """Prepare a request object."""
         url = self.url(endpoint)
-        headers = self.http_headers
-
-        response = requests.request(
-            method=http_method,
-            url=url,
+        headers = {**self.http_headers, **(headers or {})}
+
+        body = data
+        if self.config.get("gzip_requests", False):
+            if request_data is not None:
+                body = gzip_json(request_data)
+            elif data is not None:
+                body = gzip.compress(data)
+            if body is not None:
+                headers["Content-Encoding"] = "gzip"
+
+        # every sink's requests share one adaptive concurrency limit
+        response = self._target.limiter.request(
+            self.session,
+            http_method,
+            url,
             params=params,
             headers=headers,
-            json=request_data
+            json=request_data if body is None else None,
+            data=body,
         )
 
         # NOTE: handle PATCH
@@ -145,9 +277,9 @@ class SalesforceV3Sink(HotglueSink, RecordSink):
         self.validate_response(response)
         return response
 
-    def request_api(self, http_method, endpoint=None, params=None, request_data=None, headers=None):
+    def request_api(self, http_method, endpoint=None, params=None, request_data=None, headers=None, data=None):
         """Request records from REST endpoint(s), returning response records."""
-        resp = self._request(http_method, endpoint, params, request_data, headers)
+        resp = self._request(http_method, endpoint, params, request_data, headers, data)
         self.check_salesforce_limits(resp)
         return resp
 
@@ -157,25 +289,15 @@ class SalesforceV3Sink(HotglueSink, RecordSink):
         # Getting custom fields from record
         # self.process_custom_fields(record)
 
+        record.pop(RECORD_CONTEXT_KEY, None)
         if not record:
             return "", True, {"state": "no fields to post or update"}
 
-        fields = self.sf_fields_description()
-
-        for field in fields["external_ids"]:
-            if record.get(field):
-                try:
-                    update_record = record.copy()
-                    update_record.pop(field)
-                    url = "/".join([self.endpoint, field, record[field]])
-                    response = self.request_api(
-                        "PATCH", endpoint=url, request_data=update_record
-                    )
-                    id = response.json().get("id")
-                    self.logger.info(f"{self.name} updated with id: {id}")
-                    return id, True, state_updates
-                except:
-                    self.logger.info(f"{field} with id {record[field]} does not exist.")
+        external_id = None if record.get("Id") else self.external_id_field(record)
+        if external_id:
+            id, created = self.upsert_by_external_id(self.sobject_name, external_id, record)
+            self.logger.info(f"{self.name} {'created' if created else 'updated'} with id: {id}")
+            return id, True, state_updates
 
         if "Id" in record:
             if "ContactId" in record.keys():
@@ -195,13 +317,609 @@ class SalesforceV3Sink(HotglueSink, RecordSink):
         except:
             pass
 
+    def build_record_hash(self, record):
+        # the per-record context is not part of what gets written
+        record = {k: v for k, v in record.items() if k != RECORD_CONTEXT_KEY}
+        return hashlib.sha256(json.dumps(record, cls=HGJSONEncoder).encode()).hexdigest()
+
+    def get_existing_state(self, hash):
+        """Return the state of an identical record written successfully before, if any."""
+        states = self.latest_state["bookmarks"][self.name]
+
+        existing_state = next((s for s in states if hash == s.get("hash") and s.get("success")), None)
+
+        if existing_state:
+            self.latest_state["summary"][self.name]["existing"] += 1
+
+        return existing_state
+
+    def process_record(self, record: dict, context: dict) -> None:
+        """Stage the record in the batch context, or write it right away in record mode."""
+        if not self.latest_state:
+            self.init_state()
+
+        hash = self.build_record_hash(record)
+        existing_state = self.get_existing_state(hash)
+        if existing_state:
+            return self.update_state(existing_state, is_duplicate=True)
+        buffered = context.get("hashes", {}).get(hash)
+        if buffered:
+            # reported with the state of the identical record once it is written
+            buffered["duplicates"] += 1
+            return
+
+        # the target adds the source externalId after preprocess_record, it is
+        # reported in the state and never sent to Salesforce
+        external_id = record.pop("externalId", None)
+        entry = self.buffer_entry(record)
+        entry["state"] = {"hash": hash}
+        if external_id:
+            entry["state"]["externalId"] = external_id
+        entry["source_external_id"] = external_id
+        entry["duplicates"] = 0
+
+        if not self.is_buffered:
+            return self.process_entries([entry])
+        # state hash -> staged entry, so identical records are written once
+        context.setdefault("hashes", {})[hash] = entry
+        context.setdefault("records", []).append(entry)
+
+    def process_batch(self, context: dict) -> None:
+        """Write the entries staged in the drained batch's context."""
+        self.process_entries(context.get("records") or [])
+
+    def process_entries(self, entries):
+        """Write entries and report their states in input order once all are written."""
+        if not entries:
+            return
+
+        # stop at a batch boundary, the records are left unwritten for a later run
+        if not self.quota_allows(len(entries)):
+            error = self.quota.stop_reason(self.stream_name)
+            for entry in entries:
+                entry["state"].update({"success": False, "error": error})
+                self.report_state(entry)
+            return
+
+        self.resolve_stored_ids(entries)
+        if self.is_buffered:
+            # metadata changes happen before the batch, never while it is written
+            self.provision_pending_custom_fields()
+            # record mode resolves its lookups in preprocess_record
+            self.prepare_batch(entries)
+        pending = self.skip_unchanged(entries)
+        self.make_batch_request(pending)
+
+        for entry in entries:
+            self.remember_payload(entry)
+            self.report_state(entry)
+        self._target.payload_hashes.commit()
+        self.quota.record_written(self.stream_name, len(entries))
+
+    def make_batch_request(self, entries):
+        """Write prepared entries, then make the follow-up calls batched across them."""
+        self.write_entries(entries)
+        retry = self.forget_deleted(entries)
+        if retry:
+            if self.is_buffered:
+                self.prepare_batch(retry)
+            self.write_entries(retry)
+        self.after_batch(entries)
+
+    def write_entries(self, entries):
+        if not self.is_buffered:
+            for entry in entries:
+                self.upsert_entry(entry)
+        elif self.write_mode == "bulk" and len(entries) >= int(self.config.get("bulk_threshold", 2000)):
+            self.write_bulk(entries)
+        elif self.write_mode == "async":
+            self.write_async(entries)
+        elif self.write_mode == "threaded":
+            self.write_threaded(entries)
+        else:
+            self.write_batch(entries)
+
+    def report_state(self, entry):
+        """Add a written record's state, and its duplicates the way the record path reports them."""
+        self.update_state(entry["state"])
+        for _ in range(entry["duplicates"]):
+            existing_state = entry["state"].get("success") and self.get_existing_state(entry["state"]["hash"])
+            if existing_state:
+                self.update_state(existing_state, is_duplicate=True)
+            else:
+                self.update_state(dict(entry["state"]))
+
+    def buffer_entry(self, record):
+        """Capture what is needed to write a preprocessed record later."""
+        payload = dict(record)
+        record_context = payload.pop(RECORD_CONTEXT_KEY, None) or {}
+        return {"raw": dict(record), "record": payload, "object_type": self.sobject_name, "context": record_context}
+
+    def prepare_batch(self, entries):
+        """Hook to resolve lookups for a whole drained batch before it is written.
+
+        Subclasses resolve their lookups first and then call this, which applies
+        `only_upsert_empty_fields` to the whole batch.
+        """
+        if self.config.get("only_upsert_empty_fields"):
+            self.fetch_existing(entries)
+            self.drop_filled_fields(entries)
+
+    @property
+    def skip_unchanged_mode(self):
+        # a persistent state store is meant to make re-runs skip what was written
+        return self.config.get("skip_unchanged") or ("hash" if self.config.get("state_store_path") else None)
+
+    def resolve_stored_ids(self, entries):
+        """Set the Ids of records written before with their source externalId, from the state store.
+
+        Only applies with a persistent `state_store_path`. In batch modes it
+        saves the lookups `prepare_batch` would otherwise run for these
+        records, like matching contacts by email. Record mode has run its
+        lookups in preprocess_record by then, and only records they matched
+        nothing for take a stored Id. Records upserted on a Salesforce
+        external id need no lookup and keep their upsert.
+        """
+        if not self.config.get("state_store_path"):
+            return
+        for entry in entries:
+            record = entry["record"]
+            if not record or not entry["object_type"] or record.get("Id") or not entry.get("source_external_id"):
+                continue
+            if self.entry_external_id(entry):
+                continue
+            stored = self._target.payload_hashes.get(self.payload_key(entry))
+            if stored and stored[0]:
+                record["Id"] = stored[0]
+                entry["raw"]["Id"] = stored[0]
+                entry["stored_id"] = True
+
+    def forget_deleted(self, entries):
+        """Drop the stored Ids of records deleted in Salesforce since they were written.
+
+        Returns their entries, reset to be prepared and written again without
+        the stored Id.
+        """
+        deleted = []
+        for entry in entries:
+            state = entry["state"]
+            if not entry.get("stored_id") or state.get("success"):
+                continue
+            if not any(code in str(state.get("error")) for code in ["NOT_FOUND", "ENTITY_IS_DELETED"]):
+                continue
+            self.logger.info(f"{entry['object_type']} {entry['record']['Id']} no longer exists, writing it again")
+            del self._target.payload_hashes[self.payload_key(entry)]
+            for payload in [entry["record"], entry["raw"]]:
+                payload.pop("Id", None)
+            for key in ["success", "error", "id"]:
+                state.pop(key, None)
+            entry.pop("existing", None)
+            entry.pop("stored_id")
+            deleted.append(entry)
+        return deleted
+
+    def skip_unchanged(self, entries):
+        """Leave out the records whose payload Salesforce already has.
+
+        With `skip_unchanged` set to "hash", payloads are compared with the
+        hashes of the payloads written before for the same Id or external id.
+        With "snapshot", they are compared with the current values, fetched for
+        the whole batch. Returns the entries left to write.
+        """
+        mode = self.skip_unchanged_mode
+        if not mode:
+            return entries
+        if mode == "snapshot":
+            self.fetch_existing(entries)
+
+        pending = []
+        for entry in entries:
+            if not entry["record"] or not entry["object_type"]:
+                pending.append(entry)
+                continue
+            if mode == "hash":
+                # hashed before the write, which may change the entry
+                self.payload_hash(entry)
+            id = self.unchanged_id(entry, mode)
+            if id:
+                entry["state"].update({"success": True, "id": id, "unchanged": True})
+                summary = self.latest_state["summary"][self.name]
+                summary["unchanged"] = summary.get("unchanged", 0) + 1
+            else:
+                pending.append(entry)
+
+        skipped = len(entries) - len(pending)
+        if skipped:
+            self.logger.info(f"Skipped {skipped} unchanged {self.name} records")
+        return pending
+
+    def unchanged_id(self, entry, mode):
+        """Return the Salesforce Id of the record if it is unchanged, None otherwise."""
+        record = entry["record"]
+        if mode == "snapshot":
+            # current field values say nothing about campaign members, topics or file links
+            if self.has_follow_up(entry):
+                return None
+            existing = entry.get("existing")
+            if existing and all(
+                same_value(existing.get(k), v) for k, v in record.items() if k != "Id"
+            ):
+                return existing["Id"]
+            return None
+
+        key = self.payload_key(entry)
+        stored = self._target.payload_hashes.get(key) if key else None
+        if stored and stored[1] == self.payload_hash(entry):
+            return stored[0]
+        return None
+
+    def payload_key(self, entry, id=None):
+        """Key of a record in the state store.
+
+        That is its source externalId, otherwise the Salesforce external id it
+        is upserted on or its Id.
+        """
+        if entry.get("source_external_id"):
+            return (entry["object_type"], "externalId", str(entry["source_external_id"]))
+        external_id = self.entry_external_id(entry)
+        if external_id:
+            return (entry["object_type"], external_id, str(entry["record"][external_id]))
+        id = entry["record"].get("Id") or id
+        if id:
+            return (entry["object_type"], "Id", match_key("Id", id))
+        return None
+
+    def has_follow_up(self, entry):
+        """Whether writing the record also makes follow-up calls, like assignments or file links."""
+        return False
+
+    def payload_hash(self, entry):
+        """Hash of everything a write sends for the record: its fields, context and file links.
+
+        It is taken once per entry, before the record is written.
+        """
+        if "payload_hash" not in entry:
+            payload = {
+                "record": {k: v for k, v in entry["record"].items() if k != "Id"},
+                "context": entry["context"],
+                "links": entry.get("linked_object_id"),
+            }
+            entry["payload_hash"] = hashlib.sha1(
+                json.dumps(payload, sort_keys=True, default=str).encode("utf-8")
+            ).hexdigest()
+        return entry["payload_hash"]
+
+    def remember_payload(self, entry):
+        """Store the Id and payload hash of a record written successfully.
+
+        Used by `skip_unchanged` "hash" and, with a `state_store_path`, by
+        `resolve_stored_ids` on later runs.
+        """
+        state = entry["state"]
+        if not (self.skip_unchanged_mode == "hash" or self.config.get("state_store_path")):
+            return
+        if not state.get("success") or state.get("unchanged"):
+            return
+        key = self.payload_key(entry, state.get("id"))
+        if key and entry["record"]:
+            self._target.payload_hashes[key] = (state.get("id"), self.payload_hash(entry))
+
+    def fetch_existing(self, entries):
+        """Fetch the current values of the mapped fields of existing records.
+
+        Records are matched by Id or by their external id, with one chunked
+        `IN` query per sObject and key field. Entries that already carry an
+        `existing` record from an earlier lookup are left as they are.
+        """
+        groups = {}
+        for entry in entries:
+            if "existing" in entry or not entry["record"] or not entry["object_type"]:
+                continue
+            key_field = "Id" if entry["record"].get("Id") else self.entry_external_id(entry)
+            if key_field:
+                groups.setdefault((entry["object_type"], key_field), []).append(entry)
+
+        for (object_type, key_field), group in groups.items():
+            describe_fields = self.describe(object_type).fields_by_name
+            select = dict.fromkeys(["Id", key_field])
+            for entry in group:
+                # binary fields can only be queried one record at a time
+                select.update(dict.fromkeys(
+                    k for k in entry["record"] if k in describe_fields and describe_fields[k]["type"] != "base64"
+                ))
+            try:
+                self.fetch_existing_group(object_type, key_field, list(select), group)
+            except Exception as e:
+                self.logger.warning(f"Could not fetch existing {object_type} records for the batch, fetching them one by one: {e}")
+                for entry in group:
+                    try:
+                        self.fetch_existing_group(object_type, key_field, list(select), [entry])
+                    except Exception as e:
+                        self.logger.warning(f"Could not fetch the existing {object_type} record: {e}")
+                        entry["existing"] = None
+
+    def fetch_existing_group(self, object_type, key_field, fields, group):
+        values = [entry["record"][key_field] for entry in group]
+        existing = {}
+        for record in self.query_in(object_type, fields, key_field, values):
+            existing.setdefault(match_key(key_field, record.get(key_field)), record)
+        for entry in group:
+            entry["existing"] = existing.get(match_key(key_field, entry["record"][key_field]))
+
+    def drop_filled_fields(self, entries):
+        """Drop the fields that already have a value on the existing record."""
+        for entry in entries:
+            existing = entry.get("existing")
+            if not existing:
+                continue
+            keep = ["Id", self.entry_external_id(entry)]
+            for field in [k for k in entry["record"] if existing.get(k) and k not in keep]:
+                entry["record"].pop(field)
+                entry["raw"].pop(field, None)
+
+    def write_batch(self, entries):
+        """Write buffered records through sObject Collections."""
+        self.send_entries(entries)
+
+    def send_entries(self, entries):
+        """Write buffered records through sObject Collections, 200 per call.
+
+        Records updated by Id go through PATCH and new records through POST.
+        Records carrying the stream's external id are upserted with PATCH
+        composite/sobjects/{type}/{field}, which reports per row whether the
+        record was created. Empty records keep using `upsert_record`.
+        """
+        creates, updates, upserts = [], [], {}
+        for entry in entries:
+            record = entry["record"]
+            if not record or not entry["object_type"]:
+                self.upsert_entry(entry)
+            elif record.get("Id"):
+                updates.append(entry)
+            else:
+                external_id = self.entry_external_id(entry)
+                if external_id:
+                    upserts.setdefault((entry["object_type"], external_id), []).append(entry)
+                else:
+                    creates.append(entry)
+
+        for chunk in chunked(updates, self.COLLECTIONS_BATCH_SIZE):
+            self.send_collection("PATCH", chunk)
+        for (object_type, external_id), group in upserts.items():
+            for chunk in chunked(group, self.COLLECTIONS_BATCH_SIZE):
+                self.send_collection("PATCH", chunk, endpoint=f"composite/sobjects/{object_type}/{external_id}")
+        for chunk in chunked(creates, self.COLLECTIONS_BATCH_SIZE):
+            self.send_collection("POST", chunk)
+
+    def write_bulk(self, entries):
+        """Write buffered records through Bulk API 2.0 ingest jobs.
+
+        Records are grouped into one job per sObject and operation: update by
+        Id, upsert on an external id field, or insert. Empty records and
+        objects Bulk API cannot load go through `send_entries` instead.
+        """
+        groups = {}
+        remaining = []
+        for entry in entries:
+            object_type = entry["object_type"]
+            if not entry["record"] or not object_type or object_type in self.bulk_unsupported_objects:
+                remaining.append(entry)
+            elif entry["record"].get("Id"):
+                groups.setdefault((object_type, "update", None), []).append(entry)
+            else:
+                external_id = self.entry_external_id(entry)
+                operation = "upsert" if external_id else "insert"
+                groups.setdefault((object_type, operation, external_id), []).append(entry)
+
+        self.send_entries(remaining)
+
+        for (object_type, operation, external_id), group in groups.items():
+            job = BulkIngestJob(
+                self.request_api,
+                object_type,
+                operation,
+                external_id_field=external_id,
+                poll_interval=float(self.config.get("bulk_poll_interval", 2)),
+                timeout=float(self.config.get("bulk_timeout", 3600)),
+                logger=self.logger,
+            )
+            records = [self.entry_payload(entry, operation == "update") for entry in group]
+            try:
+                results = job.run(records)
+            except Exception as e:
+                self.logger.exception(f"Bulk {operation} of {len(group)} {object_type} records failed")
+                results = [{"success": False, "error": str(e)}] * len(group)
+            for entry, result in zip(group, results):
+                self.record_result(entry, result, "updated" if operation == "update" else "created")
+
+    def write_threaded(self, entries):
+        """Write buffered records with `upsert_record` on a pool of `thread_workers`."""
+        list(self.executor.map(self.upsert_entry, entries))
+
+    def write_async(self, entries):
+        """Write buffered records one call each, up to `async_concurrency` at once."""
+        pending = []
+        for entry in entries:
+            if not entry["record"] or not entry["object_type"]:
+                self.upsert_entry(entry)
+            else:
+                pending.append(entry)
+
+        results = self.async_engine.run([self.async_upsert_entry(entry) for entry in pending])
+        for entry, (result, action) in zip(pending, results):
+            self.record_result(entry, result, action)
+
+    async def async_upsert_entry(self, entry):
+        try:
+            return await self.async_upsert_record(entry)
+        except Exception as e:
+            self.logger.exception("Upsert record error")
+            return {"success": False, "error": str(e)}, "created"
+
+    async def async_upsert_record(self, entry):
+        """Async counterpart of `upsert_record` for a buffered record.
+
+        Returns the result for `record_result` and the action it reports.
+        """
+        object_type = entry["object_type"]
+        if entry["record"].get("Id"):
+            record = self.entry_payload(entry, True)
+            id = record.pop("Id")
+            await self.async_engine.request("PATCH", f"sobjects/{object_type}/{id}", record)
+            return {"success": True, "id": id}, "updated"
+
+        external_id = self.entry_external_id(entry)
+        if external_id:
+            record = entry["record"]
+            value = urllib.parse.quote(str(record[external_id]), safe="")
+            payload = {k: v for k, v in record.items() if k != external_id}
+            response = await self.async_engine.request(
+                "PATCH", f"sobjects/{object_type}/{external_id}/{value}", payload
+            )
+            body = response.json() if response.text else {}
+            created = response.status_code == 201 or bool(body.get("created"))
+            return {"success": True, "id": body.get("id"), "created": created}, "created"
+
+        response = await self.async_engine.request("POST", f"sobjects/{object_type}", dict(entry["record"]))
+        return {"success": True, "id": response.json().get("id")}, "created"
+
+    def clean_up(self) -> None:
+        super().clean_up()
+        unchanged = self.latest_state and self.latest_state["summary"].get(self.name, {}).get("unchanged")
+        if unchanged:
+            self.logger.info(f"Skipped {unchanged} unchanged {self.name} records in total")
+        if "async_engine" in self.__dict__:
+            self.async_engine.close()
+        if "executor" in self.__dict__:
+            self.executor.shutdown()
+
+    def entry_external_id(self, entry):
+        return self.external_id_field(entry["record"], entry["object_type"])
+
+    def external_id_field(self, record, object_type=None):
+        """Return the external id field to upsert `record` on.
+
+        The field comes from the `external_id_fields` config (keyed by stream
+        or sObject name), otherwise from the first describe external id the
+        stream's records carry. It is picked once per sObject.
+        """
+        object_type = object_type or self.sobject_name
+        field = self._external_id_fields.get(object_type)
+        if not field:
+            external_id_fields = self.config.get("external_id_fields") or {}
+            field = external_id_fields.get(self.stream_name) or external_id_fields.get(object_type)
+            if not field:
+                external_ids = self.sf_fields_description(object_type)["external_ids"]
+                field = next((f for f in external_ids if record.get(f)), None)
+            if not field:
+                return None
+            self._external_id_fields[object_type] = field
+        return field if record.get(field) else None
+
+    def upsert_by_external_id(self, object_type, field, record):
+        """Upsert one record with PATCH sobjects/{type}/{field}/{value}.
+
+        Returns the record id and whether Salesforce created it.
+        """
+        value = urllib.parse.quote(str(record[field]), safe="")
+        payload = {k: v for k, v in record.items() if k != field}
+        response = self.request_api("PATCH", endpoint=f"sobjects/{object_type}/{field}/{value}", request_data=payload)
+        body = response.json() if response.text else {}
+        return body.get("id"), response.status_code == 201 or bool(body.get("created"))
+
+    def upsert_entry(self, entry):
+        """Write a buffered record with the per-record `upsert_record` path."""
+        state = entry["state"]
+        try:
+            id, success, state_updates = self.upsert_record(dict(entry["raw"]), {})
+        except Exception as e:
+            self.logger.exception("Upsert record error")
+            id, success, state_updates = None, False, {"error": str(e)}
+        state["success"] = success
+        if id:
+            state["id"] = id
+        if state_updates and isinstance(state_updates, dict):
+            state.update(state_updates)
+
+    def entry_payload(self, entry, is_update):
+        record = dict(entry["record"])
+        if is_update:
+            for field in self.non_updatable_fields:
+                record.pop(field, None)
+        return record
+
+    def send_collection(self, http_method, entries, endpoint="composite/sobjects", retry_read_only=True):
+        """Send one sObject Collections call and map the results back per record.
+
+        Rows rejected for writing read-only fields are sent once more without
+        those fields, like `_request` does for a single record.
+        """
+        is_update = http_method == "PATCH" and endpoint == "composite/sobjects"
+        records = []
+        for entry in entries:
+            record = self.entry_payload(entry, is_update)
+            record["attributes"] = {"type": entry["object_type"]}
+            records.append(record)
+        try:
+            response = self.request_api(
+                http_method,
+                endpoint=endpoint,
+                request_data={"allOrNone": False, "records": records},
+            )
+            results = response.json()
+        except Exception as e:
+            self.logger.exception(f"Error encountered while sending {len(entries)} {self.name} records")
+            results = [{"success": False, "error": str(e)}] * len(entries)
+
+        action = "updated" if is_update else "created"
+        retry = []
+        for entry, result in zip(entries, results):
+            fields = read_only_fields(result) if retry_read_only else None
+            if fields and any(field in entry["record"] for field in fields):
+                for payload in [entry["record"], entry["raw"]]:
+                    for field in fields:
+                        payload.pop(field, None)
+                retry.append(entry)
+                continue
+            if result.get("errors"):
+                result = {**result, "error": json.dumps(result["errors"])}
+            self.record_result(entry, result, action)
+
+        if retry:
+            self.logger.warning(f"Attempted to write read-only fields in {len(retry)} {self.name} records. Removing them and retrying.")
+            self.send_collection(http_method, retry, endpoint, retry_read_only=False)
+
+    def record_result(self, entry, result, action):
+        """Store the outcome of a batched write in the record's state."""
+        state = entry["state"]
+        object_type = entry["object_type"]
+        if not result.get("success"):
+            state.update({"success": False, "error": result.get("error")})
+            self.logger.error(f"Failed to write {object_type}: {result.get('error')}")
+            return
+
+        id = result.get("id") or entry["record"].get("Id")
+        if "created" in result:
+            action = "created" if result["created"] else "updated"
+        state.update({"success": True, "id": id})
+        self.logger.info(f"{object_type} {action} with id: {id}")
+        try:
+            self.after_write(entry, id)
+        except Exception as e:
+            self.logger.exception(f"Error encountered after writing {object_type} {id}")
+            state.update({"success": False, "error": str(e)})
+
+    def after_write(self, entry, id):
+        """Hook for follow-up calls once a batched record has an id."""
+        pass
+
+    def after_batch(self, entries):
+        """Hook for follow-up calls batched across all records written in a batch."""
+        pass
+
     @property
     def authenticator(self):
-        url = self.url()
-        return SalesforceV3Authenticator(
-            self._target,
-            url
-        )
+        return self._target.authenticator
 
     @staticmethod
     def clean_dict_items(dict):
@@ -223,6 +941,10 @@ class SalesforceV3Sink(HotglueSink, RecordSink):
                 output[k] = v
         return output
 
+    def composite_url(self, endpoint):
+        """Return the url of `endpoint` as referenced by a composite subrequest."""
+        return f"/services/data/v{self.api_version}/{endpoint}"
+
     def url(self, endpoint=None):
         if not endpoint:
             endpoint = self.endpoint
@@ -239,73 +961,131 @@ class SalesforceV3Sink(HotglueSink, RecordSink):
         else:
             raise Exception(f"Invalid record: {record}")
 
+    @property
+    def sobject_name(self):
+        return self.endpoint.replace("sobjects/", "")
+
+    def describe_cache_key(self, object_type=None):
+        return (self.config.get("instance_url"), self.api_version, object_type or self.sobject_name)
+
+    def request_metadata(self, endpoint, cache_key):
+        """GET a metadata resource, revalidating the on-disk copy if there is one."""
+        disk = self._target.describe_cache.disk
+        cached = disk.load(cache_key) if disk else None
+        headers = {}
+        if cached:
+            headers["If-Modified-Since"] = cached["last_modified"]
+
+        fetched_at = formatdate(usegmt=True)
+        response = self.request_api("GET", endpoint, headers=headers)
+        if response.status_code == 304:
+            self.logger.info(f"Using cached metadata for {endpoint}, not modified since {cached['last_modified']}")
+            return cached["body"]
+
+        body = response.json()
+        if disk:
+            disk.save(cache_key, response.headers.get("Last-Modified") or fetched_at, body)
+        return body
+
+    def describe(self, object_type=None):
+        """Return the cached describe of an sObject, fetching it on first use."""
+        object_type = object_type or self.sobject_name
+        key = self.describe_cache_key(object_type)
+        return self._target.describe_cache.get(
+            key, lambda: self.request_metadata(f"sobjects/{object_type}/describe/", key)
+        )
+
+    def sobject_catalog(self):
+        """Return the name/label index of the org's sObjects, built once per run."""
+        key = (self.config.get("instance_url"), self.api_version)
+        return self._target.describe_cache.get_catalog(key, self.sobjects_list)
+
+    def sobjects_list(self):
+        """Return the org's global sObject list, fetched once per run."""
+        key = (self.config.get("instance_url"), self.api_version)
+        return self._target.describe_cache.get_sobjects(
+            key, lambda: self.request_metadata("sobjects/", key).get("sobjects", [])
+        )
+
     def sf_fields(self, object_type=None):
-        if not object_type:
-            sobject = self.request_api("GET", f"{self.endpoint}/describe/")
-        else:
-            sobject = self.request_api("GET", f"sobjects/{object_type}/describe/")
-        return [f for f in sobject.json()["fields"]]
+        return self.describe(object_type).fields
 
     def sf_fields_description(self, object_type=None):
-        fld = self.sf_fields(object_type=object_type)
-        fields = {}
-        fields["createable"] = [
-            f["name"] for f in fld if f["createable"] and not f["custom"]
-        ]
-        fields["custom"] = [
-            f["name"] for f in fld if f["custom"]
-        ]
-        fields["createable_not_default"] = [
-            f["name"]
-            for f in fld
-            if f["createable"] and not f["defaultedOnCreate"] and not f["custom"]
-        ]
-        fields["required"] = [
-            f["name"]
-            for f in fld
-            if not f["nillable"] and f["createable"] and not f["defaultedOnCreate"]
-        ]
-        fields["external_ids"] = [f["name"] for f in fld if f["externalId"]]
-        fields["pickable"] = {}
-        for field in fld:
-            if field["picklistValues"]:
-                fields["pickable"][field["name"]] = [
-                    p["label"] for p in field["picklistValues"] if p["active"]
-                ]
-        return fields
-
-    def get_pickable(self, record_field, sf_field, default=None, select_first=False):
-        fields_dict = self.sf_fields_description()
-        pickable_fields = fields_dict["pickable"]
-        if sf_field not in pickable_fields:
+        return self.describe(object_type).description
+
+    def record_type_picklists(self, record_type_id, object_type=None):
+        """Return the picklist indexes of a record type, fetched once per run.
+
+        A record type whose values can't be fetched has no indexes, and its
+        fields fall back to the describe picklists.
+        """
+        object_type = object_type or self.sobject_name
+        key = (*self.describe_cache_key(object_type), record_type_id)
+
+        def load():
+            try:
+                return self.request_api("GET", f"ui-api/object-info/{object_type}/picklist-values/{record_type_id}").json()
+            except Exception as e:
+                self.logger.warning(f"Could not fetch the picklist values of {object_type} record type {record_type_id}: {e}")
+                return {}
+
+        return self._target.describe_cache.get_record_type_picklists(key, load)
+
+    def get_pickable(self, record_field, sf_field, default=None, select_first=False, record_type_id=None, controlling_value=None, object_type=None):
+        """Map a value to the canonical label of a picklist option.
+
+        Values match options regardless of case and punctuation. With a
+        `record_type_id` only that record type's options are considered, and
+        for dependent picklists the option must be valid for
+        `controlling_value`.
+        """
+        index = self.record_type_picklists(record_type_id, object_type).get(sf_field) if record_type_id else None
+        if index is None:
+            index = self.describe(object_type).picklist(sf_field)
+        if index is None:
             return default
-        valid_options = [re.sub(r'\W+', '', choice).lower() for choice in pickable_fields[sf_field]]
-        nice_valid_options = [choice for choice in pickable_fields[sf_field]]
-
-        if record_field not in valid_options:
-            if select_first:
-                self.logger.warning(
-                    f"Using {nice_valid_options[0]} as {sf_field} {record_field} is not valid, valid values are {nice_valid_options}"
-                )
-                record_field = valid_options[0]
-            else:
-                record_field = default
-        else:
-            record_field = nice_valid_options[valid_options.index(record_field)]
-        return record_field
+
+        label = index.resolve(record_field, controlling_value)
+        if label is not None:
+            return label
+        label = index.first(controlling_value) if select_first else None
+        if label is None:
+            label = default
+        if select_first:
+            self.logger.warning(
+                f"Using {label} as {sf_field} {record_field} is not valid, valid values are {index.labels}"
+            )
+        return label
+
+    def resolve_picklists(self, mapping, sf_fields, object_type=None, record_type_id=None):
+        """Resolve the picklist values of `sf_fields` in `mapping`, in order.
+
+        Dependent picklists are checked against the value of their controlling
+        field in the mapping, so a controller listed earlier is resolved first.
+        """
+        fields = self.describe(object_type).fields_by_name
+        for sf_field in sf_fields:
+            controller = (fields.get(sf_field) or {}).get("controllerName")
+            mapping[sf_field] = self.get_pickable(
+                mapping.get(sf_field),
+                sf_field,
+                record_type_id=record_type_id,
+                controlling_value=mapping.get(controller) if controller else None,
+                object_type=object_type,
+            )
+        return mapping
 
     def sf_field_detais(self, field_name):
-        fields = self.sf_fields
-        return next((f for f in fields if f["name"] == field_name), None)
+        return self.describe().fields_by_name.get(field_name)
 
-    def validate_output(self, mapping):
+    def validate_output(self, mapping, object_type=None):
         mapping = self.clean_payload(mapping)
         payload = {}
-        fields_dict = self.sf_fields_description()
-        if not fields_dict["createable"]:
+        describe = self.describe(object_type)
+        if not describe.description["createable"]:
             raise NoCreatableFieldsException(f"No creatable fields for stream {self.name} stream, check your permissions")
         for k, v in mapping.items():
-            if k.endswith("__c") or k in fields_dict["createable"] + ["Id"]:
+            if k.endswith("__c") or k in describe.writable_fields:
                 payload[k] = v
 
         # required = self.sf_fields_description["required"]
@@ -314,6 +1094,86 @@ class SalesforceV3Sink(HotglueSink, RecordSink):
         #         raise MissingRequiredFieldException(req_field)
         return payload
 
+    def query_all(self, query, endpoint="query"):
+        """Yield every record of a SOQL query, following nextRecordsUrl.
+
+        Use `endpoint="queryAll"` to include deleted and archived records.
+        """
+        response = self.request_api("GET", endpoint=endpoint, params={"q": query}).json()
+        while True:
+            for record in response.get("records", []):
+                yield record
+            next_records_url = response.get("nextRecordsUrl")
+            if not next_records_url:
+                return
+            endpoint = next_records_url.split(f"/v{self.api_version}/", 1)[-1]
+            response = self.request_api("GET", endpoint=endpoint).json()
+
+    def query_in(self, object_type, fields, lookup_field, values, where=None, endpoint="query", order_by=None):
+        """Yield records whose `lookup_field` is in `values`.
+
+        Values are split across as few `IN (...)` queries as fit under
+        SOQL_MAX_LENGTH once URL encoded.
+        """
+        query = f"SELECT {', '.join(fields)} FROM {object_type} WHERE {lookup_field} IN ({{}})"
+        if where:
+            query += f" AND {where}"
+        if order_by:
+            query += f" ORDER BY {order_by}"
+        base_length = len(urllib.parse.quote(query))
+
+        chunk, length = [], base_length
+        for value in dict.fromkeys(values):
+            literal = soql_literal(value)
+            size = len(urllib.parse.quote(literal)) + 1
+            if chunk and length + size > SOQL_MAX_LENGTH:
+                yield from self.query_all(query.format(",".join(chunk)), endpoint)
+                chunk, length = [], base_length
+            chunk.append(literal)
+            length += size
+        if chunk:
+            yield from self.query_all(query.format(",".join(chunk)), endpoint)
+
+    def lookup_records(self, object_type, lookup_field, values, fields=("Id",)):
+        """Resolve many values of `lookup_field` to records in one pass.
+
+        Matches are memoized per run, so each value costs at most one share of
+        a chunked `IN` query. Values without a match are looked up again next
+        time, since the record may have been created in the meantime.
+        """
+        values = [v for v in values if v]
+        missing = [v for v in values if (object_type, lookup_field, str(v).lower()) not in self._lookups]
+        if missing:
+            select = list(dict.fromkeys(["Id", lookup_field, *fields]))
+            for record in self.query_in(object_type, select, lookup_field, missing):
+                key = (object_type, lookup_field, str(record.get(lookup_field)).lower())
+                self._lookups.setdefault(key, record)
+        return {v: self._lookups.get((object_type, lookup_field, str(v).lower())) for v in values}
+
+    def reference_index(self, object_type, case_insensitive=None, preload=True):
+        """Return the target's shared name to Id index of `object_type`.
+
+        Without `preload`, the index only ever queries the names it is asked for.
+        """
+        indexes = self._target.reference_indexes
+        index = indexes.get(object_type)
+        if index is None:
+            if case_insensitive is None:
+                case_insensitive = self.config.get("reference_case_insensitive", False)
+            index = indexes.setdefault(
+                object_type,
+                ReferenceIndex(
+                    object_type,
+                    case_insensitive=case_insensitive,
+                    preload_limit=int(self.config.get("reference_preload_limit", 50000)) if preload else 0,
+                ),
+            )
+        return index
+
+    def reference_id(self, object_type, name):
+        """Look up the Id of the `object_type` row called `name` in the shared index."""
+        return self.reference_index(object_type).get(self, name)
+
     def query_sobject(self, query, fields=None):
         params = {"q": query}
         response = self.request_api("GET", endpoint="query", params=params)
@@ -322,11 +1182,15 @@ class SalesforceV3Sink(HotglueSink, RecordSink):
             return response
         return [{k: v for k, v in r.items() if k in fields} for r in response]
 
-    def process_custom_fields(self, record) -> None:
+    def process_custom_fields(self, record, object_type=None) -> None:
         """
             Process the custom fields for Salesforce,
             creating unexsisting custom fields based on the present custom fields available in the record.
 
+            Batch modes only collect the names here, they are provisioned for
+            the whole batch before it is written. Record mode provisions the
+            record's fields as it goes.
+
             Inputs:
             - record
         """
@@ -336,35 +1200,74 @@ class SalesforceV3Sink(HotglueSink, RecordSink):
         if not self.config.get('create_custom_fields', False):
             return None
 
-        # Checking if the custom fields already exist in
-        fields_dict = self.sf_fields_description()
-        salesforce_custom_fields = fields_dict['custom']
-
-        for cf in record:
-            cf_name = cf['name']
-            if not cf_name.endswith('__c'):
-                cf_name+='__c'
-            if cf_name not in salesforce_custom_fields:
-                # If there's a custom field in the record that is not in Salesforce
-                # create it
-                self.add_custom_field(cf['name'], label = cf.get('label'))
+        fields = {cf['name']: cf.get('label') for cf in record}
+        if self.is_buffered:
+            pending = self._pending_custom_fields.setdefault(object_type or self.sobject_name, {})
+            for name, label in fields.items():
+                pending.setdefault(name, label)
+            return None
 
+        self.provision_custom_fields({object_type or self.sobject_name: fields})
         return None
 
-    def add_custom_field(self,cf,label=None):
-        if not label:
-            label = cf
+    def provision_custom_fields(self, fields_by_object):
+        """Create the custom fields missing on each sObject, diffed against its describe in one pass.
+
+        Inputs:
+        - fields_by_object: dict of sObject name to a dict of field name to label
+        """
+        for object_type, fields in fields_by_object.items():
+            # Checking if the custom fields already exist in
+            salesforce_custom_fields = set(self.sf_fields_description(object_type)['custom'])
+            missing = [
+                (name, label) for name, label in fields.items()
+                if (name if name.endswith('__c') else name + '__c') not in salesforce_custom_fields
+            ]
+            if missing:
+                # If there are custom fields in the records that are not in Salesforce
+                # create them
+                self.add_custom_fields(missing, object_type)
+
+    def provision_pending_custom_fields(self):
+        """Create the custom fields collected from a buffered batch."""
+        pending, self._pending_custom_fields = self._pending_custom_fields, {}
+        if pending:
+            self.provision_custom_fields(pending)
+
+    def add_custom_fields(self, fields, object_type=None):
+        """
+            Create text custom fields with the Metadata API and grant access to them.
 
-        if not cf.endswith('__c'):
-            cf += '__c'
+            Inputs:
+            - fields: list of (name, label) tuples
+            - object_type: the sObject to add them to, the sink's by default
+        """
+        sobject = object_type or self.sobject_name
+        # If it's a task's custom field we need to create it under
+        # `Activity` sObject, so we change `Task` -> `Activity`
+        metadata_sobject = 'Activity' if sobject == 'Task' else sobject
+
+        names = []
+        for cf, label in fields:
+            label = label or cf
+            if not cf.endswith('__c'):
+                cf += '__c'
+            names.append((cf, label))
+
+        created = []
+        for chunk in chunked(names, self.METADATA_BATCH_SIZE):
+            created += self.create_custom_field_metadata(metadata_sobject, chunk)
+
+        # the permissions are set on the Task sObject, not on `Activity`
+        self.grant_field_permissions(sobject, [f"{sobject}.{cf}" for cf in created])
+
+        # the cached describe no longer lists every custom field
+        self._target.describe_cache.invalidate(self.describe_cache_key(sobject))
+
+    def create_custom_field_metadata(self, sobject, fields):
+        """Send one SOAP createMetadata call for up to 10 fields and return the names created."""
         # Getting token and building the payload
         access_token = self.http_headers['Authorization'].replace('Bearer ','')
-        sobject = self.endpoint.replace('sobjects/','')
-
-        if sobject == 'Task':
-            # If it's a task's custom field we need to create it under
-            # `Activity` sObject, so we change `Task` -> `Activity`
-            sobject = 'Activity'
 
         url = self.url(
             f"services/Soap/m/{self.api_version}"
@@ -372,8 +1275,18 @@ class SalesforceV3Sink(HotglueSink, RecordSink):
             f'services/data/v{self.api_version}/',''
         )
 
-        # If the new custom field is an external id it needs to contain 'externalid'
-        external_id = 'true' if 'externalid' in cf.lower() else 'false'
+        metadata = ""
+        for cf, label in fields:
+            # If the new custom field is an external id it needs to contain 'externalid'
+            external_id = 'true' if 'externalid' in cf.lower() else 'false'
+            metadata += f"""
+                                <metadata xsi:type="CustomField">
+                                    <fullName>{sobject}.{cf}</fullName>
+                                    <label>{xml_escape(label)}</label>
+                                    <externalId>{external_id}</externalId>
+                                    <type>Text</type>
+                                    <length>100</length>
+                                </metadata>"""
 
         xml_payload = f"""<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/">
                             <s:Header>
@@ -386,58 +1299,64 @@ class SalesforceV3Sink(HotglueSink, RecordSink):
                             </s:Header>
                             <s:Body xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"
                                 xmlns:xsd="http://www.w3.org/2001/XMLSchema">
-                                <createMetadata xmlns="http://soap.sforce.com/2006/04/metadata">
-                                <metadata xsi:type="CustomField">
-                                    <fullName>{sobject}.{cf}</fullName>
-                                    <label>{label}</label>
-                                    <externalId>{external_id}</externalId>
-                                    <type>Text</type>
-                                    <length>100</length>
-                                </metadata>
+                                <createMetadata xmlns="http://soap.sforce.com/2006/04/metadata">{metadata}
                                 </createMetadata>
                             </s:Body>
                         </s:Envelope>"""
 
-        response = requests.request(
-            method="POST",
-            url=url,
+        response = self._target.limiter.request(
+            self.session,
+            "POST",
+            url,
             headers={'Content-Type':"text/xml","SOAPAction":'""'},
             data=xml_payload
         )
         self.validate_response(response)
 
-        # update field permissions for custom field per profile
-        if sobject == 'Activity':
-            # But then, we need to add the permissions to the Task sObject
-            # So we change it back again from `Activity` -> `Task`
-            sobject = 'Task'
-        for permission_set_id in getattr(self, "permission_set_ids", []):
-            self.update_field_permissions(permission_set_id, sobject_type=sobject, field_name=f"{sobject}.{cf}")
-
-    def update_field_permissions(self,permission_set_id, sobject_type, field_name):
-        payload = {
-            "allOrNone": True,
-            "compositeRequest": [
-                {
-                    "referenceId": "NewFieldPermission",
-                    "body": {
-                        "ParentId": permission_set_id,
-                        "SobjectType": sobject_type,
-                        "Field": field_name,
-                        "PermissionsEdit": "true",
-                        "PermissionsRead": "true"
-                    },
-                    "url": f"/services/data/v{self.api_version}/sobjects/FieldPermissions/",
-                    "method": "POST"
-                }
-            ]
-        }
-
-        response = self.request_api("POST", endpoint="composite", request_data=payload, headers={"Content-Type": "application/json"})
-        self.logger.info(f"Field permission for {field_name} updated for permission set {permission_set_id}, response: {response.text}")
-    
+        # one result per field, in the order they were sent
+        created = []
+        results = ElementTree.fromstring(response.content).iter("{http://soap.sforce.com/2006/04/metadata}result")
+        for (cf, _), result in zip(fields, results):
+            success = result.findtext("{http://soap.sforce.com/2006/04/metadata}success") == "true"
+            message = result.findtext(".//{http://soap.sforce.com/2006/04/metadata}message")
+            if success:
+                self.logger.info(f"Custom field {sobject}.{cf} created")
+                created.append(cf)
+            elif message and "already" in message.lower():
+                created.append(cf)
+            else:
+                self.logger.error(f"Could not create custom field {sobject}.{cf}: {message}")
+        return created
+
+    def grant_field_permissions(self, sobject_type, field_names):
+        """Give every permission set read and edit access to `field_names`, 200 FieldPermissions per call."""
+        records = [
+            {
+                "attributes": {"type": "FieldPermissions"},
+                "ParentId": permission_set_id,
+                "SobjectType": sobject_type,
+                "Field": field_name,
+                "PermissionsEdit": True,
+                "PermissionsRead": True,
+            }
+            for field_name in field_names
+            for permission_set_id in self.permission_set_ids
+        ]
+        for chunk in chunked(records, self.COLLECTIONS_BATCH_SIZE):
+            response = self.request_api(
+                "POST", endpoint="composite/sobjects", request_data={"allOrNone": False, "records": chunk}
+            )
+            failed = [result for result in response.json() if not result.get("success")]
+            self.logger.info(
+                f"Field permissions for {sobject_type} updated for {len(chunk) - len(failed)} of {len(chunk)} permission set fields"
+            )
+            if failed:
+                self.logger.debug(f"Field permissions not updated: {failed}")
 
     def map_only_empty_fields(self, mapping, sobject_name, lookup_field):       
+        # batch modes compare the whole drained batch at once in prepare_batch
+        if self.is_buffered:
+            return mapping
         fields = ",".join([field for field in mapping.keys()])
         data = self.query_sobject(
             query = f"SELECT {fields} from {sobject_name} WHERE {lookup_field}",
@@ -446,20 +1365,9 @@ class SalesforceV3Sink(HotglueSink, RecordSink):
             mapping = {k:v for k,v in mapping.items() if not data[0].get(k) or k == "Id"}
         return mapping
     
-    def read_json_file(self, filename):
-        # read file
-        with open(os.path.join(__location__, f"{filename}"), "r") as filetoread:
-            data = filetoread.read()
-
-        # parse file
-        content = json.loads(data)
-
-        return content
-    
     def map_country(self, country):
         if country:
-            countries = self.read_json_file("countries.json")
-            mapped_country = countries.get(country) or (country if country in countries.values() else None)
+            mapped_country = lookup_country(country)
             if not mapped_country:
                 self.logger.info(f"Country '{country}' is not a valid value, not sending country in the payload.")
             return mapped_country
\ No newline at end of file
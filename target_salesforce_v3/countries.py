@@ -0,0 +1,82 @@
+"""Country code and name lookup built from countries.json."""
+
+from __future__ import annotations
+
+import json
+import os
+from functools import lru_cache
+
+COUNTRIES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "countries.json")
+
+# common spellings that differ from the names in countries.json
+ALIASES = {
+    "usa": "US",
+    "u.s.a.": "US",
+    "u.s.": "US",
+    "united states of america": "US",
+    "america": "US",
+    "uk": "GB",
+    "u.k.": "GB",
+    "great britain": "GB",
+    "britain": "GB",
+    "england": "GB",
+    "scotland": "GB",
+    "wales": "GB",
+    "northern ireland": "GB",
+    "south korea": "KR",
+    "korea": "KR",
+    "north korea": "KP",
+    "russia": "RU",
+    "iran": "IR",
+    "vietnam": "VN",
+    "czechia": "CZ",
+    "holland": "NL",
+    "the netherlands": "NL",
+    "uae": "AE",
+    "taiwan": "TW",
+    "syria": "SY",
+    "laos": "LA",
+    "moldova": "MD",
+    "tanzania": "TZ",
+    "ivory coast": "CI",
+    "cote d'ivoire": "CI",
+    "côte d'ivoire": "CI",
+    "democratic republic of the congo": "CD",
+    "dr congo": "CD",
+    "macedonia": "MK",
+    "north macedonia": "MK",
+    "micronesia": "FM",
+    "palestine": "PS",
+    "brunei": "BN",
+    "eswatini": "SZ",
+    "türkiye": "TR",
+    "cabo verde": "CV",
+    "burma": "MM",
+}
+
+
+@lru_cache(maxsize=None)
+def country_index() -> tuple:
+    """Load countries.json once and index it.
+
+    Returns the code to name map, plus a case-insensitive lookup from any
+    code, name or alias to the canonical name.
+    """
+    with open(COUNTRIES_FILE) as f:
+        code_to_name = json.load(f)
+
+    lookup = {}
+    for code, name in code_to_name.items():
+        lookup[code.casefold()] = name
+        lookup.setdefault(name.casefold(), name)
+    for alias, code in ALIASES.items():
+        if code in code_to_name:
+            lookup.setdefault(alias, code_to_name[code])
+    return code_to_name, lookup
+
+
+def lookup_country(value: str):
+    """Return the canonical country name for a code, name or alias, if known."""
+    if not value:
+        return None
+    return country_index()[1].get(value.strip().casefold())
@@ -0,0 +1,119 @@
+"""Adaptive limit on the requests in flight across all sinks of a target."""
+
+from __future__ import annotations
+
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+
+def retry_after_seconds(value) -> float:
+    """Parse a Retry-After header, given in seconds or as an HTTP date."""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max((parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def response_feedback(response, latency) -> dict:
+    """How a response should adapt the limiter: latency, throttling and Retry-After."""
+    if response is None:
+        return {}
+    throttled = response.status_code in [429, 503] or (
+        response.status_code == 403 and "REQUEST_LIMIT_EXCEEDED" in response.text
+    )
+    return {
+        "latency": latency,
+        "throttled": throttled,
+        "retry_after": retry_after_seconds(response.headers.get("Retry-After")),
+    }
+
+
+class AdaptiveLimiter:
+    """AIMD limit on concurrent requests, shared by every sink of a target.
+
+    The limit halves when Salesforce throttles (429, 503 or
+    REQUEST_LIMIT_EXCEEDED), at most once per `cooldown` seconds. It grows by
+    about one request per round trip while the recent latency stays within
+    `tolerance` of the long-run latency. A Retry-After pauses every new
+    request until it has passed.
+    """
+
+    def __init__(
+        self,
+        initial: int,
+        minimum: int = 1,
+        maximum: int = None,
+        decrease_factor: float = 0.5,
+        tolerance: float = 1.5,
+        cooldown: float = 5.0,
+    ) -> None:
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum or initial
+        self.decrease_factor = decrease_factor
+        self.tolerance = tolerance
+        self.cooldown = cooldown
+        self.in_flight = 0
+        # recent and long-run moving averages of the request latency
+        self.latency = None
+        self.baseline_latency = None
+        self.paused_until = 0.0
+        self._last_decrease = float("-inf")
+        self._condition = threading.Condition()
+
+    def _available(self) -> bool:
+        return self.in_flight < max(int(self.limit), self.minimum) and time.monotonic() >= self.paused_until
+
+    def try_acquire(self) -> bool:
+        """Take a slot if one is free, without waiting."""
+        with self._condition:
+            if not self._available():
+                return False
+            self.in_flight += 1
+            return True
+
+    def acquire(self) -> None:
+        """Wait for a free slot and take it."""
+        with self._condition:
+            while not self._available():
+                self._condition.wait(max(self.paused_until - time.monotonic(), 0.05))
+            self.in_flight += 1
+
+    def release(self, latency: float = None, throttled: bool = False, retry_after: float = None) -> None:
+        """Give a slot back and adapt the limit to how the request went."""
+        with self._condition:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if retry_after:
+                self.paused_until = max(self.paused_until, now + retry_after)
+            if throttled:
+                if now - self._last_decrease >= self.cooldown:
+                    self.limit = max(self.limit * self.decrease_factor, float(self.minimum))
+                    self._last_decrease = now
+            elif latency is not None:
+                if self.latency is None:
+                    self.latency = self.baseline_latency = latency
+                self.latency = 0.8 * self.latency + 0.2 * latency
+                self.baseline_latency = 0.98 * self.baseline_latency + 0.02 * latency
+                if self.latency <= self.baseline_latency * self.tolerance:
+                    self.limit = min(self.limit + 1 / self.limit, float(self.maximum))
+            self._condition.notify_all()
+
+    def request(self, session, method, url, **kwargs):
+        """Send a request through `session` in a free slot and adapt the limit to its response."""
+        self.acquire()
+        started = time.monotonic()
+        response = None
+        try:
+            response = session.request(method=method, url=url, **kwargs)
+        finally:
+            self.release(**response_feedback(response, time.monotonic() - started))
+        return response
@@ -0,0 +1,129 @@
+"""Daily API quota tracking and per-run call budgets."""
+
+from __future__ import annotations
+
+import logging
+import math
+import threading
+import time
+
+
+class QuotaGovernor:
+    """Track the org's daily API usage and the calls made by this run.
+
+    Usage comes from `/limits` when the first batch starts and from the
+    Sforce-Limit-Info header of every response after that. Before each batch
+    is written, `allows` projects the calls it needs from the stream's calls
+    per record so far. It checks the projection against three limits: the
+    quota threshold, the run budget and the stream's budget. Once a limit
+    would be passed, the stream (or the whole run) stops and writes nothing
+    more.
+    """
+
+    def __init__(
+        self,
+        quota_percent: float = 80,
+        run_budget: int = None,
+        stream_budgets: dict = None,
+        logger: logging.Logger = None,
+    ) -> None:
+        self.quota_percent = quota_percent
+        self.run_budget = run_budget
+        self.stream_budgets = stream_budgets or {}
+        self.logger = logger or logging.getLogger(__name__)
+        self.used = None
+        self.allotted = None
+        self.run_calls = 0
+        self.stream_calls = {}
+        self.stream_records = {}
+        # stream (None for the whole run) -> why it was stopped
+        self.stopped = {}
+        self._first = None
+        self._started = False
+        # re-entrant, `start` observes its own request
+        self._lock = threading.RLock()
+
+    def start(self, sink) -> None:
+        """Read the org's daily API usage from `/limits`, once per run."""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+            try:
+                limits = sink.request_api("GET", endpoint="limits").json()["DailyApiRequests"]
+            except Exception as e:
+                self.logger.warning(f"Could not read the daily API limits: {e}")
+                return
+            self.observe(None, limits["Max"] - limits["Remaining"], limits["Max"], count_call=False)
+            self.logger.info(f"Used {self.used} of {self.allotted} daily REST API quota at startup")
+
+    def observe(self, stream, used=None, allotted=None, count_call=True) -> None:
+        """Count a call made for `stream` and the usage its response reported."""
+        with self._lock:
+            if count_call:
+                self.run_calls += 1
+                self.stream_calls[stream] = self.stream_calls.get(stream, 0) + 1
+            if used is not None:
+                self.used, self.allotted = used, allotted
+                if self._first is None:
+                    self._first = (time.time(), used)
+
+    def record_written(self, stream, count: int) -> None:
+        with self._lock:
+            self.stream_records[stream] = self.stream_records.get(stream, 0) + count
+
+    def calls_per_record(self, stream) -> float:
+        records = self.stream_records.get(stream)
+        if not records:
+            return 1.0
+        return self.stream_calls.get(stream, 0) / records
+
+    def remaining(self, stream) -> tuple:
+        """Return the smallest number of calls left under any limit, and which limit it is."""
+        limits = []
+        if self.used is not None and self.allotted:
+            limits.append((self.allotted * self.quota_percent / 100 - self.used, f"{self.quota_percent}% of the daily API quota"))
+        if self.run_budget is not None:
+            limits.append((self.run_budget - self.run_calls, f"the run budget of {self.run_budget} calls"))
+        if stream in self.stream_budgets:
+            budget = self.stream_budgets[stream]
+            limits.append((budget - self.stream_calls.get(stream, 0), f"the {stream} budget of {budget} calls"))
+        if not limits:
+            return None, None
+        return min(limits, key=lambda limit: limit[0])
+
+    def usage_rate(self):
+        """Org-wide calls per minute since the first observation, once a minute has passed."""
+        if self._first is None or self.used is None:
+            return None
+        elapsed = time.time() - self._first[0]
+        if elapsed < 60:
+            return None
+        return (self.used - self._first[1]) * 60 / elapsed
+
+    def allows(self, stream, record_count: int) -> bool:
+        """Whether `record_count` more records of `stream` fit in every limit."""
+        with self._lock:
+            if self.stop_reason(stream):
+                return False
+            remaining, limit = self.remaining(stream)
+            if remaining is None:
+                return True
+            needed = math.ceil(record_count * self.calls_per_record(stream))
+            if needed <= remaining:
+                return True
+
+            per_stream = limit.startswith(f"the {stream} budget")
+            reason = (
+                f"Stopping {stream if per_stream else 'the run'}: writing {record_count} more records would take "
+                f"about {needed} API calls, but only {max(int(remaining), 0)} are left under {limit}."
+            )
+            rate = self.usage_rate()
+            if rate is not None:
+                reason += f" The org is using {rate:.1f} calls per minute."
+            self.stopped[stream if per_stream else None] = reason
+            self.logger.warning(reason)
+            return False
+
+    def stop_reason(self, stream):
+        return self.stopped.get(None) or self.stopped.get(stream)
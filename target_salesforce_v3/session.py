@@ -0,0 +1,30 @@
+"""HTTP session shared by all API traffic of a target."""
+
+from __future__ import annotations
+
+import gzip
+import json
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+def build_session(pool_size: int) -> requests.Session:
+    """Build a keep-alive session with a connection pool of `pool_size`.
+
+    The pool is sized so every sink drained in parallel can hold a connection
+    to the instance without opening a new TCP+TLS handshake per request.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update(
+        {"Accept-Encoding": "gzip, deflate", "Connection": "keep-alive"}
+    )
+    return session
+
+
+def gzip_json(data) -> bytes:
+    """Serialize `data` as a gzip-compressed JSON request body."""
+    return gzip.compress(json.dumps(data).encode("utf-8"))
@@ -2,8 +2,9 @@
 from __future__ import annotations
 
 import json
-import urllib
-from target_salesforce_v3.client import SalesforceV3Sink
+import re
+import urllib.parse
+from target_salesforce_v3.client import RECORD_CONTEXT_KEY, SalesforceV3Sink, chunked, match_key, soql_literal
 
 from hotglue_models_crm.crm import Contact, Company, Deal, Campaign,Activity
 from backports.cached_property import cached_property
@@ -21,17 +22,9 @@ class ContactsSink(SalesforceV3Sink):
     endpoint = "sobjects/Contact"
     unified_schema = Contact
     name = Contact.Stream.name
-    campaigns = None
-    topics = None
     contact_type = "Contact"
     available_names = ["contacts", "customers"]
-
-    @cached_property
-    def reference_data(self):
-        params = {"q": "SELECT id, name from Account"}
-        response = self.request_api("GET", endpoint="query", params=params)
-        response = response.json()["records"]
-        return [{k: v for k, v in r.items() if k in ["Id", "Name"]} for r in response]
+    non_updatable_fields = []
 
     def preprocess_record(self, record: dict, context: dict):
 
@@ -48,20 +41,12 @@ class ContactsSink(SalesforceV3Sink):
         if record.get("company") and not record.get("company_name"):
             record["company_name"] = record["company"]
 
+        # not part of the unified schema
+        record_type_id = record.get("record_type_id")
         record = self.validate_input(record)
 
         # Handles creation/update of Leads and Contacts
-        if record.get("type") == "lead":
-            self.contact_type = "Lead"
-            self.endpoint = "sobjects/Lead"
-        else:
-            self.contact_type = "Contact"
-            self.endpoint = "sobjects/Contact"
-
-        lead_source = self.get_pickable(record.get("lead_source"), "LeadSource")
-        salutation = self.get_pickable(record.get("salutation"), "Salutation")
-        industry = self.get_pickable(record.get("industry"), "Industry")
-        rating = self.get_pickable(record.get("rating"), "Rating")
+        contact_type = "Lead" if record.get("type") == "lead" else "Contact"
 
         birthdate = record.get("birthdate")
         if birthdate is not None:
@@ -76,8 +61,8 @@ class ContactsSink(SalesforceV3Sink):
             "Email": record.get("email"),
             "Title": record.get("title"),
             "Description": record.get("description"),
-            "LeadSource": lead_source,
-            "Salutation": salutation,
+            "LeadSource": record.get("lead_source"),
+            "Salutation": record.get("salutation"),
             "Birthdate": birthdate,
             "OwnerId": record.get("owner_id"),
             "HasOptedOutOfEmail": record.get("unsubscribed")
@@ -85,20 +70,24 @@ class ContactsSink(SalesforceV3Sink):
             else record.get("subscribe_status") == "unsubscribed",            
             "NumberOfEmployees": record.get("number_of_employees"),
             "Website": record.get("website"),
-            "Industry": industry,
+            "Industry": record.get("industry"),
             "Company": record.get("company_name"),
-            "Rating": rating,
+            "Rating": record.get("rating"),
             "AnnualRevenue": record.get("annual_revenue"),
+            "RecordTypeId": record_type_id,
         }
+        self.resolve_picklists(
+            mapping, ["LeadSource", "Salutation", "Industry", "Rating"], contact_type, record_type_id
+        )
 
         mapping_copy = mapping.copy()
         for key,value in mapping_copy.items():
             if value is None: mapping.pop(key)
         del mapping_copy
 
-        if self.contact_type == "Contact":
+        if contact_type == "Contact":
             mapping.update({"Department": record.get("department")})
-        elif self.contact_type == "Lead":
+        elif contact_type == "Lead":
             mapping.update({"Company": record.get("company_name")})
 
 
@@ -114,35 +103,31 @@ class ContactsSink(SalesforceV3Sink):
             lookup_field = f"{external_id['name']} = '{external_id['value']}'"
         else:
             # If no Id we'll use email to search for an existing record
-            if record.get('email'):
+            # Batch modes resolve emails for the whole drained batch at once
+            if record.get('email') and not self.is_buffered:
                 # Get contact_id based on email
-                data = self.query_sobject(
-                    query = f"SELECT Name, Id from {self.contact_type} WHERE Email = '{record.get('email')}'",
-                    fields = ['Name', 'Id']
-                )
-                if data:
-                    id = data[0].get("Id")
+                match = self.lookup_records(contact_type, "Email", [record["email"]])[record["email"]]
+                if match:
+                    id = match["Id"]
                     mapping.update({"Id":id})
                     lookup_field = f"Id = '{id}'"
 
         # We map tags => topics in Salesforce
-        if record.get('tags'):
-            self.topics = record['tags']
+        topics = record.get('tags') or None
 
         # We map campaigns => campaigns in Salesforce
-        if record.get('campaigns'):
-            self.campaigns = record['campaigns']
+        campaigns = record.get('campaigns') or None
 
         # We map lists => campaigns in Salesforce
-        if not self.campaigns and record.get("lists"):
-            self.campaigns = [{"name": list_item} for list_item in record.get("lists")]
+        if not campaigns and record.get("lists"):
+            campaigns = [{"name": list_item} for list_item in record.get("lists")]
 
         if record.get("addresses"):
             address = record["addresses"][0]
             street = " - ".join(
                 [v for k, v in address.items() if "line" in k and v is not None]
             )
-            if self.contact_type == "Contact":
+            if contact_type == "Contact":
                 _prefix = "Mailing"
             else: _prefix = ""
 
@@ -152,7 +137,7 @@ class ContactsSink(SalesforceV3Sink):
             mapping[f"{_prefix}PostalCode"] = address.get("postal_code")
             mapping[f"{_prefix}Country"] = self.map_country(address.get("country"))
 
-        if record.get("addresses") and len(record["addresses"]) >= 2 and self.contact_type == 'Contact':
+        if record.get("addresses") and len(record["addresses"]) >= 2 and contact_type == 'Contact':
             # Leads only have one address
             address = record["addresses"][1]
             street = " - ".join(
@@ -181,27 +166,24 @@ class ContactsSink(SalesforceV3Sink):
             mapping[phone_type] = phone.get("number")
 
         if record.get("custom_fields"):
-            self.process_custom_fields(record["custom_fields"])
+            self.process_custom_fields(record["custom_fields"], contact_type)
             for cf in record.get("custom_fields"):
                 if not cf['name'].endswith('__c'):
                     cf['name'] += '__c'
                 mapping.update({cf['name']:cf['value']})
 
         if not mapping.get("AccountId") and record.get("company_name"):
-            account_id = (
-                r["Id"]
-                for r in self.reference_data
-                if r["Name"] == record["company_name"]
-            )
-            mapping["AccountId"] = next(account_id, None)
+            mapping["AccountId"] = self.reference_id("Account", record["company_name"])
 
         # validate mapping
-        mapping = self.validate_output(mapping)
+        mapping = self.validate_output(mapping, contact_type)
         
         # If flag only_upsert_empty_fields is true, only upsert empty fields
         if self.config.get("only_upsert_empty_fields") and lookup_field:
-            mapping = self.map_only_empty_fields(mapping, self.contact_type, lookup_field)
+            mapping = self.map_only_empty_fields(mapping, contact_type, lookup_field)
 
+        # per-record attributes travel with the record so records can be written concurrently
+        mapping[RECORD_CONTEXT_KEY] = {"contact_type": contact_type, "campaigns": campaigns, "topics": topics}
         return mapping
 
     def upsert_record(self, record, context):
@@ -210,53 +192,97 @@ class ContactsSink(SalesforceV3Sink):
         # Getting custom fields from record
         # self.process_custom_fields(record)
 
+        record_context = record.pop(RECORD_CONTEXT_KEY, None) or {}
+        contact_type = record_context.get("contact_type", self.contact_type)
+        endpoint = f"sobjects/{contact_type}"
+        campaigns = record_context.get("campaigns")
+        topics = record_context.get("topics")
+
         if record.get("Id"):
             fields = ["Id"]
         else:
-            fields_dict = self.sf_fields_description()
-            fields = fields_dict["external_ids"]
-
-        for field in fields:
-            if record.get(field):
-                try:
-                    update_record = record.copy()
-                    id = update_record.pop(field)
-                    if update_record:
-                        url = "/".join([self.endpoint, field, record[field]])
-
-                        response = self.request_api(
-                            "PATCH", endpoint=url, request_data=update_record
-                        )
-                        id = response.json().get("id")
-                    self.logger.info(f"{self.name} updated with id: {id}")
-                    record = None
-
-                    # Check for campaigns to be added
-                    if self.campaigns:
-                        self.assign_to_campaign(id,self.campaigns)
-
-                    if self.topics:
-                        self.assign_to_topic(id,self.topics)
-
-                    return id, True, state_updates
-                except Exception as e:
-                    self.logger.exception(f"Could not PATCH to {url}: {e}")
-                    raise e
-        if record:
-            try:
-                response = self.request_api("POST", request_data=record)
-                id = response.json().get("id")
-                self.logger.info(f"{self.contact_type} created with id: {id}")
-                # Check for campaigns to be added
-                if self.campaigns:
-                    self.assign_to_campaign(id,self.campaigns)
+            # one PATCH on the stream's external id creates or updates the record
+            fields = [self.external_id_field(record, contact_type)]
+
+        # the contact and its campaign members and topic assignments go out
+        # as one composite request, members reference the contact's id
+        contact_request = None
+        id = None
+        field = next((field for field in fields if record.get(field)), None)
+        if field:
+            update_record = record.copy()
+            id = update_record.pop(field)
+            if update_record:
+                value = urllib.parse.quote(str(record[field]), safe="")
+                contact_request = {
+                    "method": "PATCH",
+                    "url": self.composite_url(f"{endpoint}/{field}/{value}"),
+                    "referenceId": "contact",
+                    "body": update_record,
+                }
+        elif record:
+            contact_request = {
+                "method": "POST",
+                "url": self.composite_url(endpoint),
+                "referenceId": "contact",
+                "body": record,
+            }
+        else:
+            return None, False, state_updates
 
-                if self.topics:
-                    self.assign_to_topic(id,self.topics)
-                return id, True, state_updates
-            except Exception as e:
-                self.logger.exception("Error while attempting to create Contact")
-                raise e
+        contact_ref = "@{contact.id}" if contact_request else id
+        assignments = self.assignment_requests(contact_ref, campaigns, topics, contact_type)
+        try:
+            id = self.send_contact_requests(contact_request, id, assignments)
+        except Exception as e:
+            self.logger.exception(f"Error while attempting to write {contact_type}")
+            raise e
+        self.logger.info(f"{contact_type} {'updated' if field else 'created'} with id: {id}")
+        return id, True, state_updates
+
+    def buffer_entry(self, record):
+        entry = super().buffer_entry(record)
+        entry["object_type"] = entry["context"].get("contact_type", self.contact_type)
+        return entry
+
+    def prepare_batch(self, entries):
+        """Resolve the Ids of buffered contacts and leads by email, one IN query per chunk."""
+        pending = {}
+        for entry in entries:
+            record = entry["record"]
+            if record.get("Email") and not record.get("Id") and not self.entry_external_id(entry):
+                pending.setdefault(entry["object_type"], []).append(entry)
+
+        for object_type, group in pending.items():
+            matches = self.lookup_records(object_type, "Email", [entry["record"]["Email"] for entry in group])
+            for entry in group:
+                match = matches.get(entry["record"]["Email"])
+                if match:
+                    entry["record"]["Id"] = match["Id"]
+                    entry["raw"]["Id"] = match["Id"]
+
+        # warm the campaign and topic indexes with the batch's names at once
+        campaign_names, topic_names = [], []
+        for entry in entries:
+            record_context = entry["context"]
+            campaign_names += [c.get("name") for c in record_context.get("campaigns") or [] if c.get("id") is None]
+            topic_names += record_context.get("topics") or []
+        if campaign_names:
+            self.reference_index("Campaign", case_insensitive=True, preload=False).resolve(self, campaign_names)
+        if topic_names:
+            self.reference_index("Topic", case_insensitive=True, preload=False).resolve(self, topic_names)
+        super().prepare_batch(entries)
+
+    def has_follow_up(self, entry):
+        return bool(entry["context"].get("campaigns") or entry["context"].get("topics"))
+
+    def after_write(self, entry, id):
+        record_context = entry["context"]
+        assignments = self.assignment_requests(
+            id, record_context.get("campaigns"), record_context.get("topics"), entry["object_type"]
+        )
+        if assignments:
+            self.send_contact_requests(None, id, assignments)
 
     def validate_response(self, response):
         """Validate HTTP response."""
@@ -269,7 +295,7 @@ class ContactsSink(SalesforceV3Sink):
             elif '[{"errorCode":"NOT_FOUND","message":"The requested resource does not exist"}]' in response.text:
                 self.logger.info("INFO: This Contact/Lead was not found using Email will attempt to create it.")
             elif '[{"message":"No such column \'HasOptedOutOfEmail\' on sobject of type' in response.text:
-                self.update_field_permissions(profile = 'System Administrator', sobject_type = self.contact_type, field_name=f"{self.contact_type}.HasOptedOutOfEmail")
+                self.grant_opted_out_permission(response.text)
                 raise RetriableAPIError(f"DEBUG: HasOptedOutOfEmail column was not found, updating 'Field-Leve Security'\n'System Administrator'[x]")
             else:
                 try:
@@ -278,108 +304,135 @@ class ContactsSink(SalesforceV3Sink):
                     msg = self.response_error_message(response)
                 raise FatalAPIError(msg)
 
-    def assign_to_topic(self,contact_id,topics:list) -> None:
-        """
-        This function recieves a contact_id and a list of topics and assigns the contact_id to each topic
+    def grant_opted_out_permission(self, message):
+        """Grant access to the HasOptedOutOfEmail field of the sObject named in `message`."""
+        match = re.search(r"on sobject of type (\w+)", message)
+        contact_type = match.group(1) if match else self.contact_type
+        self.grant_field_permissions(contact_type, [f"{contact_type}.HasOptedOutOfEmail"])
+
+    # SOQL compares names case-insensitively, so the indexes do too
+    def topic_id(self, topic) -> str:
+        """Return the Id of the topic named `topic`, creating it once if it doesn't exist."""
+        return self.reference_index("Topic", case_insensitive=True, preload=False).get_or_create(
+            self, topic, lambda name: self.create_named("Topic", name)
+        )
+
+    def campaign_id(self, campaign) -> str:
+        """Return the Id of a campaign, looked up by name and created once if it doesn't exist.
 
         Input:
-        contact_id : str
-        topics : list[str]
+        campaign : dict eg. {'id': None, 'name': 'Big Campaign'}
         """
+        # Assuming campaigns are always created first
+        if campaign.get("id") is not None:
+            return campaign["id"]
+        return self.reference_index("Campaign", case_insensitive=True, preload=False).get_or_create(
+            self, campaign.get("name"), lambda name: self.create_named("Campaign", name)
+        )
 
-        for topic in topics:
-            # data = self.get_query(endpoint=f"sobjects/Campaign/Name/{campaign.get('name')}")
-            data = self.query_sobject(
-                query = f"SELECT Id, CreatedDate from Topic WHERE Name = '{topic}' ORDER BY CreatedDate ASC",
-                fields = ['Id']
-                )
-            # Extract topic id from record
-            if not data:
-                self.logger.info(f"No topic found with Name = '{topic}'\nCreating topic ...")
-                # Create the topic since it doesn't exist
-                response = self.request_api("POST", endpoint="sobjects/Topic", request_data={
-                    "Name": topic,
-                })
-                id = response.json().get("id")
-                self.logger.info(f"{self.name} created with id: {id}")
-                topic_id = id
-            else:
-                topic_id = data[0]['Id']
-
-            # Add the contact to the topic
-            self.logger.info(f"INFO: Adding Contact/Lead Id:[{contact_id}] to Topic Id:[{topic_id}].")
-
-            try:
-                response = self.request_api("POST",endpoint="sobjects/TopicAssignment",request_data={
-                    "EntityId": contact_id,
-                    "TopicId": topic_id
-                })
-
-                data = response.json()
-                self.logger.info(f"Added TopicAssignment")
-            except Exception as e:
-                # Means it's already in the topic
-                if "DUPLICATE_VALUE" in str(e):
-                    return
-
-                self.logger.exception("Error encountered while creating TopicAssignment")
-                raise e
+    def create_named(self, object_type, name) -> str:
+        self.logger.info(f"No {object_type} found with Name = '{name}'\nCreating {object_type} ...")
+        response = self.request_api("POST", endpoint=f"sobjects/{object_type}", request_data={"Name": name})
+        id = response.json().get("id")
+        self.logger.info(f"{object_type} created with id: {id}")
+        return id
 
-    def assign_to_campaign(self,contact_id,campaigns:list) -> None:
+    def assignment_requests(self, contact_ref, campaigns, topics, contact_type="Contact") -> list:
         """
-        This function recieves a contact_id and a list of campaigns and assigns the contact_id to each campaign
+        Build the composite subrequests that add a contact to its campaigns and topics
 
         Input:
-        contact_id : str
+        contact_ref : str, the contact id or a reference like @{contact.id}
         campaigns : list[dict] eg. [{'id': None, 'name': 'Big Campaign'}, {'id': None, 'name': 'Huge Campaign'}]
+        topics : list[str]
+        contact_type : str, "Contact" or "Lead"
         """
+        requests = []
+        # Assigns the customer_id to the campaign_id or lead_id
+        member_field = "ContactId" if contact_type == "Contact" else "LeadId"
+        for i, campaign in enumerate(campaigns or []):
+            requests.append({
+                "method": "POST",
+                "url": self.composite_url("sobjects/CampaignMember"),
+                "referenceId": f"campaignMember{i}",
+                "body": {"CampaignId": self.campaign_id(campaign), member_field: contact_ref},
+            })
+        for i, topic in enumerate(topics or []):
+            requests.append({
+                "method": "POST",
+                "url": self.composite_url("sobjects/TopicAssignment"),
+                "referenceId": f"topicAssignment{i}",
+                "body": {"TopicId": self.topic_id(topic), "EntityId": contact_ref},
+            })
+        return requests
+
+    def send_contact_requests(self, contact_request, contact_id, assignments) -> str:
+        """
+        Send a contact write and its assignments as composite requests and return the contact id
 
-        for campaign in campaigns:
-
-            # Checks if there's an id, if not, query it
-            # Assuming campaigns are always created first
-            if campaign.get("id") is None:
-                # data = self.get_query(endpoint=f"sobjects/Campaign/Name/{campaign.get('name')}")
-                data = self.query_sobject(
-                    query = f"SELECT Id, CreatedDate from Campaign WHERE Name = '{campaign.get('name')}' ORDER BY CreatedDate ASC",
-                    fields = ['Id']
-                    )
-                # Extract capaign id from record
-                if not data:
-                    self.logger.info(f"No Campaign found with Name = '{campaign.get('name')}'\nCreating campaign ...")
-                    # Create the campaign since it doesn't exist
-                    response = self.request_api("POST", endpoint="sobjects/Campaign", request_data={
-                        "Name": campaign.get("name"),
-                    })
-                    id = response.json().get("id")
-                    self.logger.info(f"{self.name} created with id: {id}")
-                    campaign['campaign_id'] = id
-                else:
-                    campaign['campaign_id'] = data[0]['Id']
-
-            # Assigns the customer_id to the campaign_id or lead_id
-            mapping = {"CampaignId": campaign.get("campaign_id") or campaign.get("id")}
-            if self.contact_type == "Contact":
-                mapping.update({"ContactId": contact_id})
-            else:
-                mapping.update({"LeadId": contact_id})
-
-            # Create the CampaignMember
-            self.logger.info(f"INFO: Adding Contact/Lead Id:[{contact_id}] as a CampaignMember of Campaign Id:[{mapping.get('CampaignId')}].")
-
-            try:
-                response = self.request_api("POST",endpoint="sobjects/CampaignMember",request_data=mapping)
-                data = response.json()
-
-                if isinstance(data, list) and data[0].get("message") == "Already a campaign member.":
-                    return
-
-                id = data.get("id")
-                self.logger.info(f"CampaignMember created with id: {id}")
-            except Exception as e:
-                self.logger.exception("Error encountered while creating CampaignMember")
-                error = f"error: {e}, response: {response.json()}"
-                raise e
+        The first request carries the contact and the assignments referencing
+        it, up to 25 subrequests. Assignments that don't fit are sent with the
+        resolved id. `composite_all_or_none` rolls back the whole request
+        when one subrequest fails.
+        """
+        all_or_none = bool(self.config.get("composite_all_or_none", False))
+        requests = ([contact_request] if contact_request else []) + assignments
+        first = True
+        granted = False
+        while requests:
+            chunk, requests = requests[:self.COMPOSITE_MAX_SUBREQUESTS], requests[self.COMPOSITE_MAX_SUBREQUESTS:]
+            response = self.request_api(
+                "POST", endpoint="composite", request_data={"allOrNone": all_or_none, "compositeRequest": chunk}
+            )
+            results = response.json()["compositeResponse"]
+
+            if first and contact_request:
+                result = results[0]
+                errors = result["body"] if result["httpStatusCode"] >= 400 else None
+                error = (errors or [{}])[0]
+                if error.get("errorCode") == "INVALID_FIELD_FOR_INSERT_UPDATE" and error.get("fields"):
+                    body = {k: v for k, v in contact_request["body"].items() if k not in error.get("fields")}
+                    # retry only while fields are actually removed
+                    if body != contact_request["body"]:
+                        # drop the read-only fields and send the chunk again
+                        self.logger.warning(f"Attempted to write read-only fields: {error.get('fields')}. Removing them and retrying.")
+                        contact_request = {**contact_request, "body": body}
+                        requests = [contact_request] + chunk[1:] + requests
+                        continue
+                # composite responses are 200, so validate_response never sees this error
+                if "No such column 'HasOptedOutOfEmail'" in (error.get("message") or "") and not granted:
+                    self.logger.info("HasOptedOutOfEmail column was not found, updating 'Field-Level Security' and retrying.")
+                    self.grant_opted_out_permission(error["message"])
+                    granted = True
+                    requests = chunk + requests
+                    continue
+                if errors:
+                    raise Exception(json.dumps(errors))
+                contact_id = (result.get("body") or {}).get("id") or contact_id
+                results = results[1:]
+                # assignments past this chunk can't reference the contact anymore
+                requests = [
+                    {**request, "body": {k: contact_id if v == "@{contact.id}" else v for k, v in request["body"].items()}}
+                    for request in requests
+                ]
+            first = False
+
+            for result in results:
+                self.check_assignment_result(result)
+        return contact_id
+
+    def check_assignment_result(self, result) -> None:
+        """Log a CampaignMember or TopicAssignment result, raising on real failures."""
+        if result["httpStatusCode"] < 400:
+            self.logger.info(f"Added {result['referenceId']} with id: {(result.get('body') or {}).get('id')}")
+            return
+        error = (result.get("body") or [{}])[0]
+        # Means it's already in the campaign or topic
+        if error.get("errorCode") == "DUPLICATE_VALUE" or error.get("message") == "Already a campaign member.":
+            self.logger.info(f"INFO: {result['referenceId']} already exists.")
+            return
+        self.logger.error(f"Error encountered while creating {result['referenceId']}: {result.get('body')}")
+        raise Exception(json.dumps(result.get("body")))
 
 
 class DealsSink(SalesforceV3Sink):
@@ -388,12 +441,22 @@ class DealsSink(SalesforceV3Sink):
     name = Deal.Stream.name
     available_names = ["deal", "opportunities", "deals"]
 
-    @cached_property
-    def reference_data(self):
-        params = {"q": "SELECT id, name from Account"}
-        response = self.request_api("GET", endpoint="query", params=params)
-        response = response.json().get("records",[])
-        return [{k: v for k, v in r.items() if k in ["Id", "Name"]} for r in response]
+    def prepare_batch(self, entries):
+        """Resolve deal contacts (and their accounts) by email for the whole batch."""
+        pending = [entry for entry in entries if entry["context"].get("contact_email")]
+        if pending:
+            matches = self.lookup_records(
+                "Contact", "Email", [entry["context"]["contact_email"] for entry in pending], fields=["AccountId"]
+            )
+            for entry in pending:
+                match = matches.get(entry["context"]["contact_email"])
+                if not match:
+                    continue
+                for payload in [entry["record"], entry["raw"]]:
+                    payload["ContactId"] = match["Id"]
+                    if match.get("AccountId"):
+                        payload["AccountId"] = match["AccountId"]
+        super().prepare_batch(entries)
 
     def preprocess_record(self, record, context):
         try:
@@ -414,31 +477,31 @@ class DealsSink(SalesforceV3Sink):
                 except:
                     self.logger.info(f"custom_fields is not a valid Json document: {record['custom_fields']}")
 
+            # not part of the unified schema, selects the record type's stages
+            record_type_id = record.get("record_type_id")
             record = self.validate_input(record)
 
             record_stage = record.get("pipeline_stage_id")
             if not record_stage:
                 record_stage = record.get("status") # fallback on field
 
-            record_stage = self.get_pickable(record_stage, "StageName", select_first=True)
+            record_stage = self.get_pickable(record_stage, "StageName", select_first=True, record_type_id=record_type_id)
 
             record_type = record.get("type")
-            record_type = self.get_pickable(record_type, "Type")
+            record_type = self.get_pickable(record_type, "Type", record_type_id=record_type_id)
 
             if record.get("contact_external_id") and not record.get("contact_id"):
                 external_id = record["contact_external_id"]
                 url = "/".join(["sobjects/Contact", external_id["name"], external_id["value"]])
                 response = self.request_api("GET", endpoint=url)
                 record["contact_id"] = response.json().get("Id")
-            else:
+            elif record.get("contact_email") and not self.is_buffered:
                 # Tries to get contact_id and account_id from email
-                data = self.query_sobject(
-                    query = f"SELECT Id, AccountId from Contact WHERE Email = '{record.get('contact_email')}'",
-                    fields = ['Id', 'AccountId']
-                )
-                if len(data) > 0:
-                    record["contact_id"] = data[0].get("Id")
-                    record["company_id"] = data[0].get("AccountId")
+                match = self.lookup_records("Contact", "Email", [record["contact_email"]], fields=["AccountId"])
+                match = match[record["contact_email"]]
+                if match:
+                    record["contact_id"] = match.get("Id")
+                    record["company_id"] = match.get("AccountId")
 
             mapping = {
                 "Name": record.get("title"),
@@ -453,15 +516,11 @@ class DealsSink(SalesforceV3Sink):
                 "AccountId": record.get("company_id"),
                 "OwnerId": record.get("owner_id"),
                 "ContactId": record.get("contact_id"),
+                "RecordTypeId": record_type_id,
             }
 
             if not mapping.get("AccountId") and record.get("company_name"):
-                account_id = (
-                    r["Id"]
-                    for r in self.reference_data
-                    if r["Name"] == record["company_name"]
-                )
-                mapping["AccountId"] = next(account_id, None)
+                mapping["AccountId"] = self.reference_id("Account", record["company_name"])
 
             if record.get("custom_fields"):
                 self.process_custom_fields(record["custom_fields"])
@@ -482,6 +541,10 @@ class DealsSink(SalesforceV3Sink):
             if self.config.get("only_upsert_empty_fields") and lookup_field:
                 mapping = self.map_only_empty_fields(mapping, "Opportunity", lookup_field)
 
+            # the contact is looked up by email when the batch is drained
+            if self.is_buffered and not record.get("contact_id") and record.get("contact_email"):
+                mapping[RECORD_CONTEXT_KEY] = {"contact_email": record["contact_email"]}
+
             return mapping
         except Exception as exc:
             return {"error": repr(exc)}
@@ -562,20 +625,6 @@ class RecurringDonationsSink(SalesforceV3Sink):
     name = "RecurringDonations"
     available_names = ["recurringdonations", "recurring_donations"]
 
-    @cached_property
-    def reference_accounts(self):
-        params = {"q": "SELECT id, name from Account"}
-        response = self.request_api("GET", endpoint="query", params=params)
-        response = response.json()["records"]
-        return [{k: v for k, v in r.items() if k in ["Id", "Name"]} for r in response]
-
-    @cached_property
-    def reference_contacts(self):
-        params = {"q": "SELECT id, name from Contact"}
-        response = self.request_api("GET", endpoint="query", params=params)
-        response = response.json()["records"]
-        return [{k: v for k, v in r.items() if k in ["Id", "Name"]} for r in response]
-
     def preprocess_record(self, record, context):
         installment_period = None
         if record.get("installment_period"):
@@ -604,19 +653,9 @@ class RecurringDonationsSink(SalesforceV3Sink):
             mapping["npe03__Contact__c"] = contact.json()["Id"]
 
         elif not mapping.get("npe03__Organization__c") and record.get("company_name"):
-            account_id = (
-                r["Id"]
-                for r in self.reference_accounts
-                if r["Name"] == record["company_name"]
-            )
-            mapping["npe03__Organization__c"] = next(account_id, None)
+            mapping["npe03__Organization__c"] = self.reference_id("Account", record["company_name"])
         elif not mapping.get("npe03__Contact__c") and record.get("contact_name"):
-            account_id = (
-                r["Id"]
-                for r in self.reference_contacts
-                if r["Name"] == record["contact_name"]
-            )
-            mapping["npe03__Contact__c"] = next(account_id, None)
+            mapping["npe03__Contact__c"] = self.reference_id("Contact", record["contact_name"])
         else:
             raise Exception("No Account or Contact provided for the donation")
 
@@ -639,6 +678,7 @@ class CampaignSink(SalesforceV3Sink):
     unified_schema = Campaign
     name = "Campaigns"
     available_names = ["campaigns"]
+    non_updatable_fields = []
 
     def preprocess_record(self, record, context):
 
@@ -693,11 +733,13 @@ class CampaignSink(SalesforceV3Sink):
         # Getting custom fields from record
         # self.process_custom_fields(record)
 
-        if record.get("Id"):
-            fields = ["Id"]
-        else:
-            fields_dict = self.sf_fields_description()
-            fields = fields_dict["external_ids"]
+        external_id = None if record.get("Id") else self.external_id_field(record)
+        if external_id:
+            id, created = self.upsert_by_external_id(self.sobject_name, external_id, record)
+            self.logger.info(f"{self.name} {'created' if created else 'updated'} with id: {id}")
+            return id, True, state_updates
+
+        fields = ["Id"] if record.get("Id") else []
 
         for field in fields:
             if record.get(field):
@@ -743,13 +785,13 @@ class CampaignMemberSink(SalesforceV3Sink):
             # "HasResponded": record.get("responded",False)
         }
 
+        id = None
         if record.get('contact_id'):
-            if record.get('type') == "contact":
-                mapping.update({"ContactId": record.get('contact_id')})
-                id = self.get_campaign_member_id(contact_id=record.get('contact_id'),campaign_id=record.get('campaign_id'))
-            else:
-                mapping.update({"LeadId": record.get('contact_id')})
-                id = self.get_campaign_member_id(contact_id=record.get('contact_id'),campaign_id=record.get('campaign_id'),contact_lookup="LeadId")
+            contact_lookup = "ContactId" if record.get('type') == "contact" else "LeadId"
+            mapping.update({contact_lookup: record.get('contact_id')})
+            # Batch modes look up existing members for the whole drained batch at once
+            if not self.is_buffered:
+                id = self.get_campaign_member_id(contact_id=record.get('contact_id'),campaign_id=record.get('campaign_id'),contact_lookup=contact_lookup)
 
         if id:
             record['id'] = id
@@ -790,6 +832,40 @@ class CampaignMemberSink(SalesforceV3Sink):
             return query[0]['Id']
         return None
 
+    def prepare_batch(self, entries):
+        """Resolve the Ids of existing members of buffered records in a few IN queries.
+
+        Existing (CampaignId, ContactId/LeadId) pairs are queried per contact
+        field, for all of the batch's campaigns at once, and matched entries
+        become updates.
+        """
+        for contact_lookup in ["ContactId", "LeadId"]:
+            pending = [
+                entry for entry in entries
+                if not entry["record"].get("Id") and entry["record"].get("CampaignId") and entry["record"].get(contact_lookup)
+            ]
+            if not pending:
+                continue
+
+            # 15 and 18 character ids of the same record share their first 15 characters
+            existing = {}
+            campaign_ids = list(dict.fromkeys(entry["record"]["CampaignId"] for entry in pending))
+            contact_ids = [entry["record"][contact_lookup] for entry in pending]
+            for campaign_chunk in chunked(campaign_ids, 100):
+                where = f"CampaignId IN ({','.join(soql_literal(c) for c in campaign_chunk)})"
+                for member in self.query_in("CampaignMember", ["Id", "CampaignId", contact_lookup], contact_lookup, contact_ids, where=where):
+                    existing.setdefault((member["CampaignId"][:15], member[contact_lookup][:15]), member["Id"])
+
+            for entry in pending:
+                record = entry["record"]
+                id = existing.get((record["CampaignId"][:15], record[contact_lookup][:15]))
+                if id:
+                    for payload in [record, entry["raw"]]:
+                        payload["Id"] = id
+                        payload.pop("CampaignId", None)
+                        payload.pop("LeadId", None)
+        super().prepare_batch(entries)
+
 
 class ActivitiesSink(SalesforceV3Sink):
     endpoint = "sobjects/Task"
@@ -841,6 +917,7 @@ class ActivitiesSink(SalesforceV3Sink):
 
 class FallbackSink(SalesforceV3Sink):
     endpoint = "sobjects/"
+    non_updatable_fields = []
 
     @property
     def lookup_fields_dict(self):
@@ -854,28 +931,23 @@ class FallbackSink(SalesforceV3Sink):
 
     def get_fields_for_object(self, object_type):
         """Check if Salesforce has an object type and fetches its fields."""
-        req = self.request_api("GET")
-        for object in req.json().get("sobjects", []):
-            if object["name"] == object_type or object["label"] == object_type or object["labelPlural"] == object_type:
-                obj_req = self.request_api("GET", endpoint=f"sobjects/{object['name']}/describe").json()
-                return {f["name"]: f for f in obj_req.get("fields", [])}
+        object_name = self.sobject_catalog().resolve(object_type)
+        if object_name:
+            return dict(self.describe(object_name).fields_by_name)
 
         raise MissingObjectInSalesforceError(f"Object type {object_type} not found in Salesforce.")
 
+    @cached_property
+    def object_type(self):
+        """The sObject this stream writes to, resolved once per stream."""
+        object_type = self.sobject_catalog().resolve(self.stream_name)
+        if object_type:
+            self.logger.info(f"Processing records for type {self.stream_name} as {object_type}. Using fallback sink.")
+        return object_type
+
     def preprocess_record(self, record, context):
         # Check if object exists in Salesforce
-        object_type = None
-        req = self.request_api("GET", "sobjects")
-        objects_list = req.json().get("sobjects", [])
-        for object in objects_list:
-            is_name = object["name"] == self.stream_name
-            is_label = object["label"] == self.stream_name
-            is_label_plural = object["labelPlural"] == self.stream_name
-            if is_name or is_label or is_label_plural:
-                self.logger.info(f"Processing record for type {self.stream_name}. Using fallback sink.")
-                object_type = object["name"]
-                break
-
+        object_type = self.object_type
         if not object_type:
             self.logger.info(f"Record doesn't exist on Salesforce {self.stream_name} was not found on Salesforce.")
             return {}
@@ -909,10 +981,12 @@ class FallbackSink(SalesforceV3Sink):
         req = None
         # lookup for record with field from config
         if object_lookup_field and lookup_value:
-            query_fields = ",".join([field for field in fields.keys() if field in record] + ["Id"])
-            query = f"SELECT {query_fields} FROM {object_type} WHERE {object_lookup_field} = '{lookup_value}'"
-            req = self.request_api("GET", "queryAll", params={"q": query})
-            req = req.json().get("records")
+            # Batch modes look up the whole drained batch at once in prepare_batch
+            if not self.is_buffered:
+                query_fields = ",".join([field for field in fields.keys() if field in record] + ["Id"])
+                query = f"SELECT {query_fields} FROM {object_type} WHERE {object_lookup_field} = '{lookup_value}'"
+                req = self.request_api("GET", "queryAll", params={"q": query})
+                req = req.json().get("records")
         # lookup for record with email fields
         elif self.config.get("lookup_by_email", True) and self.name not in self.not_searchable_by_mail:
             # Try to find object instance using email
@@ -949,6 +1023,115 @@ class FallbackSink(SalesforceV3Sink):
             record.pop(field, None)
         return record
 
+    def buffer_entry(self, record):
+        entry = super().buffer_entry(record)
+        payload = entry["record"]
+        entry["object_type"] = payload.pop("object_type", None)
+        entry["linked_object_id"] = payload.pop("LinkedEntityId", None) if self.name == "ContentVersion" else None
+        if "id" in payload and "Id" not in payload:
+            payload["Id"] = payload.pop("id")
+        return entry
+
+    def prepare_batch(self, entries):
+        """Look up buffered records by the configured lookup fields, one queryAll IN query per chunk."""
+        groups = {}
+        for entry in entries:
+            record = entry["record"]
+            lookup_field = self.lookup_fields_dict.get(entry["object_type"])
+            if lookup_field and not record.get("Id") and record.get(lookup_field):
+                groups.setdefault((entry["object_type"], lookup_field), []).append(entry)
+
+        for (object_type, lookup_field), group in groups.items():
+            fields = self.get_fields_for_object(object_type)
+            if lookup_field not in fields:
+                continue
+            select = dict.fromkeys(["Id", lookup_field])
+            for entry in group:
+                select.update(dict.fromkeys(k for k in entry["record"] if k in fields))
+            values = [entry["record"][lookup_field] for entry in group]
+            matches = {}
+            for record in self.query_in(object_type, list(select), lookup_field, values, endpoint="queryAll"):
+                matches.setdefault(match_key(lookup_field, record.get(lookup_field)), record)
+            for entry in group:
+                match = matches.get(match_key(lookup_field, entry["record"][lookup_field]))
+                if match:
+                    # the values are already known, prepare_batch won't fetch them again
+                    entry["existing"] = match
+                    entry["record"]["Id"] = match["Id"]
+                    entry["raw"]["Id"] = match["Id"]
+        if self.name == "ContentVersion":
+            self.prepare_links(entries)
+        super().prepare_batch(entries)
+
+    def prepare_links(self, entries):
+        """Resolve the files' links for the whole batch.
+
+        A new file with a single link gets it as FirstPublishLocationId, which
+        links it on insert. The other links are left for `after_batch`.
+        """
+        linked = [entry for entry in entries if entry["linked_object_id"]]
+        resolved = self.resolve_link_ids([entry["linked_object_id"] for entry in linked])
+        for entry, link_ids in zip(linked, resolved):
+            links = self.link_targets(entry["linked_object_id"])
+            missing = [link for link, link_id in zip(links, link_ids) if not link_id]
+            if missing:
+                entry["link_error"] = f"Could not find matching records for {missing}"
+            link_ids = [link_id for link_id in link_ids if link_id]
+            record = entry["record"]
+            if (
+                len(links) == 1
+                and link_ids
+                and not record.get("Id")
+                and not record.get("FirstPublishLocationId")
+                and not self.entry_external_id(entry)
+            ):
+                record["FirstPublishLocationId"] = entry["raw"]["FirstPublishLocationId"] = link_ids[0]
+                link_ids = []
+            entry["linked_object_id"] = entry["raw"]["LinkedEntityId"] = link_ids or None
+
+    def has_follow_up(self, entry):
+        return bool(entry.get("linked_object_id"))
+
+    def upsert_entry(self, entry):
+        super().upsert_entry(entry)
+        # upsert_record links the file itself
+        if entry["state"].get("success"):
+            entry["linked_object_id"] = None
+
+    def after_batch(self, entries):
+        """Link the written files to their remaining objects with batched ContentDocumentLink inserts."""
+        if self.name != "ContentVersion":
+            return
+        written = [entry for entry in entries if entry["state"].get("success") and entry["state"].get("id")]
+        for entry in written:
+            if entry.get("link_error"):
+                entry["state"].update({"success": False, "error": entry["link_error"]})
+        pending = [entry for entry in written if entry["linked_object_id"] and not entry.get("link_error")]
+        if not pending:
+            return
+
+        document_ids = self.content_document_ids([entry["state"]["id"] for entry in pending])
+        links, owners = [], []
+        for entry in pending:
+            document_id = document_ids.get(match_key("Id", entry["state"]["id"]))
+            if not document_id:
+                entry["state"].update({"success": False, "error": f"ContentDocumentId not found for file {entry['state']['id']}"})
+                continue
+            for link_id in entry["linked_object_id"]:
+                links.append((document_id, link_id))
+                owners.append(entry)
+
+        for entry, result in zip(owners, self.insert_content_document_links(links)):
+            if not result.get("success"):
+                self.logger.error(f"Failed to link file {entry['state']['id']}: {result.get('errors')}")
+                entry["state"].update({"success": False, "error": json.dumps(result.get("errors"))})
+
+    def record_result(self, entry, result, action):
+        external_id = self.external_id_field(entry["record"], entry["object_type"])
+        if external_id:
+            entry["state"]["externalId"] = entry["record"][external_id]
+        super().record_result(entry, result, action)
+
     def upsert_record(self, record, context):
         if record == {} or record is None:
             return None, False, {}
@@ -968,16 +1151,11 @@ class FallbackSink(SalesforceV3Sink):
         # get object fields
         fields_desc = self.sf_fields_description(object_type=object_type)
 
-        possible_update_fields = []
-
-        for field in fields_desc["external_ids"]:
-            if field in record:
-                possible_update_fields.append(field)
-
-        # grab the externalId we should use for the state
-        # TODO: in most cases this would be 1, but what if there's more?
-        if len(possible_update_fields) > 0:
-            state_updates["externalId"] = record[possible_update_fields[0]]
+        # the external id to upsert on is picked once per sObject, and is also
+        # the externalId we report in the state
+        external_id = self.external_id_field(record, object_type)
+        if external_id:
+            state_updates["externalId"] = record[external_id]
 
         if record.get("Id"):
             fields = ["Id"]
@@ -990,6 +1168,17 @@ class FallbackSink(SalesforceV3Sink):
 
         endpoint = f"sobjects/{object_type}"
 
+        # a new file with a single link is linked on insert, without follow-up calls
+        if (
+            linked_object_id
+            and len(self.link_targets(linked_object_id)) == 1
+            and not (record.get("Id") or record.get("id") or external_id or record.get("FirstPublishLocationId"))
+        ):
+            link_id = self.resolve_link_ids([linked_object_id])[0][0]
+            if link_id:
+                record["FirstPublishLocationId"] = link_id
+                linked_object_id = None
+
         for field in record.keys():
             if field not in fields:
                 self.logger.info(f"Field {field} doesn't exist on Salesforce.")
@@ -1016,22 +1205,14 @@ class FallbackSink(SalesforceV3Sink):
             except Exception as e:
                 self.logger.exception(f"Error encountered while updating {object_type}")
 
-        if len(possible_update_fields) > 0:
-            for id_field in possible_update_fields:
-                try:
-                    url = "/".join([endpoint, id_field, record.get(id_field)])
-                    response = self.request_api("PATCH", endpoint=url, request_data={k: record[k] for k in set(list(record.keys())) - set([id_field])})
-                    id = response.json().get("id")
-                    self.logger.info(f"{object_type} updated with id: {id}")
-                    self.link_attachment_to_object(id, linked_object_id)
-                    return id, True, state_updates
-                except Exception as e:
-                    self.logger.exception(f"Could not PATCH to {url}: {e}")
+        if external_id:
+            # a native upsert creates the record when no match exists
+            id, created = self.upsert_by_external_id(object_type, external_id, record)
+            self.logger.info(f"{object_type} {'created' if created else 'updated'} with id: {id}")
+            self.link_attachment_to_object(id, linked_object_id)
+            return id, True, state_updates
 
         try:
-            if len(possible_update_fields) > 0:
-                self.logger.info("Failed to find updatable entity, trying to create it.")
-
             response = self.request_api("POST", endpoint=endpoint, request_data=record)
             id = response.json().get("id")
             self.logger.info(f"{object_type} created with id: {id}")
@@ -1069,36 +1250,85 @@ class FallbackSink(SalesforceV3Sink):
             self.logger.info(f"Object id not found to link file with id {file_id}")
             return
         try:
-            # get contentdocumentid
-            content_endpoint = "query"
-            params = {"q": f"SELECT ContentDocumentId FROM ContentVersion WHERE Id = '{file_id}'"}
-            content_document_id = self.request_api("GET", endpoint=content_endpoint, params=params)
-            content_document_id = content_document_id.json()
-            if content_document_id.get("records"):
-                content_document_id = content_document_id["records"][0]["ContentDocumentId"]
-            else:
+            links = self.link_targets(linked_object_id)
+            link_ids = self.resolve_link_ids([linked_object_id])[0]
+            missing = [link for link, link_id in zip(links, link_ids) if not link_id]
+            if missing:
+                raise Exception(f"Could not find matching records for {missing}")
+
+            content_document_id = self.content_document_ids([file_id]).get(match_key("Id", file_id))
+            if not content_document_id:
                 raise Exception(f"Failed while trying to link file {file_id} and object {linked_object_id} because ContentDocumentId was not found")
 
-            if isinstance(linked_object_id, dict):
-                # they're using an external id, we need to look it up
-                link = list(linked_object_id.keys())[0]
-                sobject, external_id = link.split("/")
-                params = {"q": f"SELECT Id FROM {sobject} WHERE {external_id} = '{linked_object_id[link]}'"}
-                link_obj = self.request_api("GET", endpoint=content_endpoint, params=params)
-                link_obj = link_obj.json()
-                if link_obj.get("records"):
-                    linked_object_id = link_obj['records'][0]['Id']
+            results = self.insert_content_document_links([(content_document_id, link_id) for link_id in link_ids])
+            failed = [result for result in results if not result.get("success")]
+            if failed:
+                raise Exception(json.dumps([result.get("errors") for result in failed]))
+            self.logger.info(f"File with id {file_id} succesfully linked to objects with ids {link_ids}. Link ids {[result['id'] for result in results]}")
+        except Exception as e:
+            self.logger.info(f"Failed while trying to link file {file_id} and object {linked_object_id}")
+            raise e
+
+    @staticmethod
+    def link_targets(linked_object_id):
+        """A file's links, each an Id or a {"Sobject/ExternalIdField": value} dict."""
+        if isinstance(linked_object_id, list):
+            return linked_object_id
+        return [linked_object_id]
+
+    def resolve_link_ids(self, linked_object_ids):
+        """Resolve the links of many files to Ids, with one IN query per sObject and external id field.
+
+        Returns a list of Ids per file, with None for links that matched nothing.
+        """
+        targets = [self.link_targets(linked_object_id) for linked_object_id in linked_object_ids]
+        groups = {}
+        for links in targets:
+            for link in links:
+                if isinstance(link, dict):
+                    key = list(link.keys())[0]
+                    groups.setdefault(key, []).append(link[key])
+
+        resolved = {}
+        for key, values in groups.items():
+            sobject, external_id = key.split("/")
+            for record in self.query_in(sobject, ["Id", external_id], external_id, values):
+                resolved.setdefault((key, match_key(external_id, record.get(external_id))), record["Id"])
+
+        link_ids = []
+        for links in targets:
+            ids = []
+            for link in links:
+                if isinstance(link, dict):
+                    key = list(link.keys())[0]
+                    ids.append(resolved.get((key, match_key(key.split("/")[1], link[key]))))
                 else:
-                    raise Exception(f"Could not find matching {sobject} with {external_id} = '{linked_object_id[link]}'")
+                    ids.append(link)
+            link_ids.append(ids)
+        return link_ids
+
+    def content_document_ids(self, file_ids):
+        """Map ContentVersion ids (by match_key) to their ContentDocumentId."""
+        return {
+            match_key("Id", record["Id"]): record["ContentDocumentId"]
+            for record in self.query_in("ContentVersion", ["Id", "ContentDocumentId"], "Id", file_ids)
+        }
 
-            endpoint = "sobjects/ContentDocumentLink"
-            record = {
+    def insert_content_document_links(self, links):
+        """Insert a viewer ContentDocumentLink per (ContentDocumentId, LinkedEntityId), 200 per call."""
+        records = [
+            {
+                "attributes": {"type": "ContentDocumentLink"},
                 "ContentDocumentId": content_document_id,
-                "LinkedEntityId": linked_object_id,
-                "ShareType": "V"
+                "LinkedEntityId": linked_entity_id,
+                "ShareType": "V",
             }
-            response = self.request_api("POST", endpoint=endpoint, request_data=record)
-            self.logger.info(f"File with id {file_id} succesfully linked to object with id {linked_object_id}. Link id {response.json()['id']}")
-        except Exception as e:
-            self.logger.info(f"Failed while trying to link file {file_id} and object {linked_object_id}")
-            raise e
\ No newline at end of file
+            for content_document_id, linked_entity_id in links
+        ]
+        results = []
+        for chunk in chunked(records, self.COLLECTIONS_BATCH_SIZE):
+            response = self.request_api(
+                "POST", endpoint="composite/sobjects", request_data={"allOrNone": False, "records": chunk}
+            )
+            results.extend(response.json())
+        return results
\ No newline at end of file
@@ -0,0 +1,54 @@
+"""Store of the records written by the target, kept across runs."""
+
+from __future__ import annotations
+
+import sqlite3
+import threading
+import time
+
+
+class PayloadStateStore:
+    """SQLite map of (sObject, key field, key value) to (Id, payload hash).
+
+    The key field is the external id a record was written with, or "Id".
+    Each row also keeps when the record was last written. With the default
+    ":memory:" path the store only lasts for the run.
+    """
+
+    def __init__(self, path: str = ":memory:") -> None:
+        self.path = path
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS records ("
+                "object_type TEXT NOT NULL, key_field TEXT NOT NULL, key_value TEXT NOT NULL, "
+                "id TEXT, hash TEXT NOT NULL, written_at REAL NOT NULL, "
+                "PRIMARY KEY (object_type, key_field, key_value)) WITHOUT ROWID"
+            )
+            self._connection.commit()
+
+    def get(self, key: tuple, default=None):
+        """Return the (Id, payload hash) stored for `key`."""
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT id, hash FROM records WHERE object_type = ? AND key_field = ? AND key_value = ?", key
+            ).fetchone()
+        return tuple(row) if row else default
+
+    def __setitem__(self, key: tuple, value: tuple) -> None:
+        id, hash = value
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO records VALUES (?, ?, ?, ?, ?, ?)", (*key, id, hash, time.time())
+            )
+
+    def __delitem__(self, key: tuple) -> None:
+        with self._lock:
+            self._connection.execute(
+                "DELETE FROM records WHERE object_type = ? AND key_field = ? AND key_value = ?", key
+            )
+
+    def commit(self) -> None:
+        with self._lock:
+            self._connection.commit()
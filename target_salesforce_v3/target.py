@@ -2,9 +2,18 @@
 
 from __future__ import annotations
 
+import copy
+
+from backports.cached_property import cached_property
 from singer_sdk import typing as th
 from target_hotglue.target import TargetHotglue
 
+from target_salesforce_v3.auth import SalesforceV3Authenticator
+from target_salesforce_v3.cache import DescribeCache, MetadataDiskCache
+from target_salesforce_v3.limiter import AdaptiveLimiter
+from target_salesforce_v3.quota import QuotaGovernor
+from target_salesforce_v3.session import build_session
+from target_salesforce_v3.state_store import PayloadStateStore
 from target_salesforce_v3.sinks import (
     FallbackSink,
     ContactsSink,
@@ -36,6 +45,55 @@ class TargetSalesforceV3(TargetHotglue):
     SINK_TYPES = SINK_TYPES
     read_only_fields = {}
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # shared by every sink so each sObject is described once per run
+        metadata_cache_path = self.config.get("metadata_cache_path")
+        self.describe_cache = DescribeCache(
+            MetadataDiskCache(metadata_cache_path) if metadata_cache_path else None
+        )
+        # queried by the first sink that creates custom fields
+        self.permission_set_ids = None
+        # name -> Id indexes of referenced objects (Account, Contact)
+        self.reference_indexes = {}
+        # (sObject, key field, value) -> (Id, payload hash) of records written,
+        # kept across runs when state_store_path is set
+        self.payload_hashes = PayloadStateStore(self.config.get("state_store_path") or ":memory:")
+        # daily API quota and call budgets, checked between batches
+        stream_budgets = self.config.get("stream_api_budgets") or {}
+        self.quota = QuotaGovernor(
+            quota_percent=float(self.config.get("quota_percent", 80)),
+            run_budget=int(self.config["api_call_budget"]) if self.config.get("api_call_budget") else None,
+            stream_budgets={stream: int(budget) for stream, budget in stream_budgets.items()},
+            logger=self.logger,
+        )
+        # one keep-alive pool for every sink, sized for parallel draining
+        pool_size = int(self.config.get("connection_pool_size") or self.MAX_PARALLELISM)
+        self.session = build_session(pool_size)
+        # requests in flight across all sinks, adapted to throttling and latency
+        self.limiter = AdaptiveLimiter(int(self.config.get("max_concurrent_requests") or pool_size))
+
+    def _write_state_message(self, state: dict) -> None:
+        """Emit the state with the bookmarks of every batch drained so far.
+
+        drain_all copies the state before it drains the sinks, so the states
+        of batches drained by that call would be missing. The sinks' own
+        bookmarks and summary are taken as they are now.
+        """
+        state = copy.deepcopy(state)
+        for sink in self._sinks_active.values():
+            if not sink.latest_state:
+                continue
+            for key in ["bookmarks", "summary"]:
+                if sink.name in sink.latest_state.get(key, {}):
+                    state.setdefault(key, {})[sink.name] = copy.deepcopy(sink.latest_state[key][sink.name])
+        super()._write_state_message(state)
+
+    @cached_property
+    def authenticator(self):
+        """Authenticator shared by all sinks, created on first use."""
+        return SalesforceV3Authenticator(self)
+
     def get_sink_class(self, stream_name: str):
         """Get sink for a stream."""
         for sink_class in SINK_TYPES:
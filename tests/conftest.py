@@ -1,3 +1,163 @@
 """Test Configuration."""
 
+from __future__ import annotations
+
+import json
+import re
+import time
+from collections import namedtuple
+
+import pytest
+
 pytest_plugins = ("singer_sdk.testing.pytest_plugin",)
+
+INSTANCE_URL = "https://example.my.salesforce.com"
+
+Call = namedtuple("Call", ["method", "endpoint", "params", "body", "headers", "data"])
+
+
+class FakeResponse:
+    def __init__(self, status_code=200, body=None, headers=None):
+        self.status_code = status_code
+        self._body = body
+        self.text = json.dumps(body) if body is not None else ""
+        self.content = self.text.encode("utf-8")
+        self.headers = headers or {}
+        self.ok = status_code < 400
+        self.reason = "Fake"
+
+    def json(self):
+        return self._body
+
+    def raise_for_status(self):
+        if not self.ok:
+            raise Exception(f"{self.status_code} Error: {self.text}")
+
+
+def field(name, **overrides):
+    """A describe field, writable by default."""
+    return {
+        "name": name,
+        "label": name,
+        "type": "string",
+        "createable": True,
+        "updateable": True,
+        "custom": name.endswith("__c"),
+        "defaultedOnCreate": False,
+        "nillable": True,
+        "externalId": False,
+        "picklistValues": [],
+        **overrides,
+    }
+
+
+class FakeSalesforce:
+    """In-memory stand-in for `SalesforceV3Sink.request_api`.
+
+    Handlers are registered with `on` for a method and an endpoint pattern,
+    and the latest match answers. A handler gets the `Call` and the pattern
+    match, and returns a body, a `(status_code, body)` tuple or a
+    FakeResponse. Responses go through the sink's `validate_response`, like
+    real ones. sObjects added with `add_object` are listed and described.
+    """
+
+    def __init__(self):
+        self.calls = []
+        self.routes = []
+        self.describes = {}
+        self.on("GET", "limits", lambda call, match: {"DailyApiRequests": {"Max": 100000, "Remaining": 100000}})
+        self.on("GET", "sobjects/", lambda call, match: {
+            "sobjects": [
+                {"name": name, "label": name.replace("__c", ""), "labelPlural": name.replace("__c", "") + "s"}
+                for name in self.describes
+            ]
+        })
+        self.on("GET", r"sobjects/(\w+)/describe/", self.describe)
+
+    def on(self, method, pattern, handler):
+        self.routes.insert(0, (method, re.compile(pattern), handler))
+
+    def add_object(self, name, *fields):
+        """Describe an sObject with `fields`, given as names or as overrides of `field`."""
+        fields = [field(f) if isinstance(f, str) else field(**f) for f in fields]
+        self.describes[name] = {"name": name, "createable": True, "fields": [field("Id", createable=False, updateable=False), *fields]}
+
+    def describe(self, call, match):
+        describe = self.describes.get(match.group(1))
+        if describe is None:
+            return 404, [{"errorCode": "NOT_FOUND", "message": "The requested resource does not exist"}]
+        return describe
+
+    def endpoint_calls(self, method, pattern):
+        return [call for call in self.calls if call.method == method and re.fullmatch(pattern, call.endpoint)]
+
+    def request(self, sink, http_method, endpoint=None, params=None, request_data=None, headers=None, data=None):
+        endpoint = endpoint or sink.endpoint
+        call = Call(http_method, endpoint, params, request_data, headers, data)
+        self.calls.append(call)
+        for method, pattern, handler in self.routes:
+            match = pattern.fullmatch(endpoint)
+            if method == http_method and match:
+                response = handler(call, match)
+                break
+        else:
+            raise AssertionError(f"Unexpected request {http_method} {endpoint}")
+        if not isinstance(response, FakeResponse):
+            status_code, body = response if isinstance(response, tuple) else (200, response)
+            response = FakeResponse(status_code, body)
+        sink.validate_response(response)
+        return response
+
+
+@pytest.fixture()
+def salesforce(monkeypatch):
+    """A FakeSalesforce answering the requests of every sink."""
+    from target_salesforce_v3.client import SalesforceV3Sink
+
+    fake = FakeSalesforce()
+    monkeypatch.setattr(SalesforceV3Sink, "request_api", lambda sink, *args, **kwargs: fake.request(sink, *args, **kwargs))
+    return fake
+
+
+@pytest.fixture()
+def make_target():
+    """Build a target with a valid access token and the given config."""
+    from target_salesforce_v3.target import TargetSalesforceV3
+
+    def make(**config):
+        return TargetSalesforceV3(
+            config={
+                "instance_url": INSTANCE_URL,
+                "access_token": "token",
+                "issued_at": int(time.time() * 1000),
+                **config,
+            }
+        )
+
+    return make
+
+
+@pytest.fixture()
+def make_sink(make_target, salesforce):
+    """Build the sink of `stream`, or of `sink_class`, on a new target with the given config."""
+
+    def make(stream="Widgets", sink_class=None, schema=None, **config):
+        target = make_target(**config)
+        sink_class = sink_class or target.get_sink_class(stream)
+        return sink_class(target=target, stream_name=stream, schema=schema or {"properties": {}}, key_properties=None)
+
+    return make
+
+
+@pytest.fixture()
+def write_batch():
+    """Process records into one batch context, drain it and return the sink's bookmarks."""
+
+    def write(sink, records):
+        context = {}
+        for record in records:
+            sink.process_record(dict(record), context)
+        sink.process_batch(context)
+        return sink.latest_state["bookmarks"][sink.name]
+
+    return write
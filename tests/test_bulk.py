@@ -0,0 +1,149 @@
+"""Tests for Bulk API 2.0 ingest jobs against a local fake of the endpoints."""
+
+from __future__ import annotations
+
+import csv
+import io
+import json
+
+import pytest
+
+from target_salesforce_v3.bulk import BulkIngestJob, BulkJobTimeoutError
+
+
+class FakeResponse:
+    def __init__(self, status_code=200, body=None, text=None):
+        self.status_code = status_code
+        self._body = body
+        self.text = text if text is not None else json.dumps(body)
+
+    def json(self):
+        return self._body
+
+
+class FakeIngestApi:
+    """In-memory stand-in for the jobs/ingest endpoints.
+
+    Rows without a LastName fail, like a required field would in Salesforce.
+    The job reports InProgress for `polls_before_complete` status checks.
+    """
+
+    def __init__(self, polls_before_complete=2):
+        self.polls_before_complete = polls_before_complete
+        self.calls = []
+        self.jobs = {}
+
+    def __call__(self, http_method, endpoint=None, params=None, request_data=None, headers=None, data=None):
+        self.calls.append((http_method, endpoint))
+        parts = endpoint.split("/")
+
+        if http_method == "POST" and endpoint == "jobs/ingest":
+            job_id = f"750{len(self.jobs):012d}"
+            self.jobs[job_id] = {"id": job_id, "state": "Open", "polls": 0, "rows": [], **request_data}
+            return FakeResponse(body=self.jobs[job_id])
+
+        job = self.jobs[parts[2]]
+        if http_method == "PUT":
+            job["rows"] = list(csv.DictReader(io.StringIO(data.decode("utf-8"))))
+            return FakeResponse(status_code=201, body=None, text="")
+        if http_method == "PATCH":
+            job["state"] = request_data["state"]
+            return FakeResponse(body=job)
+        if len(parts) == 3:
+            job["polls"] += 1
+            if job["polls"] > self.polls_before_complete:
+                job["state"] = "JobComplete"
+            else:
+                job["state"] = "InProgress"
+            return FakeResponse(body={"id": job["id"], "state": job["state"]})
+        return FakeResponse(text=self.results(job, parts[3]))
+
+    def results(self, job, kind):
+        columns = list(job["rows"][0].keys())
+        output = io.StringIO()
+        if kind == "successfulResults":
+            writer = csv.DictWriter(output, ["sf__Id", "sf__Created"] + columns, lineterminator="\n")
+            writer.writeheader()
+            for index, row in enumerate(job["rows"]):
+                if row.get("LastName"):
+                    writer.writerow({"sf__Id": f"003{index:015d}", "sf__Created": "true", **row})
+        elif kind == "failedResults":
+            writer = csv.DictWriter(output, ["sf__Id", "sf__Error"] + columns, lineterminator="\n")
+            writer.writeheader()
+            for row in job["rows"]:
+                if not row.get("LastName"):
+                    writer.writerow({"sf__Id": "", "sf__Error": "REQUIRED_FIELD_MISSING:Required fields are missing: [LastName]:LastName --", **row})
+        else:
+            writer = csv.DictWriter(output, columns, lineterminator="\n")
+            writer.writeheader()
+        return output.getvalue()
+
+
+def make_job(api, **kwargs):
+    return BulkIngestJob(api, "Contact", "insert", sleep=lambda seconds: None, **kwargs)
+
+
+def test_results_are_mapped_back_in_input_order():
+    api = FakeIngestApi()
+    records = [
+        {"FirstName": "Ada", "LastName": "Lovelace", "Email": "ada@example.com"},
+        {"FirstName": "Nameless", "Email": "nobody@example.com"},
+        {"FirstName": "Alan", "LastName": "Turing", "HasOptedOutOfEmail": True},
+    ]
+
+    results = make_job(api).run(records)
+
+    assert [r["success"] for r in results] == [True, False, True]
+    assert results[0]["id"] == "003000000000000000"
+    assert results[2]["id"] == "003000000000000002"
+    assert "REQUIRED_FIELD_MISSING" in results[1]["error"]
+
+
+def test_job_lifecycle_uploads_closes_and_polls():
+    api = FakeIngestApi(polls_before_complete=3)
+
+    make_job(api).run([{"LastName": "Hopper"}])
+
+    methods = [method for method, _ in api.calls]
+    assert methods[:3] == ["POST", "PUT", "PATCH"]
+    assert methods.count("GET") == 4 + 2
+    job = next(iter(api.jobs.values()))
+    assert job["operation"] == "insert"
+    assert job["rows"] == [{"LastName": "Hopper"}]
+
+
+def test_upsert_job_sends_external_id_field():
+    api = FakeIngestApi()
+
+    BulkIngestJob(api, "Contact", "upsert", external_id_field="External_Id__c", sleep=lambda s: None).run(
+        [{"LastName": "Hopper", "External_Id__c": "42"}]
+    )
+
+    job = next(iter(api.jobs.values()))
+    assert job["externalIdFieldName"] == "External_Id__c"
+
+
+def test_polling_times_out():
+    api = FakeIngestApi(polls_before_complete=100)
+
+    with pytest.raises(BulkJobTimeoutError):
+        make_job(api, poll_interval=1, max_poll_interval=1, timeout=5).run([{"LastName": "Hopper"}])
+
+
+def test_identical_rows_each_get_their_own_result():
+    api = FakeIngestApi()
+    records = [
+        {"LastName": "Hopper"},
+        {"FirstName": "Nameless"},
+        {"LastName": "Hopper"},
+        {"FirstName": "Nameless"},
+        {"LastName": "Hopper"},
+    ]
+
+    results = make_job(api).run(records)
+
+    assert [r["success"] for r in results] == [True, False, True, False, True]
+    assert [r["id"] for r in results if r["success"]] == [
+        "003000000000000000", "003000000000000002", "003000000000000004"
+    ]
+    assert all("REQUIRED_FIELD_MISSING" in r["error"] for r in results if not r["success"])
@@ -0,0 +1,214 @@
+"""Tests for the metadata caches shared by the sinks of a target."""
+
+from __future__ import annotations
+
+import threading
+import time
+
+import pytest
+
+from target_salesforce_v3.cache import DescribeCache, MetadataDiskCache, SObjectCatalog
+from tests.conftest import FakeResponse
+
+LAST_MODIFIED = "Wed, 14 Oct 2026 10:00:00 GMT"
+
+
+def describe_calls(salesforce, sobject="Widget__c"):
+    return salesforce.endpoint_calls("GET", f"sobjects/{sobject}/describe/")
+
+
+@pytest.fixture()
+def widgets(salesforce):
+    salesforce.add_object("Widget__c", "Name", "Code__c")
+    return salesforce
+
+
+def test_sinks_of_a_target_describe_an_sobject_once(widgets, make_target):
+    from target_salesforce_v3.sinks import FallbackSink
+
+    target = make_target()
+    sinks = [
+        FallbackSink(target=target, stream_name=stream, schema={"properties": {}}, key_properties=None)
+        for stream in ["Widgets", "MoreWidgets"]
+    ]
+
+    for sink in sinks:
+        for _ in range(5):
+            assert "Code__c" in sink.sf_fields_description("Widget__c")["custom"]
+            sink.get_pickable("x", "Name", object_type="Widget__c")
+
+    assert len(describe_calls(widgets)) == 1
+
+
+def test_concurrent_misses_wait_for_one_load():
+    cache = DescribeCache()
+    loads = []
+
+    def loader():
+        loads.append(threading.get_ident())
+        time.sleep(0.05)
+        return {"name": "Widget__c", "fields": []}
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(cache.get(("url", "55.0", "Widget__c"), loader)))
+        for _ in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(loads) == 1
+    assert all(result is results[0] for result in results)
+
+
+def test_describes_are_keyed_by_instance_and_version():
+    cache = DescribeCache()
+    loads = []
+
+    def loader():
+        loads.append(1)
+        return {"fields": []}
+
+    cache.get(("https://a.my.salesforce.com", "55.0", "Account"), loader)
+    cache.get(("https://b.my.salesforce.com", "55.0", "Account"), loader)
+    cache.get(("https://a.my.salesforce.com", "56.0", "Account"), loader)
+    cache.get(("https://a.my.salesforce.com", "55.0", "Account"), loader)
+
+    assert len(loads) == 3
+
+
+def test_invalidated_describes_are_fetched_again(widgets, make_sink):
+    sink = make_sink()
+    sink.describe("Widget__c")
+    widgets.add_object("Widget__c", "Name", "Code__c", "Color__c")
+
+    assert "Color__c" not in sink.describe("Widget__c").fields_by_name
+    sink._target.describe_cache.invalidate(sink.describe_cache_key("Widget__c"))
+
+    assert "Color__c" in sink.describe("Widget__c").fields_by_name
+    assert len(describe_calls(widgets)) == 2
+
+
+def test_disk_entries_round_trip(tmp_path):
+    key = ("https://example.my.salesforce.com", "55.0", "Widget__c")
+    disk = MetadataDiskCache(str(tmp_path / "metadata"))
+
+    assert disk.load(key) is None
+    disk.save(key, LAST_MODIFIED, {"name": "Widget__c"})
+
+    assert MetadataDiskCache(str(tmp_path / "metadata")).load(key) == {
+        "last_modified": LAST_MODIFIED,
+        "body": {"name": "Widget__c"},
+    }
+    disk.delete(key)
+    assert disk.load(key) is None
+
+
+def test_unreadable_disk_entries_are_misses(tmp_path):
+    key = ("https://example.my.salesforce.com", "55.0", "Widget__c")
+    disk = MetadataDiskCache(str(tmp_path))
+    disk.save(key, LAST_MODIFIED, {})
+
+    with open(disk._file(key), "w") as f:
+        f.write("{")
+
+    assert disk.load(key) is None
+
+
+@pytest.fixture()
+def cached_widgets(widgets):
+    """Describe Widget__c with a Last-Modified header, and answer 304 when it is sent back."""
+
+    def describe(call, match):
+        if (call.headers or {}).get("If-Modified-Since") == LAST_MODIFIED:
+            return FakeResponse(304)
+        return FakeResponse(200, widgets.describe(call, match), headers={"Last-Modified": LAST_MODIFIED})
+
+    widgets.on("GET", r"sobjects/(\w+)/describe/", describe)
+    return widgets
+
+
+def test_unchanged_metadata_is_reused_by_the_next_run(cached_widgets, make_sink, tmp_path):
+    path = str(tmp_path / "metadata")
+    first = make_sink(metadata_cache_path=path).describe("Widget__c")
+
+    describe = make_sink(metadata_cache_path=path).describe("Widget__c")
+
+    calls = describe_calls(cached_widgets)
+    assert [call.headers for call in calls] == [{}, {"If-Modified-Since": LAST_MODIFIED}]
+    assert describe.fields_by_name == first.fields_by_name
+
+
+def test_changed_metadata_replaces_the_disk_entry(cached_widgets, make_sink, tmp_path):
+    path = str(tmp_path / "metadata")
+    make_sink(metadata_cache_path=path).describe("Widget__c")
+    cached_widgets.add_object("Widget__c", "Name", "Code__c", "Color__c")
+    cached_widgets.on("GET", r"sobjects/(\w+)/describe/", lambda call, match: FakeResponse(
+        200, cached_widgets.describe(call, match), headers={"Last-Modified": "Thu, 15 Oct 2026 10:00:00 GMT"}
+    ))
+
+    sink = make_sink(metadata_cache_path=path)
+
+    assert "Color__c" in sink.describe("Widget__c").fields_by_name
+    entry = MetadataDiskCache(path).load(sink.describe_cache_key("Widget__c"))
+    assert entry["last_modified"] == "Thu, 15 Oct 2026 10:00:00 GMT"
+
+
+def test_invalidated_describes_are_dropped_from_disk(cached_widgets, make_sink, tmp_path):
+    path = str(tmp_path / "metadata")
+    sink = make_sink(metadata_cache_path=path)
+    sink.describe("Widget__c")
+
+    sink._target.describe_cache.invalidate(sink.describe_cache_key("Widget__c"))
+
+    assert MetadataDiskCache(path).load(sink.describe_cache_key("Widget__c")) is None
+
+
+def test_the_catalog_resolves_names_labels_and_plural_labels():
+    catalog = SObjectCatalog([
+        {"name": "Widget__c", "label": "Widget", "labelPlural": "Widgets"},
+        {"name": "Gadget__c", "label": "Gadget", "labelPlural": "Gadgets"},
+        {"name": "widgets__c", "label": "Old Widgets", "labelPlural": "Old Widgets"},
+        {"name": "Other__c", "label": "Widget", "labelPlural": "Others"},
+    ])
+
+    assert catalog.resolve("Widget__c") == "Widget__c"
+    assert catalog.resolve("Gadgets") == "Gadget__c"
+    assert catalog.resolve("old widgets") == "widgets__c"
+    # exact matches win over case-insensitive ones, and the first sObject listed wins
+    assert catalog.resolve("widgets__c") == "widgets__c"
+    assert catalog.resolve("WIDGETS") == "Widget__c"
+    assert catalog.resolve("Widget") == "Widget__c"
+    assert catalog.resolve("Sprocket") is None
+    assert catalog.resolve(None) is None
+
+
+def test_the_catalog_loads_through_the_describe_cache(widgets, make_sink):
+    sink = make_sink()
+    catalogs = []
+
+    # the catalog and the sObject list share a cache key and the catalog's
+    # loader fetches the list, so a shared lock would never be released
+    thread = threading.Thread(target=lambda: catalogs.append(sink.sobject_catalog()), daemon=True)
+    thread.start()
+    thread.join(timeout=5)
+
+    assert not thread.is_alive()
+    assert catalogs[0].resolve("Widgets") == "Widget__c"
+    assert sink.sobjects_list() == [{"name": "Widget__c", "label": "Widget", "labelPlural": "Widgets"}]
+
+
+def test_fallback_streams_are_routed_with_one_listing(widgets, make_target):
+    from target_salesforce_v3.sinks import FallbackSink
+
+    widgets.add_object("Gadget__c", "Name")
+    target = make_target()
+    for stream in ["Widgets", "gadget", "Gadget__c"]:
+        sink = FallbackSink(target=target, stream_name=stream, schema={"properties": {}}, key_properties=None)
+        record = sink.preprocess_record({"Name": "a", "Code__c": "1", "Unknown": "x"}, {})
+        assert record["object_type"] in ["Widget__c", "Gadget__c"]
+        assert "Unknown" not in record
+
+    assert len(widgets.endpoint_calls("GET", "sobjects/")) == 1
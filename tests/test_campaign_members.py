@@ -0,0 +1,62 @@
+"""Tests for writing campaign members in batches."""
+
+from __future__ import annotations
+
+import pytest
+
+EXISTING = [
+    {"Id": "00v000000000001AAA", "CampaignId": "701000000000001AAA", "ContactId": "003000000000001AAA"},
+    {"Id": "00v000000000002AAA", "CampaignId": "701000000000002AAA", "ContactId": "003000000000002AAA"},
+]
+
+
+@pytest.fixture()
+def members(salesforce):
+    salesforce.add_object("CampaignMember", "CampaignId", "ContactId", "LeadId")
+    salesforce.on("GET", "query", lambda call, match: {"done": True, "records": [
+        member for member in EXISTING if "ContactId IN" in call.params["q"]
+    ]})
+    salesforce.on("POST", "composite/sobjects", lambda call, match: [
+        {"success": True, "id": f"00v{i:015d}"} for i, _ in enumerate(call.body["records"], 10)
+    ])
+    salesforce.on("PATCH", "composite/sobjects", lambda call, match: [
+        {"success": True, "id": record["Id"]} for record in call.body["records"]
+    ])
+    return salesforce
+
+
+def write_members(sink, records):
+    context = {}
+    for record in records:
+        sink.process_record(sink.preprocess_record(record, context), context)
+    sink.process_batch(context)
+    return sink.latest_state["bookmarks"][sink.name]
+
+
+def test_existing_members_match_by_15_and_18_character_ids(members, make_sink):
+    from target_salesforce_v3.sinks import CampaignMemberSink
+
+    sink = make_sink("CampaignMembers", CampaignMemberSink, write_mode="batch")
+
+    states = write_members(sink, [
+        # 15 character ids of the first existing member
+        {"campaign_id": "701000000000001", "contact_id": "003000000000001", "type": "contact"},
+        # 18 character ids of the second
+        {"campaign_id": "701000000000002AAA", "contact_id": "003000000000002AAA", "type": "contact"},
+        # an existing contact in another campaign
+        {"campaign_id": "701000000000002AAA", "contact_id": "003000000000001AAA", "type": "contact"},
+    ])
+
+    queries = [call.params["q"] for call in members.endpoint_calls("GET", "query")]
+    assert len(queries) == 1
+    assert "CampaignId IN ('701000000000001','701000000000002AAA')" in queries[0]
+    updates = members.endpoint_calls("PATCH", "composite/sobjects")[0].body["records"]
+    assert [(record["Id"], "CampaignId" in record) for record in updates] == [
+        ("00v000000000001AAA", False),
+        ("00v000000000002AAA", False),
+    ]
+    creates = members.endpoint_calls("POST", "composite/sobjects")[0].body["records"]
+    assert [(record["CampaignId"], record["ContactId"]) for record in creates] == [
+        ("701000000000002AAA", "003000000000001AAA")
+    ]
+    assert [state["id"] for state in states[:2]] == ["00v000000000001AAA", "00v000000000002AAA"]
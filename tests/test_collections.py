@@ -0,0 +1,110 @@
+"""Tests for batch writes through sObject Collections."""
+
+from __future__ import annotations
+
+import io
+import json
+
+import pytest
+
+
+@pytest.fixture()
+def widgets(salesforce):
+    salesforce.add_object("Widget__c", "Name", "Code__c")
+    return salesforce
+
+
+def widget(name, **fields):
+    return {"Name": name, "object_type": "Widget__c", **fields}
+
+
+def test_results_are_mapped_back_by_position(widgets, make_sink, write_batch):
+    widgets.on("POST", "composite/sobjects", lambda call, match: [
+        {"success": True, "id": "a00000000000001AAA", "errors": []},
+        {"success": False, "errors": [{"statusCode": "REQUIRED_FIELD_MISSING", "message": "Required fields are missing: [Name]"}]},
+        {"success": True, "id": "a00000000000003AAA", "errors": []},
+    ])
+    sink = make_sink(write_mode="batch")
+
+    states = write_batch(sink, [widget("a"), widget("b"), widget("c")])
+
+    assert [state["success"] for state in states] == [True, False, True]
+    assert states[0]["id"] == "a00000000000001AAA"
+    assert states[2]["id"] == "a00000000000003AAA"
+    assert "REQUIRED_FIELD_MISSING" in states[1]["error"]
+    sent = widgets.endpoint_calls("POST", "composite/sobjects")[0].body["records"]
+    assert [record["Name"] for record in sent] == ["a", "b", "c"]
+    assert sink.latest_state["summary"][sink.name]["fail"] == 1
+
+
+def test_identical_records_in_a_buffer_are_written_once(widgets, make_sink, write_batch):
+    widgets.on("POST", "composite/sobjects", lambda call, match: [
+        {"success": True, "id": f"a0000000000000{i}AAA"} for i, _ in enumerate(call.body["records"])
+    ])
+    sink = make_sink(write_mode="batch")
+
+    states = write_batch(sink, [
+        widget("a", externalId="src-1"),
+        widget("b", externalId="src-2"),
+        widget("a", externalId="src-1"),
+    ])
+
+    sent = widgets.endpoint_calls("POST", "composite/sobjects")[0].body["records"]
+    assert [record["Name"] for record in sent] == ["a", "b"]
+    assert all("externalId" not in record for record in sent)
+    assert [state["id"] for state in states] == ["a00000000000000AAA", "a00000000000000AAA", "a00000000000001AAA"]
+    assert states[0]["externalId"] == "src-1"
+    assert sink.latest_state["summary"][sink.name]["existing"] > 0
+
+
+def test_rows_with_read_only_fields_are_sent_again_without_them(widgets, make_sink, write_batch):
+    def create(call, match):
+        return [
+            {"success": False, "errors": [{"statusCode": "INVALID_FIELD_FOR_INSERT_UPDATE", "message": "Unable to create/update fields: Code__c.", "fields": ["Code__c"]}]}
+            if "Code__c" in record
+            else {"success": True, "id": f"a00{record['Name']:0>15}"}
+            for record in call.body["records"]
+        ]
+
+    widgets.on("POST", "composite/sobjects", create)
+    sink = make_sink(write_mode="batch")
+
+    states = write_batch(sink, [widget("a"), widget("b", Code__c="X")])
+
+    calls = widgets.endpoint_calls("POST", "composite/sobjects")
+    assert len(calls) == 2
+    assert calls[1].body["records"] == [{"Name": "b", "attributes": {"type": "Widget__c"}}]
+    assert [state["success"] for state in states] == [True, True]
+
+
+def test_read_only_fields_are_retried_once(widgets, make_sink, write_batch):
+    widgets.on("POST", "composite/sobjects", lambda call, match: [
+        {"success": False, "errors": [{"statusCode": "INVALID_FIELD_FOR_INSERT_UPDATE", "message": "Unable to create/update fields: Name.", "fields": ["Name"]}]}
+        for _ in call.body["records"]
+    ])
+    sink = make_sink(write_mode="batch")
+
+    states = write_batch(sink, [widget("a")])
+
+    assert len(widgets.endpoint_calls("POST", "composite/sobjects")) == 2
+    assert states[0]["success"] is False
+    assert "INVALID_FIELD_FOR_INSERT_UPDATE" in states[0]["error"]
+
+
+def test_the_last_batch_is_in_the_emitted_state(widgets, make_target, capsys):
+    ids = iter(range(100))
+    widgets.on("POST", "composite/sobjects", lambda call, match: [
+        {"success": True, "id": f"a00{next(ids):015d}"} for _ in call.body["records"]
+    ])
+    widgets.on("GET", "query", lambda call, match: {"records": [], "done": True})
+    target = make_target(write_mode="batch", batch_size=2, lookup_by_email=False)
+    messages = [{"type": "SCHEMA", "stream": "Widgets", "schema": {"properties": {"Name": {"type": "string"}}}, "key_properties": []}]
+    messages += [{"type": "RECORD", "stream": "Widgets", "record": {"Name": name}} for name in ["a", "b", "c"]]
+
+    target.listen(io.StringIO("".join(json.dumps(message) + "\n" for message in messages)))
+
+    state = json.loads(capsys.readouterr().out.strip().splitlines()[-1])
+    assert [bookmark.get("id") for bookmark in state["bookmarks"]["Widgets"]] == [
+        "a00000000000000000", "a00000000000000001", "a00000000000000002"
+    ]
+    assert state["summary"]["Widgets"]["success"] == 3
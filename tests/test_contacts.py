@@ -0,0 +1,108 @@
+"""Tests for writing contacts with their campaign members and topic assignments."""
+
+from __future__ import annotations
+
+import pytest
+
+CONTACT_ID = "003000000000001AAA"
+
+
+def read_only_error(*fields):
+    return [{
+        "errorCode": "INVALID_FIELD_FOR_INSERT_UPDATE",
+        "message": f"Unable to create/update fields: {', '.join(fields)}.",
+        "fields": list(fields),
+    }]
+
+
+class Composite:
+    """Answers composite requests.
+
+    Contacts carrying a `read_only` field are rejected with those fields.
+    Contacts are always rejected with the `always_rejected` fields, even
+    when they no longer carry them.
+    """
+
+    def __init__(self, salesforce, read_only=(), always_rejected=()):
+        self.read_only = set(read_only)
+        self.always_rejected = list(always_rejected)
+        self.requests = []
+        salesforce.on("POST", "composite", self.respond)
+
+    def respond(self, call, match):
+        self.requests.append(call.body["compositeRequest"])
+        results = []
+        for i, request in enumerate(call.body["compositeRequest"]):
+            if request["referenceId"] == "contact":
+                rejected = sorted(self.read_only & set(request["body"])) or self.always_rejected
+                if rejected:
+                    results.append({"httpStatusCode": 400, "referenceId": "contact", "body": read_only_error(*rejected)})
+                else:
+                    results.append({"httpStatusCode": 201, "referenceId": "contact", "body": {"id": CONTACT_ID, "success": True}})
+            else:
+                results.append({"httpStatusCode": 201, "referenceId": request["referenceId"], "body": {"id": f"00v{i:015d}"}})
+        return {"compositeResponse": results}
+
+
+@pytest.fixture()
+def sink(make_sink):
+    from target_salesforce_v3.sinks import ContactsSink
+
+    return make_sink("Contacts", ContactsSink)
+
+
+def contact(**body):
+    return {"method": "POST", "url": "/services/data/v55.0/sobjects/Contact", "referenceId": "contact", "body": body}
+
+
+def campaigns(count):
+    return [{"id": f"701{i:015d}"} for i in range(count)]
+
+
+def test_assignments_past_25_subrequests_reference_the_created_contact(salesforce, sink):
+    composite = Composite(salesforce)
+    assignments = sink.assignment_requests("@{contact.id}", campaigns(30), [])
+
+    id = sink.send_contact_requests(contact(LastName="Hopper"), None, assignments)
+
+    assert id == CONTACT_ID
+    first, second = composite.requests
+    assert len(first) == 25
+    assert first[0]["referenceId"] == "contact"
+    assert all(request["body"]["ContactId"] == "@{contact.id}" for request in first[1:])
+    assert len(second) == 6
+    assert all(request["body"]["ContactId"] == CONTACT_ID for request in second)
+
+
+def test_assignments_of_an_existing_contact_are_chunked_by_25(salesforce, sink):
+    composite = Composite(salesforce)
+    assignments = sink.assignment_requests(CONTACT_ID, campaigns(60), [])
+
+    sink.send_contact_requests(None, CONTACT_ID, assignments)
+
+    assert [len(requests) for requests in composite.requests] == [25, 25, 10]
+
+
+def test_read_only_fields_are_dropped_and_the_contact_sent_again(salesforce, sink):
+    composite = Composite(salesforce, read_only=["Title"])
+    assignments = sink.assignment_requests("@{contact.id}", campaigns(2), [])
+
+    id = sink.send_contact_requests(contact(LastName="Hopper", Title="Admiral"), None, assignments)
+
+    assert id == CONTACT_ID
+    first, second = composite.requests
+    assert first[0]["body"] == {"LastName": "Hopper", "Title": "Admiral"}
+    assert second[0]["body"] == {"LastName": "Hopper"}
+    assert len(second) == 3
+
+
+def test_the_read_only_retry_stops_when_no_field_is_removed(salesforce, sink):
+    composite = Composite(salesforce, always_rejected=["Title"])
+
+    with pytest.raises(Exception, match="INVALID_FIELD_FOR_INSERT_UPDATE"):
+        sink.send_contact_requests(contact(LastName="Hopper", Title="Admiral"), None, [])
+
+    assert [requests[0]["body"] for requests in composite.requests] == [
+        {"LastName": "Hopper", "Title": "Admiral"},
+        {"LastName": "Hopper"},
+    ]
@@ -0,0 +1,101 @@
+"""Tests for linking files written in batches to their objects."""
+
+from __future__ import annotations
+
+import pytest
+
+
+@pytest.fixture()
+def files(salesforce):
+    salesforce.add_object("ContentVersion", "Title", "PathOnClient", "FirstPublishLocationId", "ContentDocumentId")
+    salesforce.add_object("Account", "Name", "External_Id__c")
+
+    def query(call, match):
+        q = call.params["q"]
+        if q.startswith("SELECT Id, External_Id__c FROM Account"):
+            return {"done": True, "records": [{"Id": "001000000000009AAA", "External_Id__c": "acme"}]}
+        if q.startswith("SELECT Id, ContentDocumentId FROM ContentVersion"):
+            return {"done": True, "records": [
+                {"Id": f"068{i:012d}AAA", "ContentDocumentId": f"069{i:012d}AAA"} for i in range(10)
+            ]}
+        return {"done": True, "records": []}
+
+    def create(call, match):
+        if call.body["records"][0]["attributes"]["type"] == "ContentDocumentLink":
+            return [
+                {"success": False, "errors": [{"statusCode": "INSUFFICIENT_ACCESS", "message": "no access"}]}
+                if record["LinkedEntityId"] == "001000000000008AAA"
+                else {"success": True, "id": f"06A{i:015d}"}
+                for i, record in enumerate(call.body["records"])
+            ]
+        return [{"success": True, "id": f"068{i:012d}AAA"} for i, _ in enumerate(call.body["records"], 1)]
+
+    salesforce.on("GET", "query", query)
+    salesforce.on("POST", "composite/sobjects", create)
+    salesforce.on("PATCH", "composite/sobjects", lambda call, match: [
+        {"success": True, "id": record["Id"]} for record in call.body["records"]
+    ])
+    return salesforce
+
+
+def file(title, links, **fields):
+    return {"Title": title, "PathOnClient": f"{title}.pdf", "object_type": "ContentVersion", "LinkedEntityId": links, **fields}
+
+
+def links_sent(salesforce):
+    return [
+        (record["ContentDocumentId"], record["LinkedEntityId"])
+        for call in salesforce.endpoint_calls("POST", "composite/sobjects")
+        for record in call.body["records"]
+        if record["attributes"]["type"] == "ContentDocumentLink"
+    ]
+
+
+def test_new_files_with_one_link_are_published_there(files, make_sink, write_batch):
+    sink = make_sink("ContentVersion", write_mode="batch")
+
+    states = write_batch(sink, [
+        file("single", "001000000000001AAA"),
+        file("external", {"Account/External_Id__c": "acme"}),
+    ])
+
+    created = files.endpoint_calls("POST", "composite/sobjects")[0].body["records"]
+    assert [record["FirstPublishLocationId"] for record in created] == ["001000000000001AAA", "001000000000009AAA"]
+    assert all("LinkedEntityId" not in record for record in created)
+    assert links_sent(files) == []
+    assert [state["success"] for state in states] == [True, True]
+
+
+def test_other_links_are_inserted_in_one_batch_after_the_files(files, make_sink, write_batch):
+    sink = make_sink("ContentVersion", write_mode="batch")
+
+    states = write_batch(sink, [
+        file("shared", ["001000000000001AAA", "001000000000002AAA"]),
+        file("existing", "001000000000003AAA", Id="068000000000005AAA"),
+    ])
+
+    created = files.endpoint_calls("POST", "composite/sobjects")[0].body["records"]
+    assert [record["Title"] for record in created] == ["shared"]
+    assert "FirstPublishLocationId" not in created[0]
+    assert links_sent(files) == [
+        ("069000000000001AAA", "001000000000001AAA"),
+        ("069000000000001AAA", "001000000000002AAA"),
+        ("069000000000005AAA", "001000000000003AAA"),
+    ]
+    assert len(files.endpoint_calls("POST", "composite/sobjects")) == 2
+    assert [state["success"] for state in states] == [True, True]
+
+
+def test_failed_links_and_unknown_objects_fail_the_file(files, make_sink, write_batch):
+    sink = make_sink("ContentVersion", write_mode="batch")
+
+    states = write_batch(sink, [
+        file("denied", ["001000000000001AAA", "001000000000008AAA"]),
+        file("missing", [{"Account/External_Id__c": "nobody"}, "001000000000002AAA"]),
+    ])
+
+    assert states[0]["success"] is False
+    assert "INSUFFICIENT_ACCESS" in states[0]["error"]
+    assert states[1]["success"] is False
+    assert "Could not find matching records" in states[1]["error"]
+    assert ("069000000000002AAA", "001000000000002AAA") not in links_sent(files)
@@ -0,0 +1,156 @@
+"""Tests for creating the custom fields records carry."""
+
+from __future__ import annotations
+
+import re
+
+import pytest
+
+from tests.conftest import FakeResponse
+
+METADATA = "http://soap.sforce.com/2006/04/metadata"
+
+
+def soap_results(results):
+    """A createMetadata response with a result per `(success, message)`."""
+    body = "".join(
+        f"<result><success>{str(success).lower()}</success>"
+        + (f"<errors><message>{message}</message></errors>" if message else "")
+        + "</result>"
+        for success, message in results
+    )
+    response = FakeResponse(200)
+    response.content = (
+        '<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/">'
+        f'<soapenv:Body><createMetadataResponse xmlns="{METADATA}">{body}</createMetadataResponse>'
+        "</soapenv:Body></soapenv:Envelope>"
+    ).encode("utf-8")
+    return response
+
+
+class FakeMetadataApi:
+    """Answers the SOAP createMetadata calls sent through the target's session."""
+
+    def __init__(self, salesforce, limiter):
+        self.salesforce = salesforce
+        self.limiter = limiter
+        self.sent = []
+        self.messages = {}
+        # how many accounts had been written when each call was made
+        self.written_before = []
+
+    def request(self, method, url, **kwargs):
+        names = re.findall(r"<fullName>(.*?)</fullName>", kwargs["data"])
+        # the call holds a slot of the target's limiter
+        assert self.limiter.in_flight == 1
+        self.sent.append(names)
+        self.written_before.append(len(written_accounts(self.salesforce)))
+        return soap_results([(name not in self.messages, self.messages.get(name)) for name in names])
+
+
+def written_accounts(salesforce):
+    calls = salesforce.endpoint_calls("POST", "composite/sobjects") + salesforce.endpoint_calls("POST", "sobjects/Account")
+    return [call for call in calls if call.body.get("records", [call.body])[0].get("attributes", {}).get("type") != "FieldPermissions"]
+
+
+@pytest.fixture()
+def accounts(salesforce):
+    salesforce.add_object("Account", "Name", "Type")
+    salesforce.on("GET", "query", lambda call, match: {"done": True, "records": [{"Id": "0PS000000000001AAA"}]})
+    salesforce.on("POST", "composite/sobjects", lambda call, match: [
+        {"success": True, "id": f"001{i:015d}"} for i, _ in enumerate(call.body["records"])
+    ])
+    salesforce.on("POST", "sobjects/Account", lambda call, match: (201, {"success": True, "id": "001000000000001AAA"}))
+    return salesforce
+
+
+@pytest.fixture()
+def company_sink(accounts, make_sink, monkeypatch):
+    """Build a CompanySink creating custom fields, with the Metadata API faked."""
+    from target_salesforce_v3.sinks import CompanySink
+
+    def make(**config):
+        sink = make_sink("Companies", CompanySink, create_custom_fields=True, **config)
+        sink.metadata_api = FakeMetadataApi(accounts, sink._target.limiter)
+        monkeypatch.setattr(sink._target.session, "request", sink.metadata_api.request)
+        return sink
+
+    return make
+
+
+def company(name, *custom_fields):
+    return {"name": name, "custom_fields": [{"name": field, "value": "x"} for field in custom_fields]}
+
+
+def write_companies(sink, records):
+    """Preprocess and write records like the target does, in one batch."""
+    context = {}
+    for record in records:
+        sink.process_record(sink.preprocess_record(record, context), context)
+    sink.process_batch(context)
+    return sink.latest_state["bookmarks"][sink.name]
+
+
+def test_a_batch_creates_its_custom_fields_before_it_is_written(accounts, company_sink):
+    sink = company_sink(write_mode="batch")
+    fields = [f"Field{i}" for i in range(12)]
+
+    states = write_companies(sink, [company("a", *fields[:7]), company("b", *fields[5:])])
+
+    assert sink.metadata_api.sent == [
+        [f"Account.{field}__c" for field in fields[:10]],
+        [f"Account.{field}__c" for field in fields[10:]],
+    ]
+    assert sink.metadata_api.written_before == [0, 0]
+    assert len(written_accounts(accounts)) == 1
+    assert [state["success"] for state in states] == [True, True]
+
+
+def test_fields_salesforce_has_are_not_created_again(accounts, company_sink):
+    accounts.add_object("Account", "Name", "Type", "Tier__c")
+    sink = company_sink(write_mode="batch")
+
+    write_companies(sink, [company("a", "Tier", "Region")])
+
+    assert sink.metadata_api.sent == [["Account.Region__c"]]
+
+
+def test_record_mode_creates_the_fields_of_each_record(accounts, company_sink):
+    sink = company_sink(write_mode="record")
+
+    write_companies(sink, [company("a", "Tier"), company("b", "Region")])
+
+    assert sink.metadata_api.sent == [["Account.Tier__c"], ["Account.Region__c"]]
+    assert sink.metadata_api.written_before == [0, 1]
+
+
+def granted_fields(salesforce):
+    return [
+        record["Field"]
+        for call in salesforce.endpoint_calls("POST", "composite/sobjects")
+        for record in call.body["records"]
+        if record["attributes"]["type"] == "FieldPermissions"
+    ]
+
+
+def test_fields_that_already_exist_count_as_created(accounts, company_sink, caplog):
+    sink = company_sink(write_mode="batch")
+    sink.metadata_api.messages = {
+        "Account.Tier__c": "There is already a field named Tier on Account.",
+        "Account.Bad__c": "The API name can only contain underscores and alphanumeric characters.",
+    }
+
+    sink.add_custom_fields([("Tier", None), ("Region", "Sales region"), ("Bad", None)], "Account")
+
+    assert sink.metadata_api.sent == [["Account.Tier__c", "Account.Region__c", "Account.Bad__c"]]
+    assert granted_fields(accounts) == ["Account.Tier__c", "Account.Region__c"]
+    assert "Could not create custom field Account.Bad__c: The API name can only contain" in caplog.text
+
+
+def test_task_fields_are_created_on_activity(accounts, company_sink):
+    sink = company_sink(write_mode="batch")
+
+    sink.add_custom_fields([("Outcome", None)], "Task")
+
+    assert sink.metadata_api.sent == [["Activity.Outcome__c"]]
+    assert granted_fields(accounts) == ["Task.Outcome__c"]
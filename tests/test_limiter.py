@@ -0,0 +1,150 @@
+"""Tests for the adaptive limit on requests in flight."""
+
+from __future__ import annotations
+
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+
+import pytest
+
+from target_salesforce_v3 import limiter as limiter_module
+from target_salesforce_v3.limiter import AdaptiveLimiter, response_feedback, retry_after_seconds
+from tests.conftest import FakeResponse
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture()
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(limiter_module.time, "monotonic", clock)
+    return clock
+
+
+def send(limiter, **feedback):
+    assert limiter.try_acquire()
+    limiter.release(**feedback)
+
+
+def test_throttling_halves_the_limit_once_per_cooldown(clock):
+    limiter = AdaptiveLimiter(8)
+
+    send(limiter, throttled=True)
+    assert limiter.limit == 4
+    clock.now += 4.9
+    send(limiter, throttled=True)
+    assert limiter.limit == 4
+
+    clock.now += 0.1
+    send(limiter, throttled=True)
+    assert limiter.limit == 2
+    for _ in range(5):
+        clock.now += 5
+        send(limiter, throttled=True)
+    assert limiter.limit == 1
+
+
+def test_the_limit_grows_by_one_per_round_trip_while_latency_holds(clock):
+    limiter = AdaptiveLimiter(2, maximum=4)
+    limiter.limit = 2.0
+
+    send(limiter, latency=0.2)
+    send(limiter, latency=0.2)
+    assert limiter.limit == pytest.approx(2.9, abs=0.01)
+
+    for _ in range(20):
+        send(limiter, latency=0.2)
+    assert limiter.limit == 4
+
+
+def test_the_limit_stops_growing_when_latency_rises(clock):
+    limiter = AdaptiveLimiter(2, maximum=10)
+    for _ in range(10):
+        send(limiter, latency=0.2)
+    grown = limiter.limit
+
+    for _ in range(5):
+        send(limiter, latency=2.0)
+
+    assert limiter.latency > limiter.baseline_latency * limiter.tolerance
+    assert limiter.limit < grown + 1
+
+
+def test_in_flight_requests_are_capped_by_the_limit(clock):
+    limiter = AdaptiveLimiter(2)
+
+    assert limiter.try_acquire()
+    assert limiter.try_acquire()
+    assert not limiter.try_acquire()
+    limiter.release()
+    assert limiter.try_acquire()
+
+
+def http_date(seconds):
+    return format_datetime(datetime.now(timezone.utc) + timedelta(seconds=seconds), usegmt=True)
+
+
+@pytest.mark.parametrize("retry_after", [lambda: "10", lambda: http_date(10)])
+def test_retry_after_pauses_new_requests(clock, retry_after):
+    limiter = AdaptiveLimiter(4)
+    response = FakeResponse(429, [{"errorCode": "REQUEST_LIMIT_EXCEEDED"}], headers={"Retry-After": retry_after()})
+
+    assert limiter.try_acquire()
+    limiter.release(**response_feedback(response, 0.1))
+
+    assert limiter.limit == 2
+    assert not limiter.try_acquire()
+    # HTTP dates have whole seconds, so the pause may be up to a second shorter
+    clock.now += 8.5
+    assert not limiter.try_acquire()
+    clock.now += 2
+    assert limiter.try_acquire()
+
+
+def test_retry_after_is_read_in_seconds_or_as_an_http_date():
+    assert retry_after_seconds("120") == 120
+    assert 8 < retry_after_seconds(http_date(10)) <= 10
+    assert retry_after_seconds(http_date(-60)) == 0
+    assert retry_after_seconds("soon") is None
+    assert retry_after_seconds(None) is None
+
+
+def test_request_limit_exceeded_counts_as_throttling():
+    throttled = FakeResponse(403, [{"errorCode": "REQUEST_LIMIT_EXCEEDED"}])
+    forbidden = FakeResponse(403, [{"errorCode": "INSUFFICIENT_ACCESS"}])
+
+    assert response_feedback(throttled, 0.1)["throttled"]
+    assert not response_feedback(forbidden, 0.1)["throttled"]
+    assert response_feedback(FakeResponse(503), 0.1)["throttled"]
+
+
+def test_token_refreshes_hold_a_slot(make_target, monkeypatch):
+    target = make_target(
+        issued_at=0,
+        client_id="id",
+        client_secret="secret",
+        redirect_uri="https://example.com",
+        refresh_token="refresh",
+    )
+    in_flight = []
+
+    def post(method, url, **kwargs):
+        in_flight.append((method, url, target.limiter.in_flight))
+        return FakeResponse(200, {
+            "access_token": "token",
+            "instance_url": target.config["instance_url"],
+            "issued_at": str(int(datetime.now().timestamp() * 1000)),
+        })
+
+    monkeypatch.setattr(target.session, "request", post)
+
+    target.authenticator
+
+    assert in_flight == [("POST", "https://login.salesforce.com/services/oauth2/token", 1)]
+    assert target.limiter.in_flight == 0
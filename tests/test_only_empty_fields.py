@@ -0,0 +1,74 @@
+"""Tests for only filling the empty fields of existing records."""
+
+from __future__ import annotations
+
+import re
+
+import pytest
+
+CURRENT = {
+    "a00000000000001AAA": {"Id": "a00000000000001AAA", "Name": "Kept", "Code__c": None},
+    "a00000000000002AAA": {"Id": "a00000000000002AAA", "Name": None, "Code__c": "2"},
+    "a00000000000003AAA": {"Id": "a00000000000003AAA", "Name": "Kept", "Code__c": "3"},
+}
+
+
+@pytest.fixture()
+def widgets(salesforce):
+    salesforce.add_object("Widget__c", "Name", "Code__c")
+    salesforce.on("PATCH", "composite/sobjects", lambda call, match: [
+        {"success": True, "id": record["Id"]} for record in call.body["records"]
+    ])
+    return salesforce
+
+
+def query_current(fail_on=()):
+    """Answer Id IN queries with CURRENT, failing for batches and for the ids in `fail_on`."""
+
+    def query(call, match):
+        ids = re.findall(r"'(\w+)'", call.params["q"].split(" IN ")[1])
+        if len(ids) > 1 or set(ids) & set(fail_on):
+            return 400, [{"errorCode": "MALFORMED_QUERY", "message": "unexpected token"}]
+        return {"done": True, "records": [CURRENT[id] for id in ids if id in CURRENT]}
+
+    return query
+
+
+def widget(id, name, code):
+    return {"Id": id, "Name": name, "Code__c": code, "object_type": "Widget__c"}
+
+
+def test_a_failed_batch_query_falls_back_to_one_query_per_record(widgets, make_sink, write_batch):
+    widgets.on("GET", "query", query_current())
+    sink = make_sink(write_mode="batch", only_upsert_empty_fields=True)
+
+    write_batch(sink, [
+        widget("a00000000000001AAA", "New", "1"),
+        widget("a00000000000002AAA", "New", "New"),
+    ])
+
+    queries = [call.params["q"] for call in widgets.endpoint_calls("GET", "query")]
+    assert len(queries) == 3
+    assert "Id IN ('a00000000000001AAA','a00000000000002AAA')" in queries[0]
+    assert queries[1].endswith("WHERE Id IN ('a00000000000001AAA')")
+    sent = widgets.endpoint_calls("PATCH", "composite/sobjects")[0].body["records"]
+    assert [{k: v for k, v in record.items() if k != "attributes"} for record in sent] == [
+        {"Id": "a00000000000001AAA", "Code__c": "1"},
+        {"Id": "a00000000000002AAA", "Name": "New"},
+    ]
+
+
+def test_records_whose_own_query_fails_are_written_in_full(widgets, make_sink, write_batch):
+    widgets.on("GET", "query", query_current(fail_on=["a00000000000003AAA"]))
+    sink = make_sink(write_mode="batch", only_upsert_empty_fields=True)
+
+    write_batch(sink, [
+        widget("a00000000000001AAA", "New", "1"),
+        widget("a00000000000003AAA", "New", "New"),
+    ])
+
+    sent = widgets.endpoint_calls("PATCH", "composite/sobjects")[0].body["records"]
+    assert [{k: v for k, v in record.items() if k != "attributes"} for record in sent] == [
+        {"Id": "a00000000000001AAA", "Code__c": "1"},
+        {"Id": "a00000000000003AAA", "Name": "New", "Code__c": "New"},
+    ]
@@ -0,0 +1,98 @@
+"""Tests for mapping values to picklist options."""
+
+from __future__ import annotations
+
+import base64
+
+import pytest
+
+from target_salesforce_v3.cache import PicklistIndex, decode_valid_for
+
+
+def valid_for(*indexes):
+    """Encode controlling value indexes as a describe `validFor` bitmap."""
+    bits = bytearray(max(indexes) // 8 + 1)
+    for i in indexes:
+        bits[i >> 3] |= 0x80 >> (i & 7)
+    return base64.b64encode(bytes(bits)).decode()
+
+
+def option(label, value=None, **extra):
+    return {"label": label, "value": value or label, "active": True, **extra}
+
+
+COUNTRY = {
+    "name": "Country__c",
+    "type": "picklist",
+    "picklistValues": [option("United States", "US"), option("Canada", "CA"), option("Mexico", "MX")],
+}
+STATE = {
+    "name": "State__c",
+    "type": "picklist",
+    "dependentPicklist": True,
+    "controllerName": "Country__c",
+    "picklistValues": [
+        option("Texas", "TX", validFor=valid_for(0, 2)),
+        option("Ontario", "ON", validFor=valid_for(1)),
+        option("Quebec", "QC", validFor=valid_for(1)),
+        option("Retired", active=False, validFor=valid_for(0)),
+    ],
+}
+
+
+def test_valid_for_bits_are_read_from_the_high_bit_of_each_byte():
+    assert decode_valid_for("gA==") == {0}
+    assert decode_valid_for("oA==") == {0, 2}
+    assert decode_valid_for("AEA=") == {9}
+    assert decode_valid_for(valid_for(3, 8, 15)) == {3, 8, 15}
+
+
+def test_dependent_options_are_only_valid_for_their_controlling_values():
+    index = PicklistIndex.from_describe(STATE, COUNTRY)
+
+    assert index.labels == ["Texas", "Ontario", "Quebec"]
+    assert index.resolve("tx", "US") == "Texas"
+    assert index.resolve("Texas", "Mexico") == "Texas"
+    assert index.resolve("Texas", "CA") is None
+    assert index.resolve("on", "Canada") == "Ontario"
+    assert index.first("Canada") == "Ontario"
+    assert index.resolve("Ontario") == "Ontario"
+
+
+def test_boolean_controllers_use_false_and_true_as_indexes():
+    field = {**STATE, "controllerName": "Active__c", "picklistValues": [
+        option("Open", validFor=valid_for(1)),
+        option("Closed", validFor=valid_for(0)),
+    ]}
+
+    index = PicklistIndex.from_describe(field, {"name": "Active__c", "type": "boolean"})
+
+    assert index.resolve("Open", "true") == "Open"
+    assert index.resolve("Open", "false") is None
+
+
+@pytest.fixture()
+def sink(salesforce, make_sink):
+    from target_salesforce_v3.sinks import CompanySink
+
+    salesforce.add_object("Account", COUNTRY, STATE)
+    return make_sink("Companies", CompanySink)
+
+
+def test_values_map_to_the_canonical_label(sink):
+    assert sink.get_pickable("united-states", "Country__c") == "United States"
+    assert sink.get_pickable("Ontario", "State__c", controlling_value="CA") == "Ontario"
+    assert sink.get_pickable("Atlantis", "Country__c", default="Other") == "Other"
+    assert sink.get_pickable("Texas", "Missing__c", default="Other") == "Other"
+
+
+def test_select_first_uses_the_first_option_valid_for_the_controlling_value(sink):
+    assert sink.get_pickable("Atlantis", "Country__c", select_first=True) == "United States"
+    assert sink.get_pickable("Yukon", "State__c", select_first=True, controlling_value="Canada") == "Ontario"
+
+
+def test_select_first_falls_back_to_the_default_when_no_option_is_valid(sink, caplog):
+    label = sink.get_pickable("Yukon", "State__c", default="Other", select_first=True, controlling_value="Atlantis")
+
+    assert label == "Other"
+    assert "Using Other as State__c Yukon is not valid" in caplog.text
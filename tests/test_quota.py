@@ -0,0 +1,105 @@
+"""Tests for the daily API quota and call budgets."""
+
+from __future__ import annotations
+
+from target_salesforce_v3.quota import QuotaGovernor
+
+
+class LimitsSink:
+    """Answers the `/limits` call `QuotaGovernor.start` makes."""
+
+    def __init__(self, used, allotted):
+        self.limits = {"DailyApiRequests": {"Max": allotted, "Remaining": allotted - used}}
+        self.calls = 0
+
+    def request_api(self, http_method, endpoint=None, **kwargs):
+        self.calls += 1
+        limits = self.limits
+
+        class Response:
+            def json(self):
+                return limits
+
+        return Response()
+
+
+def make_calls(quota, stream, calls, records):
+    for _ in range(calls):
+        quota.observe(stream)
+    quota.record_written(stream, records)
+
+
+def test_calls_are_projected_from_the_calls_per_record_so_far():
+    quota = QuotaGovernor(run_budget=100)
+    make_calls(quota, "Contacts", 30, 10)
+
+    assert quota.calls_per_record("Contacts") == 3
+    assert quota.calls_per_record("Deals") == 1
+    assert quota.allows("Contacts", 23)
+    assert not quota.allows("Contacts", 24)
+    assert "about 72 API calls, but only 70 are left under the run budget of 100 calls" in quota.stop_reason("Contacts")
+
+
+def test_the_quota_threshold_comes_from_limits_and_response_headers():
+    quota = QuotaGovernor(quota_percent=80)
+    sink = LimitsSink(used=750, allotted=1000)
+
+    quota.start(sink)
+    quota.start(sink)
+
+    assert sink.calls == 1
+    assert quota.run_calls == 0
+    assert quota.allows("Contacts", 50)
+    quota.observe("Contacts", 790, 1000)
+    assert not quota.allows("Contacts", 11)
+    assert "80% of the daily API quota" in quota.stop_reason("Contacts")
+
+
+def test_a_stream_budget_only_stops_that_stream():
+    quota = QuotaGovernor(stream_budgets={"Contacts": 10})
+    make_calls(quota, "Contacts", 8, 8)
+
+    assert not quota.allows("Contacts", 3)
+    assert quota.stop_reason("Contacts").startswith("Stopping Contacts:")
+    assert quota.stop_reason("Deals") is None
+    assert quota.allows("Deals", 1000)
+
+
+def test_the_run_budget_stops_every_stream():
+    quota = QuotaGovernor(run_budget=10, stream_budgets={"Contacts": 100})
+    make_calls(quota, "Contacts", 8, 8)
+
+    assert not quota.allows("Contacts", 3)
+    assert quota.stop_reason("Contacts").startswith("Stopping the run:")
+    assert quota.stop_reason("Deals") == quota.stop_reason("Contacts")
+    assert not quota.allows("Deals", 1)
+
+
+def test_a_stopped_stream_stays_stopped():
+    quota = QuotaGovernor(stream_budgets={"Contacts": 5})
+    make_calls(quota, "Contacts", 5, 5)
+    assert not quota.allows("Contacts", 1)
+
+    # a smaller batch would fit the projection, but the stream already stopped
+    quota.stream_budgets["Contacts"] = 100
+    assert not quota.allows("Contacts", 1)
+
+
+def test_no_limits_allow_everything():
+    quota = QuotaGovernor()
+    make_calls(quota, "Contacts", 100, 1)
+
+    assert quota.allows("Contacts", 1000000)
+
+
+def test_records_stopped_by_the_quota_keep_their_external_id(salesforce, make_sink):
+    salesforce.add_object("Widget__c", "Name")
+    sink = make_sink(write_mode="record", stream_api_budgets={"Widgets": 0})
+
+    sink.process_record({"Name": "a", "object_type": "Widget__c", "externalId": "src-1"}, {})
+
+    state = sink.latest_state["bookmarks"][sink.name][0]
+    assert state["externalId"] == "src-1"
+    assert state["success"] is False
+    assert state["error"].startswith("Stopping Widgets:")
+    assert not [call for call in salesforce.calls if call.method != "GET"]
@@ -0,0 +1,181 @@
+"""Tests for the shared name to Id indexes of referenced objects."""
+
+from __future__ import annotations
+
+import re
+import threading
+import time
+
+import pytest
+
+PAGE_SIZE = 2
+
+
+class Table:
+    """Rows of one sObject answering the SOQL a ReferenceIndex sends.
+
+    Rows are kept newest first, so only an ``ORDER BY CreatedDate ASC``
+    returns the oldest row of a name first. Results are paged by PAGE_SIZE.
+    """
+
+    def __init__(self, salesforce, object_type, rows):
+        self.object_type = object_type
+        self.rows = [
+            {"Id": id, "Name": name, "CreatedDate": f"2026-01-{day:02d}T00:00:00.000+0000"}
+            for id, name, day in rows
+        ]
+        self.rows.sort(key=lambda row: row["CreatedDate"], reverse=True)
+        self.queries = []
+        self.pages = {}
+        salesforce.on("GET", "query", self.query)
+        salesforce.on("GET", r"query/(\w+)", lambda call, match: self.pages.pop(match.group(1)))
+
+    def query(self, call, match):
+        query = call.params["q"]
+        self.queries.append(query)
+        if query == f"SELECT COUNT() FROM {self.object_type}":
+            return {"totalSize": len(self.rows), "done": True, "records": []}
+        rows = self.rows
+        names = re.search(r"WHERE Name IN \((.*?)\)", query)
+        if names:
+            # SOQL compares strings regardless of case
+            names = [name.casefold() for name in re.findall(r"'((?:[^'\\]|\\.)*)'", names.group(1))]
+            rows = [row for row in rows if row["Name"].casefold() in names]
+        if query.endswith("ORDER BY CreatedDate ASC"):
+            rows = sorted(rows, key=lambda row: row["CreatedDate"])
+        return self.page(rows)
+
+    def page(self, rows):
+        response = {"done": len(rows) <= PAGE_SIZE, "records": rows[:PAGE_SIZE]}
+        if rows[PAGE_SIZE:]:
+            next_page = self.page(rows[PAGE_SIZE:])
+            locator = f"01g{len(self.pages)}"
+            self.pages[locator] = next_page
+            response["nextRecordsUrl"] = f"/services/data/v55.0/query/{locator}"
+        return response
+
+    def add(self, id, name):
+        self.rows.insert(0, {"Id": id, "Name": name, "CreatedDate": "2026-12-31T00:00:00.000+0000"})
+
+
+ACCOUNTS = [
+    ("001000000000001AAA", "Acme", 1),
+    ("001000000000002AAA", "Globex", 2),
+    ("001000000000003AAA", "Initech", 3),
+    ("001000000000004AAA", "Umbrella", 4),
+    ("001000000000005AAA", "Hooli", 5),
+]
+
+
+@pytest.fixture()
+def accounts(salesforce):
+    return Table(salesforce, "Account", ACCOUNTS)
+
+
+def test_small_objects_are_preloaded_across_every_page(accounts, make_sink):
+    sink = make_sink()
+
+    ids = sink.reference_index("Account").resolve(sink, ["Acme", "Hooli", "Nobody"])
+
+    assert ids == {"Acme": "001000000000001AAA", "Hooli": "001000000000005AAA", "Nobody": None}
+    assert accounts.queries == [
+        "SELECT COUNT() FROM Account",
+        "SELECT Id, Name FROM Account ORDER BY CreatedDate ASC",
+    ]
+    # every result page was followed
+    assert not accounts.pages
+    assert sink.reference_id("Account", "Umbrella") == "001000000000004AAA"
+    assert len(accounts.queries) == 2
+
+
+def test_large_objects_are_resolved_with_in_queries(accounts, make_sink):
+    sink = make_sink(reference_preload_limit=3)
+    index = sink.reference_index("Account")
+
+    assert index.resolve(sink, ["Acme", "Initech"]) == {"Acme": "001000000000001AAA", "Initech": "001000000000003AAA"}
+    assert index.resolve(sink, ["Acme", "Hooli"]) == {"Acme": "001000000000001AAA", "Hooli": "001000000000005AAA"}
+
+    assert accounts.queries == [
+        "SELECT COUNT() FROM Account",
+        "SELECT Id, Name FROM Account WHERE Name IN ('Acme','Initech') ORDER BY CreatedDate ASC",
+        "SELECT Id, Name FROM Account WHERE Name IN ('Hooli') ORDER BY CreatedDate ASC",
+    ]
+    assert index.preloaded is False
+
+
+def test_the_index_is_shared_by_the_sinks_of_a_target(accounts, make_sink):
+    from target_salesforce_v3.sinks import ContactsSink, DealsSink
+
+    sink = make_sink("Contacts", ContactsSink, reference_case_insensitive=True)
+    other = DealsSink(target=sink._target, stream_name="Deals", schema={"properties": {}}, key_properties=None)
+
+    assert sink.reference_id("Account", "ACME") == "001000000000001AAA"
+    assert other.reference_id("Account", "globex") == "001000000000002AAA"
+    assert other.reference_index("Account") is sink.reference_index("Account")
+    assert accounts.queries.count("SELECT COUNT() FROM Account") == 1
+
+
+@pytest.mark.parametrize("preload_limit", [50000, 0])
+def test_the_oldest_row_of_a_name_wins(salesforce, make_sink, preload_limit):
+    Table(salesforce, "Campaign", [
+        ("701000000000003AAA", "Spring Launch", 3),
+        ("701000000000001AAA", "Spring Launch", 1),
+        ("701000000000002AAA", "spring launch", 2),
+    ])
+    sink = make_sink(reference_preload_limit=preload_limit)
+
+    assert sink.reference_id("Campaign", "Spring Launch") == "701000000000001AAA"
+    assert sink.reference_id("Campaign", "spring launch") == "701000000000002AAA"
+
+
+def test_case_insensitive_names_take_the_oldest_row_of_any_case(salesforce, make_sink):
+    Table(salesforce, "Campaign", [
+        ("701000000000002AAA", "spring launch", 2),
+        ("701000000000003AAA", "Spring Launch", 3),
+    ])
+    sink = make_sink()
+    index = sink.reference_index("Campaign", case_insensitive=True, preload=False)
+
+    assert index.resolve(sink, ["Spring Launch", "SPRING LAUNCH"]) == {
+        "Spring Launch": "701000000000002AAA",
+        "SPRING LAUNCH": "701000000000002AAA",
+    }
+
+
+def test_concurrent_callers_create_a_name_once(salesforce, make_sink):
+    campaigns = Table(salesforce, "Campaign", [])
+    sink = make_sink()
+    index = sink.reference_index("Campaign", case_insensitive=True, preload=False)
+    created = []
+
+    def create(name):
+        time.sleep(0.02)
+        created.append(name)
+        campaigns.add(f"70100000000000{len(created)}AAA", name)
+        return f"70100000000000{len(created)}AAA"
+
+    ids = []
+    threads = [
+        threading.Thread(target=lambda name=name: ids.append(index.get_or_create(sink, name, create)))
+        for name in ["Spring Launch", "spring launch", "SPRING LAUNCH"] * 3
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert created == ["Spring Launch"]
+    assert set(ids) == {"701000000000001AAA"}
+
+
+def test_preloaded_indexes_check_for_rows_created_since(accounts, make_sink):
+    sink = make_sink()
+    index = sink.reference_index("Account")
+    index.resolve(sink, ["Acme"])
+    # created by another process after the preload
+    accounts.add("001000000000006AAA", "Vandelay")
+
+    id = index.get_or_create(sink, "Vandelay", lambda name: pytest.fail("created again"))
+
+    assert id == "001000000000006AAA"
+    assert accounts.queries[-1] == "SELECT Id, Name FROM Account WHERE Name IN ('Vandelay') ORDER BY CreatedDate ASC"
@@ -0,0 +1,122 @@
+"""Connection reuse benchmark for the pooled session."""
+
+from __future__ import annotations
+
+import gzip
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+REQUEST_COUNT = 50
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Answers every request with an empty JSON body and counts new connections."""
+
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    connections = 0
+    bodies = []
+    lock = threading.Lock()
+
+    def setup(self):
+        super().setup()
+        with StubHandler.lock:
+            StubHandler.connections += 1
+
+    def do_GET(self):
+        body = b"{}"
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        StubHandler.bodies.append((self.headers.get("Content-Encoding"), body))
+        self.do_GET()
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture()
+def stub_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    StubHandler.connections = 0
+    StubHandler.bodies = []
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture()
+def stub_target(make_target, stub_server):
+    """Build a target whose sinks send their requests to the stub server."""
+    from target_salesforce_v3.sinks import FallbackSink
+
+    def make(**config):
+        target = make_target(instance_url=stub_server, **config)
+
+        def new_sink(stream="Widgets"):
+            return FallbackSink(target=target, stream_name=stream, schema={"properties": {}}, key_properties=None)
+
+        return target, new_sink
+
+    return make
+
+
+def test_a_session_without_pooling_opens_a_connection_per_call(stub_target):
+    target, new_sink = stub_target(connection_pool_size=1)
+    sink = new_sink()
+    # what every call cost before the session was shared
+    for _ in range(REQUEST_COUNT):
+        target.session.close()
+        sink._request("GET", "sobjects/")
+
+    assert StubHandler.connections == REQUEST_COUNT
+
+
+def test_sink_requests_reuse_the_targets_connection(stub_target):
+    _, new_sink = stub_target()
+    sink = new_sink()
+    for _ in range(REQUEST_COUNT):
+        sink._request("GET", "sobjects/")
+
+    assert StubHandler.connections == 1
+
+
+def test_parallel_sinks_are_bounded_by_the_pool_size(stub_target):
+    pool_size = 4
+    _, new_sink = stub_target(connection_pool_size=pool_size)
+    sinks = [new_sink(f"Widgets{i}") for i in range(pool_size)]
+
+    def worker(sink):
+        for _ in range(REQUEST_COUNT // pool_size):
+            sink._request("GET", "sobjects/")
+
+    threads = [threading.Thread(target=worker, args=(sink,)) for sink in sinks]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert StubHandler.connections <= pool_size
+
+
+def test_request_bodies_are_only_compressed_when_configured(stub_target):
+    _, new_sink = stub_target()
+    new_sink()._request("POST", "composite/sobjects", request_data={"records": []})
+    _, new_sink = stub_target(gzip_requests=True)
+    new_sink()._request("POST", "composite/sobjects", request_data={"records": []})
+
+    (plain_encoding, plain), (gzip_encoding, compressed) = StubHandler.bodies
+    assert plain_encoding is None
+    assert json.loads(plain) == {"records": []}
+    assert gzip_encoding == "gzip"
+    assert json.loads(gzip.decompress(compressed)) == {"records": []}
@@ -0,0 +1,106 @@
+"""Tests for skipping records whose payload Salesforce already has."""
+
+from __future__ import annotations
+
+import pytest
+
+
+@pytest.fixture()
+def widgets(salesforce):
+    salesforce.add_object("Widget__c", "Name", "Code__c")
+    ids = iter(range(100))
+    salesforce.on("POST", "composite/sobjects", lambda call, match: [
+        {"success": True, "id": f"a00{next(ids):015d}"} for _ in call.body["records"]
+    ])
+    salesforce.on("POST", "sobjects/Widget__c", lambda call, match: (201, {"success": True, "id": f"a00{next(ids):015d}"}))
+    # records written before are updated by their stored Id
+    salesforce.on("PATCH", "composite/sobjects", lambda call, match: [
+        {"success": True, "id": record["Id"]} for record in call.body["records"]
+    ])
+    salesforce.on("PATCH", r"sobjects/Widget__c/(\w+)", lambda call, match: (204, None))
+    return salesforce
+
+
+def widget(name, source_id, **fields):
+    return {"Name": name, "object_type": "Widget__c", "externalId": source_id, **fields}
+
+
+def written_names(salesforce):
+    names = []
+    for call in salesforce.calls:
+        if call.method in ["POST", "PATCH"] and call.endpoint == "composite/sobjects":
+            names += [record["Name"] for record in call.body["records"]]
+        elif call.method in ["POST", "PATCH"] and call.endpoint.startswith("sobjects/Widget__c"):
+            names.append(call.body["Name"])
+    return names
+
+
+@pytest.mark.parametrize("write_mode", ["batch", "record"])
+def test_hash_mode_skips_records_written_by_an_earlier_run(widgets, make_sink, write_batch, tmp_path, write_mode):
+    config = {"write_mode": write_mode, "skip_unchanged": "hash", "state_store_path": str(tmp_path / "state.db")}
+    first = write_batch(make_sink(**config), [widget("a", "src-1"), widget("b", "src-2")])
+    widgets.calls.clear()
+
+    sink = make_sink(**config)
+    states = write_batch(sink, [widget("a", "src-1"), widget("b changed", "src-2")])
+
+    assert written_names(widgets) == ["b changed"]
+    assert states[0] == {**first[0], "unchanged": True}
+    assert states[1]["success"] and "unchanged" not in states[1]
+    assert sink.latest_state["summary"][sink.name]["unchanged"] == 1
+
+
+def test_hash_mode_writes_files_whose_links_changed(salesforce, make_sink, write_batch, tmp_path):
+    salesforce.add_object("ContentVersion", "Title", "PathOnClient", "FirstPublishLocationId")
+    salesforce.on("POST", "sobjects/ContentVersion", lambda call, match: (201, {"success": True, "id": "068000000000001AAA"}))
+    salesforce.on("PATCH", r"sobjects/ContentVersion/(\w+)", lambda call, match: (204, None))
+    config = {"write_mode": "record", "skip_unchanged": "hash", "state_store_path": str(tmp_path / "state.db")}
+    file = {"Title": "Report", "PathOnClient": "report.pdf", "object_type": "ContentVersion", "externalId": "file-1"}
+
+    write_batch(make_sink("ContentVersion", **config), [{**file, "LinkedEntityId": "001000000000001AAA"}])
+    states = write_batch(make_sink("ContentVersion", **config), [{**file, "LinkedEntityId": "001000000000002AAA"}])
+
+    writes = [call for call in salesforce.calls if call.method != "GET" and call.endpoint.startswith("sobjects/ContentVersion")]
+    assert len(writes) == 2
+    assert writes[0].body["FirstPublishLocationId"] == "001000000000001AAA"
+    assert states[0]["success"] and "unchanged" not in states[0]
+
+
+def test_snapshot_mode_compares_with_the_current_values(widgets, make_sink, write_batch):
+    widgets.on("GET", "query", lambda call, match: {"done": True, "records": [
+        {"Id": "a00000000000001AAA", "Name": "same", "Code__c": "1"},
+        {"Id": "a00000000000002AAA", "Name": "old", "Code__c": "2"},
+    ]})
+    sink = make_sink(write_mode="batch", skip_unchanged="snapshot")
+
+    states = write_batch(sink, [
+        {"Id": "a00000000000001AAA", "Name": "same", "Code__c": 1, "object_type": "Widget__c"},
+        {"Id": "a00000000000002AAA", "Name": "new", "Code__c": "2", "object_type": "Widget__c"},
+    ])
+
+    query = widgets.endpoint_calls("GET", "query")[0].params["q"]
+    assert query.startswith("SELECT Id, Name, Code__c FROM Widget__c WHERE Id IN (")
+    updates = widgets.endpoint_calls("PATCH", "composite/sobjects")
+    assert [record["Id"] for record in updates[0].body["records"]] == ["a00000000000002AAA"]
+    assert states[0] == {"hash": states[0]["hash"], "success": True, "id": "a00000000000001AAA", "unchanged": True}
+    assert states[1]["success"] and "unchanged" not in states[1]
+
+
+def test_snapshot_mode_writes_records_with_follow_up_calls(salesforce, make_sink, write_batch):
+    salesforce.add_object("ContentVersion", "Title")
+    salesforce.on("GET", "query", lambda call, match: {"done": True, "records": [
+        {"Id": "068000000000001AAA", "Title": "Report"},
+    ]})
+    salesforce.on("PATCH", "sobjects/ContentVersion/068000000000001AAA", lambda call, match: (204, None))
+    salesforce.on("POST", "composite/sobjects", lambda call, match: [{"success": True, "id": "06A000000000001AAA"}])
+    sink = make_sink("ContentVersion", write_mode="record", skip_unchanged="snapshot")
+
+    states = write_batch(sink, [{
+        "Id": "068000000000001AAA",
+        "Title": "Report",
+        "object_type": "ContentVersion",
+        "LinkedEntityId": "001000000000001AAA",
+    }])
+
+    assert len(salesforce.endpoint_calls("PATCH", "sobjects/ContentVersion/068000000000001AAA")) == 1
+    assert "unchanged" not in states[0]
@@ -0,0 +1,96 @@
+"""Tests for the SQLite store of written record ids and payload hashes."""
+
+from __future__ import annotations
+
+import pytest
+
+from target_salesforce_v3.state_store import PayloadStateStore
+
+KEY = ("Account", "externalId", "c-1")
+
+
+def test_rows_persist_across_reopens(tmp_path):
+    path = str(tmp_path / "state.db")
+    store = PayloadStateStore(path)
+    store[KEY] = ("001000000000001AAA", "hash-1")
+    store.commit()
+
+    reopened = PayloadStateStore(path)
+    assert reopened.get(KEY) == ("001000000000001AAA", "hash-1")
+    assert reopened.get(("Account", "externalId", "c-2")) is None
+
+    reopened[KEY] = ("001000000000002AAA", "hash-2")
+    del reopened[("Account", "externalId", "c-2")]
+    reopened.commit()
+    assert PayloadStateStore(path).get(KEY) == ("001000000000002AAA", "hash-2")
+
+
+def test_uncommitted_rows_are_not_kept(tmp_path):
+    path = str(tmp_path / "state.db")
+    PayloadStateStore(path)[KEY] = ("001000000000001AAA", "hash-1")
+
+    assert PayloadStateStore(path).get(KEY) is None
+
+
+def test_deleted_rows_are_gone_after_reopening(tmp_path):
+    path = str(tmp_path / "state.db")
+    store = PayloadStateStore(path)
+    store[KEY] = ("001000000000001AAA", "hash-1")
+    store.commit()
+
+    del store[KEY]
+    store.commit()
+
+    assert PayloadStateStore(path).get(KEY) is None
+
+
+@pytest.fixture()
+def accounts(salesforce):
+    salesforce.add_object("Account", "Name")
+    ids = iter(range(1, 100))
+    salesforce.on("POST", "sobjects/Account", lambda call, match: (201, {"success": True, "id": f"001{next(ids):015d}"}))
+    salesforce.on("POST", "composite/sobjects", lambda call, match: [
+        {"success": True, "id": f"001{next(ids):015d}"} for _ in call.body["records"]
+    ])
+    return salesforce
+
+
+@pytest.mark.parametrize("write_mode", ["batch", "record"])
+def test_stored_ids_are_used_by_the_next_run(accounts, make_sink, write_batch, tmp_path, write_mode):
+    from target_salesforce_v3.sinks import CompanySink
+
+    config = {"write_mode": write_mode, "state_store_path": str(tmp_path / "state.db")}
+    first = write_batch(make_sink("Companies", CompanySink, **config), [{"Name": "Acme", "externalId": "c-1"}])
+    accounts.on("PATCH", r"sobjects/Account/(\w+)", lambda call, match: (204, None))
+    accounts.on("PATCH", "composite/sobjects", lambda call, match: [
+        {"success": True, "id": record["Id"]} for record in call.body["records"]
+    ])
+    accounts.calls.clear()
+
+    states = write_batch(make_sink("Companies", CompanySink, **config), [{"Name": "Acme Inc", "externalId": "c-1"}])
+
+    assert [call.method for call in accounts.calls if call.method != "GET"] == ["PATCH"]
+    assert states[0]["id"] == first[0]["id"]
+    assert states[0]["externalId"] == "c-1"
+
+
+@pytest.mark.parametrize("error", ["NOT_FOUND", "ENTITY_IS_DELETED"])
+@pytest.mark.parametrize("write_mode", ["batch", "record"])
+def test_deleted_records_are_written_again(accounts, make_sink, write_batch, tmp_path, write_mode, error):
+    from target_salesforce_v3.sinks import CompanySink
+
+    path = str(tmp_path / "state.db")
+    store = PayloadStateStore(path)
+    store[KEY] = ("001000000000000AAA", "old hash")
+    store.commit()
+    accounts.on("PATCH", r"sobjects/Account/(\w+)", lambda call, match: (404, [{"errorCode": error, "message": "deleted"}]))
+    accounts.on("PATCH", "composite/sobjects", lambda call, match: [
+        {"success": False, "errors": [{"statusCode": error, "message": "deleted"}]} for _ in call.body["records"]
+    ])
+    sink = make_sink("Companies", CompanySink, write_mode=write_mode, state_store_path=path)
+
+    states = write_batch(sink, [{"Name": "Acme", "externalId": "c-1"}])
+
+    assert [call.method for call in accounts.calls if call.method != "GET"][-1] == "POST"
+    assert states == [{"hash": states[0]["hash"], "externalId": "c-1", "success": True, "id": "001000000000000001"}]
+    assert PayloadStateStore(path).get(KEY)[0] == "001000000000000001"